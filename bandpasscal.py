@@ -4,8 +4,8 @@ import globals
 import random
 import flagging
 from bootflux import getCatalogFlux
-from threading import Thread
 import calculations
+import gproutines
 
 
 """
@@ -14,16 +14,6 @@ Part of the CARMA data reduction pipeline
 Author: D. N. Friedel
 """
 
-class bandpassThread(Thread) :
-    def __init__(self,objects,refant,window) :
-        Thread.__init__(self)
-        self.objects = objects
-        self.objects = objects
-        self.refant = refant
-        self.window = window
-    def run(self) :
-        bandpass(self.objects,self.refant,self.window)
-
 def bandpass(objects,refant,window) :
     """ Method to apply bandpasses, works for both wideband and narrowband windows
         input :
@@ -303,6 +293,8 @@ def bandpass(objects,refant,window) :
         args.append(globals.Variable("refant",str(refant)))
         args.append(globals.Variable("tol","0.001"))
         sys = log.run("mfcal",args,logit=False)
+        # mfcal rewrote the gains and bandpass in place, so they must be read again
+        gproutines.invalidateTables(pcfile + pcend)
 
         if(sys != 0) :
             return
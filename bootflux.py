@@ -5,6 +5,8 @@ import logger as log
 from pipeline_miriadwrap import *
 import calflux
 import math
+import os
+import scheduler
 try :
     import preferences as p
 except ImportError:
@@ -23,265 +25,186 @@ Author: D. N. Friedel
 
 averagingTime = p.preferences.get("bootfluxInterval")
 
-def runBootflux(project,gaincal, fluxcal, obsDate, obsFreq=95.0) :
-    """ Method to calculate the flux of the gain calibrator(s)
-        by bootstrapping from flux calibrator(s) or by looking up
-        the flux in FluxSource.cat as a fallback
+class BootfluxJob :
+    """
+    Class to hold one run of bootflux, on a sideband or window of a gain calibrator
+    """
+    def __init__(self,gaincal,fluxcal,ending,numChans,mflux=None) :
+        """ Initializer
+            gaincal - the gain calibrator
+            fluxcal - the flux calibrator
+            ending - the ending of the file names (.LSB, .USB or .w#)
+            numChans - the number of channels to use
+            mflux - the flux of fluxcal if it is not a planet, None for a planet
+        """
+        self.gaincal = gaincal
+        self.ending = ending
+        self.logFile = "boot.%s%s.log" % (gaincal._file,ending)
+        self.files = [gaincal._file + ending,fluxcal._file + ending]
+        args = []
+        args.append(globals.Variable("vis",gaincal._file,ending))
+        args.append(globals.Variable("ADD",fluxcal._file,ending))
+        args.append(globals.Variable("primary",fluxcal._name))
+        if(mflux != None) :
+            args.append(globals.Variable("ADD",str(mflux)))
+        args.append(globals.Variable("line","channel,1,1,%i" % (numChans)))
+        args.append(globals.Variable("taver",str(averagingTime)))
+        args.append(globals.Variable("log",self.logFile))
+        self.commandLine,self.logLine = log.commandLines("bootflux",args)
+        self.status = None
+
+    def label(self) :
+        """ Method to get a description of the data the job is run on
+            input :
+                none
+            returns :
+                the description
+        """
+        if(self.ending.startswith(".w")) :
+            return "window %s" % (self.ending[2:])
+        return "the %s" % (self.ending[1:])
+
+    def run(self) :
+        """ Method to run bootflux, nothing is logged so jobs can run at the same time
+            input :
+                none
+            returns :
+                none
+        """
+        self.status = os.system(self.commandLine)
+
+    def finish(self,fluxes,rms) :
+        """ Method to log the job and read the flux from its log
+            input :
+                fluxes - a list to hold the fluxes
+                rms - a list to hold their rms uncertainties
+            returns :
+                none
+        """
+        log.report(self.status,self.commandLine,self.logLine)
+        if(self.status == 0 and getFlux(self.logFile,fluxes,rms)) :
+            log.writeComment("Bootflux got a flux of %f for %s of %s\n" % (fluxes[-1],self.label(),self.gaincal._name))
+        else :
+            fluxes.append(0.0)
+            rms.append(0.0)
+
+def bootfluxJobs(gaincal, fluxcal, obsDate, obsFreq) :
+    """ Method to set up the bootflux runs of a gain calibrator, one for each sideband or window
         input :
             gaincal - the gain calibrator
-            fluxcal -the flux calibrator
+            fluxcal - the flux calibrator
             obsDate - observation date
             obsFreq - observation frequency in GHz
         returns :
-            the flux of gaincal in Jy
+            the flux of fluxcal (None for a planet) and the list of BootfluxJobs, the list is None if
+            no bootflux is needed (the flux is then the flux of gaincal)
     """
-    global averagingTime
-    fluxes = []
-    rms = []
-
     log.writeComment("Using %s as flux calibrator" % (fluxcal._name))
+    mflux = None
     # prefer a planet for bootflux
     # it is done one window at a time and then averaged to get flux
     if(fluxcal._type == sources.PLANET) :
-        # only rely on super windwos if we have them
-        if(fluxcal.haveSuper()) :
-            if(gaincal._lsbGood) :
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".LSB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".LSB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.LSB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.LSB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the LSB of %s\n" % (fluxes[0],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            if(gaincal._usbGood) :
-                indx = 1
-                if(globals.isSci2 and globals.obsFreq() > 50.0) :
-                    indx = 0
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".USB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".USB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.USB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.USB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the USB of %s\n" % (fluxes[indx],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-            if(flux != 0.0) :
-                fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"WB",obsDate,fluxcal._name)
-        else :
-            for window in range(1, len(gaincal._bandwidths) + 1):
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".w%i" % (window)))
-                args.append(globals.Variable("ADD",fluxcal._file,".w%i" % (window)))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("line","channel,1,1,%i" % (gaincal._numChans[window - 1])))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.w%i.log" % (gaincal._file,window)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.w%i.log" % (gaincal._file,window),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for window %i of %s\n" % (fluxes[window - 1], window,gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-        if(flux == 0.0) :
-            log.writeComment("Obtaining flux from catalog.")
-            return getCatalogFlux(gaincal._name, obsDate, obsFreq)
-        else :
-            pass
-            #fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"NB",obsDate,fluxcal._name)
-        return flux
+        pass
     # if we do not have a planet then using MWC349 (if present), since is 1.0 Jy at 3mm and 1mm
     elif(fluxcal._name == "MWC349") :
         mflux = 1.0
         if(obsFreq > 120.0) :
             mflux = 1.8
         log.writeComment("Assuming a flux of %f for MWC349" % (mflux))
-        if(fluxcal.haveSuper()) :
-            if(gaincal._lsbGood) :
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".LSB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".LSB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.LSB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.LSB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the LSB of %s\n" % (fluxes[0],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            if(gaincal._usbGood) :
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".USB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".USB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.USB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.USB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the USB of %s\n" % (fluxes[0],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-            if(flux != 0.0) :
-                fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"WB",obsDate,fluxcal._name + "(" + str(mflux) + ")")
-        else :
-            for window in range(1, len(gaincal._bandwidths) + 1):
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".w%i" % (window)))
-                args.append(globals.Variable("ADD",fluxcal._file,"w%i" % (window)))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (gaincal._numChans[window - 1])))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.w%i.log" % (gaincal._file,window)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.w%i.log" % (gaincal._file,window),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for window %i of %s\n" % (fluxes[1],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-            if(flux == 0.0) :
-                log.writeComment("Obtaining flux from catalog.")
-                return getCatalogFlux(gaincal._name, obsDate, obsFreq)
-            else :
-                pass
-                #fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"NB",obsDate,fluxcal._name + "(" + str(mflux) + ")")
-        return flux
     else :
         # use a gain calibrator as last resort
         log.writeComment("Obtaining flux for %s from catalog." % (fluxcal._name))
         mflux = getCatalogFlux(fluxcal._name, obsDate, obsFreq)
         if(gaincal._name == fluxcal._name) :
-            return mflux
-        if(fluxcal.haveSuper()) :
-            if(gaincal._lsbGood) :
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".LSB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".LSB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.LSB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
-
-                if(sys == 0) :
-                    if(getFlux("boot.%s.LSB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the LSB of %s\n" % (fluxes[0],gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            if(gaincal._usbGood) :
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".USB"))
-                args.append(globals.Variable("ADD",fluxcal._file,".USB"))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (fluxcal.getSuperNumChans())))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.USB.log" % (gaincal._file)))
-                sys = log.run("bootflux",args)
+            return mflux,None
+    jobs = []
+    # only rely on super windows if we have them
+    if(fluxcal.haveSuper()) :
+        if(gaincal._lsbGood) :
+            jobs.append(BootfluxJob(gaincal,fluxcal,".LSB",fluxcal.getSuperNumChans(),mflux))
+        if(gaincal._usbGood) :
+            jobs.append(BootfluxJob(gaincal,fluxcal,".USB",fluxcal.getSuperNumChans(),mflux))
+    else :
+        for window in range(1, len(gaincal._bandwidths) + 1):
+            jobs.append(BootfluxJob(gaincal,fluxcal,".w%i" % (window),gaincal._numChans[window - 1],mflux))
+    return mflux,jobs
 
-                if(sys == 0) :
-                    if(getFlux("boot.%s.USB.log" % (gaincal._file),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for the USB of %s\n" % (fluxes[1] ,gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
+def bootfluxResult(project, gaincal, fluxcal, mflux, jobs, obsDate, obsFreq) :
+    """ Method to combine the bootflux runs of a gain calibrator into its flux, falling back to the
+        catalog if bootflux failed
+        input :
+            project - the project name, for the flux log
+            gaincal - the gain calibrator
+            fluxcal - the flux calibrator
+            mflux - the flux of fluxcal (None for a planet)
+            jobs - the list of BootfluxJobs, which have been run
+            obsDate - observation date
+            obsFreq - observation frequency in GHz
+        returns :
+            the flux of gaincal in Jy
+    """
+    fluxes = []
+    rms = []
+    for job in jobs :
+        job.finish(fluxes,rms)
+    flux,uncert = calculations.weightedAverage(fluxes, rms)
+    name = fluxcal._name
+    if(mflux != None) :
+        name += "(" + str(mflux) + ")"
+    if(flux != 0.0 and (fluxcal.haveSuper() or (mflux != None and fluxcal._name != "MWC349"))) :
+        fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"WB",obsDate,name)
+    # MWC349 super windows have no fallback
+    if(flux == 0.0 and not (fluxcal._name == "MWC349" and fluxcal._type != sources.PLANET and fluxcal.haveSuper())) :
+        log.writeComment("Obtaining flux from catalog.")
+        return getCatalogFlux(gaincal._name, obsDate, obsFreq)
+    return flux
 
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-            if(flux == 0.0) :
-                log.writeComment("Obtaining flux from catalog.")
-                return getCatalogFlux(gaincal._name, obsDate, obsFreq)
-            else :
-                fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"WB",obsDate,fluxcal._name + "(" + str(mflux) + ")")
+def runBootfluxes(project, gaincals, fluxcal, obsDate, obsFreq=95.0) :
+    """ Method to calculate the fluxes of the gain calibrators by bootstrapping from a flux calibrator or by
+        looking up the flux in FluxSource.cat as a fallback, the bootflux runs of all gain calibrators,
+        sidebands and windows are done at the same time (limited by the number of CPUs and memory), the logs
+        and script are written in the same order as if they were run one at a time
+        input :
+            project - the project name, for the flux log
+            gaincals - list of the gain calibrators
+            fluxcal - the flux calibrator
+            obsDate - observation date
+            obsFreq - observation frequency in GHz
+        returns :
+            a list of the fluxes of the gain calibrators in Jy
+    """
+    plans = []
+    stages = scheduler.StageScheduler()
+    for gaincal in gaincals :
+        mflux,jobs = bootfluxJobs(gaincal,fluxcal,obsDate,obsFreq)
+        plans.append([mflux,jobs])
+        if(jobs == None) :
+            continue
+        for job in jobs :
+            stages.add("bootflux %s" % (job.files[0]),job.run,memory=scheduler.dataSize(job.files))
+    stages.run()
+    fluxes = []
+    for i in range(0,len(gaincals)) :
+        mflux,jobs = plans[i]
+        if(jobs == None) :
+            fluxes.append(mflux)
         else :
-            for window in range(1, len(gaincal._bandwidths) + 1):
-                mflux = getCatalogFlux(fluxcal._name, obsDate, obsFreq)
-                if(gaincal._name == fluxcal._name) :
-                    return mflux
-                args = []
-                args.append(globals.Variable("vis",gaincal._file,".w%i" % (window)))
-                args.append(globals.Variable("ADD",fluxcal._file,".w%i" % (window)))
-                args.append(globals.Variable("primary",fluxcal._name))
-                args.append(globals.Variable("ADD",str(mflux)))
-                args.append(globals.Variable("line","channel,1,1,%i" % (gaincal._numChans[window - 1])))
-                args.append(globals.Variable("taver",str(averagingTime)))
-                args.append(globals.Variable("log","boot.%s.w%i.log" % (gaincal._file,window)))
-                sys = log.run("bootflux",args)
+            fluxes.append(bootfluxResult(project,gaincals[i],fluxcal,mflux,jobs,obsDate,obsFreq))
+    return fluxes
 
-                if(sys == 0) :
-                    if(getFlux("boot.%s.w%i.log" % (gaincal._file,window),fluxes, rms)) :
-                        log.writeComment("Bootflux got a flux of %f for window %i of %s\n" % (fluxes[window - 1], window,gaincal._name))
-                    else :
-                        fluxes.append(0.0)
-                        rms.append(0.0)
-                else :
-                    fluxes.append(0.0)
-                    rms.append(0.0)
-            flux,uncert = calculations.weightedAverage(fluxes, rms)
-            if(flux == 0.0) :
-                log.writeComment("Obtaining flux from catalog.")
-                return getCatalogFlux(gaincal._name, obsDate, obsFreq)
-            else :
-                fluxlog.writeLog(project,gaincal._name,flux,uncert,obsFreq,"WB",obsDate,fluxcal._name + "(" + str(mflux) + ")")
-        return flux
+def runBootflux(project,gaincal, fluxcal, obsDate, obsFreq=95.0) :
+    """ Method to calculate the flux of the gain calibrator(s)
+        by bootstrapping from flux calibrator(s) or by looking up
+        the flux in FluxSource.cat as a fallback
+        input :
+            gaincal - the gain calibrator
+            fluxcal -the flux calibrator
+            obsDate - observation date
+            obsFreq - observation frequency in GHz
+        returns :
+            the flux of gaincal in Jy
+    """
+    return runBootfluxes(project,[gaincal],fluxcal,obsDate,obsFreq)[0]
 
 def getFlux(bootFile,fluxes, rms) :
     """ Method to read in the bootflux log and get the average flux
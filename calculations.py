@@ -119,6 +119,84 @@ def unconvertTime(time) :
         hours = hours - 24
     return "%02i:%02i:%04.1f" % (hours,minutes,seconds)
 
+def convertTimes(times) :
+    """ Method to convert many numeric time entries (as strings) to hour based entries at once, see convertTime
+        input :
+            times - a list of the times, in the form of hhmmss.s (121500.0) or hh:mm:ss.s (12:15:00.0)
+        returns :
+            an array of the times in the form of hh.hhhh  (12.25)
+    """
+    if(len(times) == 0) :
+        return numpy.zeros(0)
+    strings = numpy.char.replace(numpy.asarray(times,dtype=numpy.string_),":","")
+    width = strings.dtype.itemsize
+    if(width <= 4) :
+        strings = strings.astype("S5")
+        width = 5
+    # the hours and minutes are fixed width, the seconds are whatever is left
+    digits = strings.view(numpy.uint8).reshape(len(strings),width).astype(numpy.float64) - ord("0")
+    hours = digits[:,0]*10.0 + digits[:,1]
+    minutes = digits[:,2]*10.0 + digits[:,3]
+    seconds = numpy.ascontiguousarray(strings.view(numpy.uint8).reshape(len(strings),width)[:,4:]).view("S%i" % (width - 4)).ravel()
+    seconds = numpy.where(seconds == "","0",seconds).astype(numpy.float64)
+    return hours + minutes/60.0 + seconds/3600.0
+
+def unconvertTimes(times) :
+    """ Method to convert many numeric hours time entries to standard format at once, see unconvertTime
+        input :
+            times - an array of the times in hours (12.25)
+        returns :
+            a list of the times in the form of hh:mm:ss.s (12:15:00.0)
+    """
+    times = numpy.asarray(times,dtype=numpy.float64)
+    hours = numpy.floor(times)
+    mins = (times - hours) * 60.0
+    minutes = numpy.floor(mins)
+    seconds = (mins - minutes) * 60.0
+    roll = seconds > 59.99
+    seconds[roll] -= 59.99
+    minutes[roll] += 1.0
+    roll = minutes > 59.99
+    minutes[roll] -= 59.99
+    hours[roll] += 1.0
+    hours[hours >= 24] -= 24
+    return ["%02i:%02i:%04.1f" % (h,m,s) for h,m,s in zip(hours.tolist(),minutes.tolist(),seconds.tolist())]
+
+def hoursToJulian(hours,jd) :
+    """ Method to convert times of day to julian dates, all times are converted at once
+        input :
+            hours - an array of the times in hours (12.25)
+            jd - a julian date on the day the times are on
+        returns :
+            an array of the julian dates
+    """
+    day = floor(jd - 0.5) + 0.5
+    return day + numpy.asarray(hours,dtype=numpy.float64)/24.0
+
+def julianToTime(jd) :
+    """ Method to convert julian dates to the time of day, all dates are converted at once
+        input :
+            jd - an array of julian dates
+        returns :
+            a list of the times in the form of hh:mm:ss.s (12:15:00.0), the same as julday(jd,"H")[8:18]
+    """
+    # work in tenths of a second, rounded, so that 59.95 seconds becomes the next minute
+    tenths = numpy.round(numpy.mod(numpy.asarray(jd,dtype=numpy.float64) + 0.5,1.0) * 864000.0).astype(numpy.int64) % 864000
+    hours = tenths / 36000
+    minutes = (tenths / 600) % 60
+    seconds = (tenths % 600) / 10.0
+    return ["%02i:%02i:%04.1f" % (hours[i],minutes[i],seconds[i]) for i in range(0,len(tenths))]
+
+def julianToHours(jd) :
+    """ Method to convert julian dates to the time of day in hours, rounded to the nearest tenth of
+        a second (as the times listed by miriad tasks are)
+        input :
+            jd - an array of julian dates
+        returns :
+            an array of the times in the form of hh.hhhh  (12.25)
+    """
+    return numpy.round(numpy.mod(numpy.asarray(jd,dtype=numpy.float64) + 0.5,1.0) * 864000.0) / 36000.0
+
 def getDate() :
     """ Method to get the current date and return it as a string
         inputs :
@@ -719,6 +797,63 @@ def getRms(xt,yt,z) :
     value /= length
     return sqrt((rms - length*value**2)/(length-1))
 
+def outliers(values,mean,rms,k) :
+    """ Method to find outliers, all values are done at once
+        input :
+            values - an array of the values (NaN for missing values)
+            mean - the mean value (anything that broadcasts against values, e.g. one per row)
+            rms - the rms (anything that broadcasts against values)
+            k - values more than k*rms from the mean are outliers
+        returns :
+            a boolean array, True for outliers (missing values are never outliers)
+    """
+    values = numpy.asarray(values,dtype=numpy.float64)
+    bad = numpy.zeros(values.shape,dtype=numpy.bool_)
+    valid = numpy.isfinite(values)
+    with numpy.errstate(invalid="ignore") :
+        bad[valid] = (numpy.abs(values - mean) > k * numpy.asarray(rms))[valid]
+    return bad
+
+def runIntervals(bad,valid=None) :
+    """ Method to find the runs of consecutive True values along each row of a boolean array
+        (run length encoding), all rows are done at once. Entries which are not valid (missing data)
+        neither start nor end a run, a run continues across them
+        input :
+            bad - a 2D boolean array
+            valid - a 2D boolean array of the valid entries (default is all)
+        returns :
+            arrays of the row, first index, last index, and the index of the next valid entry after the run
+            (-1 if the run goes to the last valid entry) of each run, ordered by row then index
+    """
+    bad = numpy.atleast_2d(numpy.asarray(bad,dtype=numpy.bool_))
+    rows,length = bad.shape
+    if(valid is None) :
+        valid = numpy.ones(bad.shape,dtype=numpy.bool_)
+    valid = numpy.atleast_2d(valid)
+    bad = bad & valid
+    index = numpy.arange(length)
+    # the closest valid entry at or before/after each entry
+    previous = numpy.maximum.accumulate(numpy.where(valid,index,-1),axis=1)
+    following = numpy.minimum.accumulate(numpy.where(valid,index,length)[:,::-1],axis=1)[:,::-1]
+    row = numpy.arange(rows)[:,numpy.newaxis]
+    padded = numpy.zeros((rows,length + 1),dtype=numpy.bool_)
+    padded[:,:length] = bad
+    previousBad = (previous >= 0) & padded[row,numpy.where(previous >= 0,previous,length)]
+    followingBad = padded[row,following]
+    # fill the gaps of missing data inside runs
+    filled = bad | (numpy.logical_not(valid) & previousBad & followingBad)
+    edges = numpy.zeros((rows,length + 2),dtype=numpy.int8)
+    edges[:,1:-1] = filled
+    change = numpy.diff(edges,axis=1)
+    runRows,starts = numpy.nonzero(change == 1)
+    endRows,ends = numpy.nonzero(change == -1)
+    ends -= 1
+    nextIndex = numpy.full(len(ends),-1,dtype=numpy.int64)
+    inside = ends + 1 < length
+    nextIndex[inside] = following[endRows[inside],ends[inside] + 1]
+    nextIndex[nextIndex >= length] = -1
+    return runRows,starts,ends,nextIndex
+
 def iround(x):
     """ Method to round a number to the nearest integer
         input :
@@ -742,3 +877,66 @@ def unwrap(x) :
         l[i] = x[i] - 360*(iround((x[i]-theta)/360.0))
         theta = 0.5*(l[i] + theta)
     return l
+
+def unwrapRows(phases,good=None) :
+    """ Method to unwrap many sets of phases at once, in the same way as unwrap (each row is unwrapped
+        along its columns, skipping the values which are not good)
+        input :
+            phases - an array (rows,n) of the phases to unwrap
+            good - boolean array (rows,n) of the values to use (None for all)
+        returns :
+            an array (rows,n) of the phases unwrapped (values which are not good are left as they were)
+    """
+    x = numpy.array(phases,dtype=numpy.float64,ndmin=2)
+    if(good is None) :
+        good = numpy.ones(x.shape,dtype=numpy.bool_)
+    # start from the first good value of each row
+    theta = x[numpy.arange(x.shape[0]),numpy.argmax(good,axis=1)]
+    for i in range(0,x.shape[1]) :
+        turns = (x[:,i] - theta)/360.0
+        # same rounding as iround
+        rounded = numpy.where(turns >= 0.0,numpy.floor(turns + 0.5),numpy.ceil(turns - 0.5))
+        value = x[:,i] - 360*(numpy.trunc(rounded - 0.5) + (turns > 0.5))
+        x[:,i] = numpy.where(good[:,i],value,x[:,i])
+        theta = numpy.where(good[:,i],0.5*(value + theta),theta)
+    return x
+
+def polyRms(x,y,orders,valid=None) :
+    """ Method to fit polynomials to many sets of data at once and get the rms of each fit (as getRms)
+        all rows share the x points, so the fits are done with one least squares solution per order
+        input :
+            x - the x points
+            y - an array (rows,n) of the y points
+            orders - list of the orders of the polynomials to fit
+            valid - boolean array (rows,n) of the points to use (None for all)
+        returns :
+            an array (rows,len(orders)) of the rms of the fits (NaN where there are too few points)
+    """
+    x = numpy.asarray(x,dtype=numpy.float64)
+    y = numpy.array(y,dtype=numpy.float64,ndmin=2)
+    if(valid is None) :
+        valid = numpy.ones(y.shape,dtype=numpy.bool_)
+    rms = numpy.empty((y.shape[0],len(orders)))
+    rms[:] = numpy.nan
+    if(y.shape[0] == 0 or len(orders) == 0) :
+        return rms
+    # the residuals do not depend on the origin and scale of x, so normalize it to keep the fit well conditioned
+    scale = numpy.abs(x - x.mean()).max()
+    if(scale == 0.0) :
+        scale = 1.0
+    vander = numpy.vander((x - x.mean())/scale,max(orders) + 1,increasing=True)
+    # rows which use the same points share their matrix
+    groups = dict()
+    for row in range(0,y.shape[0]) :
+        groups.setdefault(valid[row].tostring(),[]).append(row)
+    for rows in groups.values() :
+        use = valid[rows[0]]
+        n = use.sum()
+        data = y[rows][:,use].T
+        for i in range(0,len(orders)) :
+            if(n < 2 or n <= orders[i]) :
+                continue
+            matrix = vander[use,:orders[i] + 1]
+            coeffs = numpy.linalg.lstsq(matrix,data,rcond=-1)[0]
+            rms[rows,i] = (numpy.dot(matrix,coeffs) - data).std(axis=0,ddof=1)
+    return rms
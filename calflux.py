@@ -1,7 +1,177 @@
 from pipeline_miriadwrap import *
 import os
+import threading
+import cPickle
+import numpy
 import calculations
 
+DELFREQ = 30.0              # fluxes within this many GHz of the observing frequency are used
+INDEX_VERSION = 2           # version of the format of the saved catalog index
+INDEX_NAME = "FluxSource.cat.index"
+CACHE_DIR = os.path.join(os.path.expanduser("~"),".cache","cadre")   # where the index is kept if the catalog directory is not writable
+
+# flux entries of one catalog section, in file order
+ENTRY = numpy.dtype([("date",numpy.float64),("freq",numpy.float64),("flux",numpy.float64),("order",numpy.int64)])
+
+catalogIndexes = dict()     # parsed catalogs keyed on path, each is a list of [header line,entries] in file order
+sourceEntries = dict()      # entries of each source keyed on (path,source), sorted by frequency
+catalogLock = threading.Lock()
+
+def catalogFile() :
+    """ Method to get the name of the miriad flux catalog
+        input :
+            none
+        returns :
+            the path to FluxSource.cat
+    """
+    return os.getenv("MIR") + "/cat/FluxSource.cat"
+
+def parseCatalog(file) :
+    """ Method to parse the flux catalog, each section starts with a ## line naming the source
+        input :
+            file - the name of the catalog
+        returns :
+            a list of [header line,entries] for each section in file order, entries is an array of ENTRY
+    """
+    sections = []
+    entries = None
+    order = 0
+    input = open(file,'r')
+    for line in input :
+        if("##" in line) :
+            entries = []
+            sections.append([line,entries])
+        elif(entries != None and not "#" in line) :
+            splitline = line.split()
+            try :
+                date = splitline[1].replace("-","")
+                entries.append((calculations.gregorianToNumeric(date[2:9]),float(splitline[2]),float(splitline[3]),order))
+            except (IndexError,ValueError) :
+                continue
+            order += 1
+    input.close()
+    for section in sections :
+        section[1] = numpy.array(section[1],dtype=ENTRY)
+    return sections
+
+def indexFiles(file) :
+    """ Method to get the places the index of a catalog may be saved, next to the catalog first
+        input :
+            file - the name of the catalog
+        returns :
+            a list of the possible index file names
+    """
+    files = [os.path.join(os.path.dirname(file),INDEX_NAME)]
+    files.append(os.path.join(CACHE_DIR,os.path.abspath(file).replace("/","_") + ".index"))
+    return files
+
+def indexHeader(key) :
+    """ Method to get the first line of an index file, which names the catalog the index was made from
+        input :
+            key - the version of the index format and the path, size and modification time of the catalog
+        returns :
+            the header line
+    """
+    return repr(key) + "\n"
+
+def validIndex(sections) :
+    """ Method to check that an unpickled index has the form written by loadIndex
+        input :
+            sections - the unpickled index
+        returns :
+            True if it is a list of [header line,entries] with entries an array of ENTRY
+    """
+    if(not isinstance(sections,list)) :
+        return False
+    for section in sections :
+        if(not isinstance(section,list) or len(section) != 2 or not isinstance(section[0],str)) :
+            return False
+        if(not isinstance(section[1],numpy.ndarray) or section[1].dtype != ENTRY or section[1].ndim != 1) :
+            return False
+    return True
+
+def readIndex(indexFile,key) :
+    """ Method to read a saved index, the header line is checked before anything is unpickled
+        input :
+            indexFile - the name of the index file
+            key - the version of the index format and the path, size and modification time of the catalog
+        returns :
+            the parsed catalog (see parseCatalog), or None if the index is for another catalog or is not valid
+    """
+    input = open(indexFile,"rb")
+    try :
+        if(input.readline() != indexHeader(key)) :
+            return None
+        sections = cPickle.load(input)
+    finally :
+        input.close()
+    if(not validIndex(sections)) :
+        return None
+    return sections
+
+def loadIndex(file) :
+    """ Method to get the index of a catalog, reading a saved index if it was made from this catalog (same
+        path, size and modification time), otherwise parsing the catalog and saving its index
+        input :
+            file - the name of the catalog
+        returns :
+            the parsed catalog (see parseCatalog)
+    """
+    stat = os.stat(file)
+    key = (INDEX_VERSION,os.path.abspath(file),stat.st_size,stat.st_mtime)
+    for indexFile in indexFiles(file) :
+        try :
+            sections = readIndex(indexFile,key)
+        except Exception :
+            # missing, unreadable or corrupt, the catalog is parsed again
+            continue
+        if(sections != None) :
+            return sections
+    sections = parseCatalog(file)
+    for indexFile in indexFiles(file) :
+        # write to a temporary file and rename it, so other runs never see a partial index
+        temp = "%s.%i" % (indexFile,os.getpid())
+        try :
+            if(not os.path.exists(os.path.dirname(indexFile))) :
+                os.makedirs(os.path.dirname(indexFile))
+            output = open(temp,"wb")
+            output.write(indexHeader(key))
+            cPickle.dump(sections,output,2)
+            output.close()
+            os.rename(temp,indexFile)
+            break
+        except (IOError,OSError) :
+            if(os.path.exists(temp)) :
+                os.remove(temp)
+    return sections
+
+def getEntries(source,file=None) :
+    """ Method to get all catalog entries of a source, the catalog is only read the first time
+        input :
+            source - the name of the source (sections whose ## line contains it are used)
+            file - the name of the catalog (default is the miriad flux catalog)
+        returns :
+            an array of ENTRY sorted by frequency
+    """
+    if(file == None) :
+        file = catalogFile()
+    catalogLock.acquire()
+    try :
+        if((file,source) in sourceEntries) :
+            return sourceEntries[(file,source)]
+        if(not file in catalogIndexes) :
+            catalogIndexes[file] = loadIndex(file)
+        entries = [section[1] for section in catalogIndexes[file] if source in section[0]]
+        if(len(entries) > 0) :
+            entries = numpy.concatenate(entries)
+        else :
+            entries = numpy.zeros(0,dtype=ENTRY)
+        entries = entries[numpy.argsort(entries["freq"],kind="mergesort")]
+        sourceEntries[(file,source)] = entries
+        return entries
+    finally :
+        catalogLock.release()
+
 def calflux(source,freq) :
     """ Method to get a calibrator flux from the miriad catalog
         inputs :
@@ -10,26 +180,12 @@ def calflux(source,freq) :
         returns :
             the flux of the object
     """
-    delfreq = 30.0
+    entries = getEntries(source)
+    low = numpy.searchsorted(entries["freq"],freq - DELFREQ,side="left")
+    high = numpy.searchsorted(entries["freq"],freq + DELFREQ,side="right")
+    # in file order, so a later entry for the same date replaces an earlier one
+    entries = numpy.sort(entries[low:high],order="order")
     data = dict()
-    dir = os.getenv("MIR")
-    input = open(dir + "/cat/FluxSource.cat",'r')
-    lines = input.readlines()
-    input.close()
-    lines.reverse()
-    found = False
-    while(len(lines) > 0) :
-        line = lines.pop()
-        if("##" in line and source in line) :
-            found = True
-        elif(found and not "#" in line) :
-            splitline = line.split()
-            date = splitline[1]
-            obsfreq = float(splitline[2])
-            flux = float(splitline[3])
-            if(obsfreq >= freq - delfreq and obsfreq <= freq + delfreq) :
-                date = date.replace("-","")
-                data[calculations.gregorianToNumeric(date[2:9])] = flux
-        elif(found and "##" in line) :
-            found = False
+    for date,flux in zip(entries["date"].tolist(),entries["flux"].tolist()) :
+        data[date] = flux
     return data
@@ -14,6 +14,21 @@ try :
 except ImportError:
     import defaultPreferences as p
 
+UV_BINS = [0.0,5.0,10.0,20.0,50.0,100.0,200.0,500.0,1000.0,2000.0]   # uv distance bins (kilolambda) of the decorrelation curves
+
+def logCurve(label,curve) :
+    """ Method to write the ratio of vector to scalar amplitude versus uv distance to the notes file
+        input :
+            label - description of the data
+            curve - the curve from uvflux.fluxes
+        returns :
+            none
+    """
+    log.writeLog("Vector/scalar amplitude versus uv distance (%s):" % (label))
+    for low,high,vecamp,scalamp,count in curve :
+        if(count > 0 and scalamp > 0.0) :
+            log.writeLog("  %6.1f - %6.1f klambda: %.3f (%i points)" % (low,high,vecamp/scalamp,count))
+
 def correctDecorrelation(objects,refant) :
     """ Method to correct the miriad data for decorrelation from atmospheric phase fluctuations
         input :
@@ -35,10 +50,12 @@ def correctDecorrelation(objects,refant) :
 
     log.run("mselfcal vis=junk.temp interval=%f options=phase line=chan,1,%i,%i refant=%i" % (p.preferences.get("selfcalInterval"),startChan,numChans,refant),[],logit=False,fatal=False)
 
-    f = uvflux.uvflux("junk.temp",startChan,numChans)[0]
+    fluxes,curves = uvflux.fluxes("junk.temp",startChan,numChans,uvBins=UV_BINS)
 
-    if(len(f) == 0) :
+    if(len(fluxes) == 0) :
         return False
+    f = fluxes[0]
+    logCurve("before correction",curves[0])
 
     decor = f[3].real / f[6]
     if(decor > 1.25) :
@@ -52,10 +69,12 @@ def correctDecorrelation(objects,refant) :
     log.run("uvdecor vis=junk.temp options=nocal,nopass,nopol delaymax=8500 out=junk.temp2",[],logit=False,fatal=False)
 
     log.run("mselfcal vis=junk.temp2 interval=%f options=phase line=chan,1,%i,%i refant=%i" % (p.preferences.get("selfcalInterval"),startChan,numChans,refant),[],logit=False,fatal=False)
-    f = uvflux.uvflux("junk.temp2",startChan,numChans)[0]
+    fluxes,curves = uvflux.fluxes("junk.temp2",startChan,numChans,uvBins=UV_BINS)
 
-    if(len(f) == 0) :
+    if(len(fluxes) == 0) :
         return False
+    f = fluxes[0]
+    logCurve("after correction",curves[0])
     decor2 = f[3].real / f[6]
     if(decor2 > 1.25 or decor2 <= decor) :
         log.writeComment("Correction for decorrelation failed.")
@@ -0,0 +1,297 @@
+import os
+import threading
+import numpy
+import globals
+import logger as log
+import calculations
+import miriad_functions as mfunc
+import uvReader
+import flagOccupancy
+
+"""
+Module for accumulating uvflag style flagging of miriad data sets and applying it in a single pass
+The flags and wflags items are updated directly and the equivalent uvflag commands are written to the script
+Part of the CARMA data reduction pipeline
+Author: D. N. Friedel
+"""
+
+journals = dict()       # journals keyed on data set name
+journalLock = threading.Lock()
+
+def parseTime(value) :
+    """ Method to convert a time of the form hh:mm:ss.s to hours
+        input :
+            value - the time string
+        returns :
+            the time in hours, or None if it cannot be parsed
+    """
+    splitTime = value.split(":")
+    if(len(splitTime) > 3) :
+        return None
+    try :
+        hours = 0.0
+        for i in range(0,len(splitTime)) :
+            hours += float(splitTime[i]) / 60.0**i
+    except ValueError :
+        return None
+    return hours
+
+def parseSelect(select) :
+    """ Method to parse the subset of the uvflag select keyword used by the pipeline: antenna and time
+        subcommands (subcommands of the same type are ORed, different types are ANDed, as in miriad)
+        input :
+            select - the select string
+        returns :
+            a dictionary with the antenna lists ("ants", a list of one or two lists) and time ranges
+            ("times", in hours), or None if the string uses anything else
+    """
+    selection = {"ants" : None, "times" : []}
+    select = select.replace("'","").replace(" ","")
+    for command in select.replace("),",")|").split("|") :
+        if(not "(" in command) :
+            return None
+        name = command[:command.index("(")].lower()
+        groups = command[command.index("("):].replace(")(",")|(").split("|")
+        values = [group.strip("()").split(",") for group in groups]
+        if(name != "" and "antennae".startswith(name) and len(name) >= 3) :
+            if(selection["ants"] != None or len(values) > 2) :
+                return None
+            try :
+                selection["ants"] = [[int(ant) for ant in group] for group in values]
+            except ValueError :
+                return None
+        elif(name == "time" and len(values) == 1 and len(values[0]) == 2) :
+            start = parseTime(values[0][0])
+            end = parseTime(values[0][1])
+            if(start == None or end == None) :
+                return None
+            selection["times"].append([start,end])
+        else :
+            return None
+    return selection
+
+def parseLine(line) :
+    """ Method to parse a uvflag line keyword of the form channel,nchan,start,width,step
+        input :
+            line - the line string
+        returns :
+            the list of channels (0 based) selected, or None if the string uses anything else
+    """
+    splitLine = line.split(",")
+    if(len(splitLine) < 2 or len(splitLine) > 5 or splitLine[0].lower() != "channel") :
+        return None
+    try :
+        values = [int(value) for value in splitLine[1:]]
+    except ValueError :
+        return None
+    values += [1,1,1,1][len(values):]
+    nchan,start,width,step = values
+    if(len(splitLine) < 5) :
+        step = width
+    chans = []
+    for i in range(0,nchan) :
+        chans += range(start - 1 + i*step,start - 1 + i*step + width)
+    return chans
+
+def mergeTimes(times) :
+    """ Method to merge overlapping time ranges
+        input :
+            times - a list of [start,end] ranges
+        returns :
+            the sorted, merged list of ranges
+    """
+    merged = []
+    for start,end in sorted(times) :
+        if(len(merged) > 0 and start <= merged[-1][1]) :
+            merged[-1][1] = max(merged[-1][1],end)
+        else :
+            merged.append([start,end])
+    return merged
+
+class FlagJournal :
+    def __init__(self,file,fileEnd="") :
+        """ Initializer
+            file - the name of the miriad data set (as given to uvflag, without the ending)
+            fileEnd - the ending of the data set name
+        """
+        self.file = file
+        self.fileEnd = fileEnd
+        self.selections = []    # parsed selections, each is [ants,times,channels]
+        self.commands = []      # uvflag arguments of each selection, for the script
+        self.lock = threading.Lock()
+
+    def add(self,select=None,line=None) :
+        """ Method to add a flagging selection to the journal, anything that cannot be parsed is
+            flagged immediately with uvflag
+            input :
+                select - the uvflag select string
+                line - the uvflag line string
+            returns :
+                none
+        """
+        args = []
+        args.append(globals.Variable("vis",self.file,self.fileEnd))
+        if(select != None) :
+            args.append(globals.Variable("select",select))
+        if(line != None) :
+            args.append(globals.Variable("line",line))
+        args.append(globals.Variable("flagval","flag"))
+        selection = {"ants" : None, "times" : []}
+        chans = None
+        if(select != None) :
+            selection = parseSelect(select)
+        if(line != None) :
+            chans = parseLine(line)
+        if(selection == None or (line != None and chans == None)) :
+            log.run("uvflag",args)
+            flagOccupancy.invalidateOccupancy(self.file + self.fileEnd)
+            return
+        self.lock.acquire()
+        try :
+            self.selections.append([selection["ants"],selection["times"],chans])
+            self.commands.append(args)
+        finally :
+            self.lock.release()
+
+    def pending(self) :
+        """ Method to get the number of selections waiting to be applied
+            input :
+                none
+            returns :
+                the number of selections
+        """
+        return len(self.selections)
+
+    def merged(self) :
+        """ Method to combine the selections which flag the same antennas and channels, merging
+            their time ranges
+            input :
+                none
+            returns :
+                a list of [ants,times,channels] (times is None for all times)
+        """
+        groups = dict()
+        order = []
+        for ants,times,chans in self.selections :
+            key = (repr(ants),repr(chans))
+            if(not key in groups) :
+                groups[key] = [ants,[],chans]
+                order.append(key)
+            if(len(times) == 0 or groups[key][1] == None) :
+                groups[key][1] = None
+            else :
+                groups[key][1] += times
+        merged = []
+        for key in order :
+            ants,times,chans = groups[key]
+            if(times != None) :
+                times = mergeTimes(times)
+            merged.append([ants,times,chans])
+        return merged
+
+    def apply(self) :
+        """ Method to apply all pending selections to the flags in a single pass through the data, and
+            write the equivalent uvflag commands to the script. As uvflag does, selections without a line
+            also flag the wide channels
+            input :
+                none
+            returns :
+                none
+        """
+        self.lock.acquire()
+        try :
+            if(len(self.selections) == 0) :
+                return
+            vis = self.file + self.fileEnd
+            selections = self.merged()
+            self.flagItem(vis,"corr",selections)
+            wide = [selection for selection in selections if selection[2] == None]
+            if(len(wide) > 0 and "wcorr" in uvReader.readVartable(vis)[1]) :
+                self.flagItem(vis,"wcorr",wide)
+            flagOccupancy.invalidateOccupancy(vis)
+            for args in self.commands :
+                log.run("uvflag",args,execute=False)
+            del self.selections[:]
+            del self.commands[:]
+        finally :
+            self.lock.release()
+
+    def flagItem(self,vis,data,selections) :
+        """ Method to apply selections to the flags item of the spectral or wide channels
+            input :
+                vis - the name of the data set
+                data - "corr" for the flags item or "wcorr" for the wflags item
+                selections - list of the [ants,times,channels] to flag (see merged)
+            returns :
+                none
+        """
+        reader = uvReader.UVReader(vis,data=data)
+        bit = 0
+        firstTime = None
+        for records in reader.records(withData=False) :
+            nrec,nchan = records["flags"].shape
+            # times without a date are on the day of the first record, as in miriad
+            if(firstTime == None) :
+                firstTime = records["time"][0]
+            flag = numpy.zeros((nrec,nchan),dtype=numpy.bool_)
+            for ants,times,chans in selections :
+                rows = numpy.ones(nrec,dtype=numpy.bool_)
+                if(ants != None and len(ants) == 1) :
+                    rows &= numpy.in1d(records["ant1"],ants[0]) | numpy.in1d(records["ant2"],ants[0])
+                elif(ants != None) :
+                    rows &= (numpy.in1d(records["ant1"],ants[0]) & numpy.in1d(records["ant2"],ants[1])) | (numpy.in1d(records["ant1"],ants[1]) & numpy.in1d(records["ant2"],ants[0]))
+                if(times != None) :
+                    inTime = numpy.zeros(nrec,dtype=numpy.bool_)
+                    for start,end in times :
+                        start,end = calculations.hoursToJulian([start,end],firstTime)
+                        inTime |= (records["time"] >= start) & (records["time"] <= end)
+                    rows &= inTime
+                if(chans == None) :
+                    flag[rows] = True
+                else :
+                    columns = numpy.zeros(nchan,dtype=numpy.bool_)
+                    columns[[c for c in chans if c < nchan]] = True
+                    flag[numpy.ix_(rows,columns)] = True
+            flag &= records["flags"]
+            if(flag.any()) :
+                mfunc.writeMaskBits(reader.flagItem,bit,(records["flags"] & numpy.logical_not(flag)).ravel())
+            bit += nrec*nchan
+
+def getJournal(file,fileEnd="") :
+    """ Method to get the flag journal of a data set, creating it if needed
+        input :
+            file - the name of the miriad data set (without the ending)
+            fileEnd - the ending of the data set name
+        returns :
+            the FlagJournal
+    """
+    journalLock.acquire()
+    try :
+        key = os.path.abspath(file + fileEnd)
+        if(not key in journals) :
+            journals[key] = FlagJournal(file,fileEnd)
+        return journals[key]
+    finally :
+        journalLock.release()
+
+def flush(file=None,fileEnd="") :
+    """ Method to apply the pending flagging of a data set, or of all data sets
+        input :
+            file - the name of the miriad data set (None for all data sets)
+            fileEnd - the ending of the data set name
+        returns :
+            none
+    """
+    journalLock.acquire()
+    try :
+        if(file == None) :
+            pending = journals.values()
+        else :
+            key = os.path.abspath(file + fileEnd)
+            pending = []
+            if(key in journals) :
+                pending.append(journals[key])
+    finally :
+        journalLock.release()
+    for journal in pending :
+        journal.apply()
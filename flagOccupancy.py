@@ -0,0 +1,303 @@
+import os
+import threading
+import numpy
+import logger as log
+import calculations
+import miriad_functions as mfunc
+import flagJournal
+import uvReader
+
+"""
+Module for reporting how much of a miriad uv data set is flagged, by antenna, baseline, window and time
+The flags and wflags items are read directly, without running any miriad tasks
+Part of the CARMA data reduction pipeline
+Author: D. N. Friedel
+"""
+
+occupancyCache = dict()     # occupancies keyed on path, each entry is [key,Occupancy]
+occupancyOrder = []         # paths in occupancyCache, least recently used first
+occupancyLock = threading.Lock()
+
+def flaggedFraction(good,total) :
+    """ Method to get the flagged fraction from counts of good and total channels
+        input :
+            good - array of the number of good (unflagged) channels
+            total - array of the total number of channels
+        returns :
+            array of the flagged fractions (NaN where there is no data)
+    """
+    good = numpy.asarray(good,dtype=numpy.float64)
+    total = numpy.asarray(total,dtype=numpy.float64)
+    with numpy.errstate(invalid="ignore",divide="ignore") :
+        return numpy.where(total > 0,1.0 - good/total,numpy.nan)
+
+def extend(counts,size) :
+    """ Method to lengthen an array of counts with zeros
+        input :
+            counts - the array of counts
+            size - the minimum length
+        returns :
+            the counts, at least size long
+    """
+    if(len(counts) >= size) :
+        return counts
+    return numpy.concatenate((counts,numpy.zeros(size - len(counts),dtype=counts.dtype)))
+
+class Occupancy :
+    def __init__(self,file) :
+        """ Initializer
+            file - the name of the uv data set
+        """
+        self.file = file
+        self.baselines = numpy.zeros(0,dtype=numpy.int32)   # baseline numbers
+        self.ant1 = numpy.zeros(0,dtype=numpy.int32)        # first antenna of each baseline
+        self.ant2 = numpy.zeros(0,dtype=numpy.int32)        # second antenna of each baseline
+        self.times = numpy.zeros(0)                         # julian dates of the integrations
+        self.good = numpy.zeros((0,0),dtype=numpy.int64)    # good channels (baseline x time)
+        self.total = numpy.zeros((0,0),dtype=numpy.int64)   # all channels (baseline x time)
+        self.windowGood = numpy.zeros(0,dtype=numpy.int64)  # good channels in each spectral window
+        self.windowTotal = numpy.zeros(0,dtype=numpy.int64) # all channels in each spectral window
+        self.wideGood = None                                # good records of each wide channel (None if no wide data)
+        self.wideTotal = None                               # records of each wide channel
+
+    def fraction(self) :
+        """ Method to get the flagged fraction of the whole data set
+            input :
+                none
+            returns :
+                the flagged fraction
+        """
+        return float(flaggedFraction(self.good.sum(),self.total.sum()))
+
+    def baselineFractions(self) :
+        """ Method to get the flagged fraction of each baseline
+            input :
+                none
+            returns :
+                array of the flagged fraction of each baseline (in the order of self.baselines)
+        """
+        return flaggedFraction(self.good.sum(axis=1),self.total.sum(axis=1))
+
+    def timeFractions(self) :
+        """ Method to get the flagged fraction of each integration
+            input :
+                none
+            returns :
+                array of the flagged fraction of each time (in the order of self.times)
+        """
+        return flaggedFraction(self.good.sum(axis=0),self.total.sum(axis=0))
+
+    def antennaFractions(self) :
+        """ Method to get the flagged fraction of each antenna, over all baselines the antenna is in
+            input :
+                none
+            returns :
+                array of the antenna numbers and array of their flagged fractions
+        """
+        good = self.good.sum(axis=1)
+        total = self.total.sum(axis=1)
+        size = max(self.ant1.max(),self.ant2.max()) + 1 if len(self.baselines) > 0 else 1
+        # autocorrelations are only counted once
+        cross = self.ant1 != self.ant2
+        antGood = numpy.bincount(self.ant1,good,size) + numpy.bincount(self.ant2[cross],good[cross],size)
+        antTotal = numpy.bincount(self.ant1,total,size) + numpy.bincount(self.ant2[cross],total[cross],size)
+        ants = numpy.flatnonzero(antTotal > 0)
+        return ants,flaggedFraction(antGood[ants],antTotal[ants])
+
+    def windowFractions(self) :
+        """ Method to get the flagged fraction of each spectral window
+            input :
+                none
+            returns :
+                array of the flagged fraction of each window
+        """
+        return flaggedFraction(self.windowGood,self.windowTotal)
+
+    def wideFractions(self) :
+        """ Method to get the flagged fraction of each wide band channel
+            input :
+                none
+            returns :
+                array of the flagged fraction of each wide channel, or None if there is no wide data
+        """
+        if(self.wideGood is None) :
+            return None
+        return flaggedFraction(self.wideGood,self.wideTotal)
+
+    def selected(self,select) :
+        """ Method to find the baselines and times selected by a uvflag select string
+            input :
+                select - the select string (only antenna and time selections are understood)
+            returns :
+                boolean arrays of the selected baselines and times, or None,None if the string cannot be parsed
+        """
+        selection = flagJournal.parseSelect(select)
+        if(selection == None) :
+            return None,None
+        rows = numpy.ones(len(self.baselines),dtype=numpy.bool_)
+        ants = selection["ants"]
+        if(ants != None and len(ants) == 1) :
+            rows &= numpy.in1d(self.ant1,ants[0]) | numpy.in1d(self.ant2,ants[0])
+        elif(ants != None) :
+            rows &= (numpy.in1d(self.ant1,ants[0]) & numpy.in1d(self.ant2,ants[1])) | (numpy.in1d(self.ant1,ants[1]) & numpy.in1d(self.ant2,ants[0]))
+        columns = numpy.ones(len(self.times),dtype=numpy.bool_)
+        if(len(selection["times"]) > 0 and len(self.times) > 0) :
+            columns[:] = False
+            for start,end in selection["times"] :
+                # times without a date are on the day of the first record, as in miriad
+                start,end = calculations.hoursToJulian([start,end],self.times[0])
+                columns |= (self.times >= start) & (self.times <= end)
+        return rows,columns
+
+    def fullyFlagged(self,select) :
+        """ Method to check whether all data matching a uvflag select string are already flagged
+            input :
+                select - the select string
+            returns :
+                True if there is nothing left to flag, False otherwise (or if the string cannot be parsed)
+        """
+        rows,columns = self.selected(select)
+        if(rows is None) :
+            return False
+        return self.good[numpy.ix_(rows,columns)].sum() == 0
+
+    def summary(self) :
+        """ Method to get a text summary of the occupancy
+            input :
+                none
+            returns :
+                a list of the summary lines
+        """
+        lines = []
+        lines.append("Flag occupancy of %s: %.1f%% of the data are flagged" % (self.file,100.0*self.fraction()))
+        ants,fractions = self.antennaFractions()
+        if(len(ants) > 0) :
+            lines.append("  Antennas (% flagged): " + " ".join(["%i:%.0f" % (ants[i],100.0*fractions[i]) for i in range(0,len(ants))]))
+        windows = self.windowFractions()
+        if(len(windows) > 0) :
+            lines.append("  Windows (% flagged): " + " ".join(["%i:%.0f" % (i + 1,100.0*windows[i]) for i in range(0,len(windows))]))
+        wide = self.wideFractions()
+        if(wide is not None and len(wide) > 0) :
+            lines.append("  Wide channels (% flagged): " + " ".join(["%i:%.0f" % (i + 1,100.0*wide[i]) for i in range(0,len(wide))]))
+        times = self.timeFractions()
+        if(len(times) > 0) :
+            lines.append("  Integrations: %i, fully flagged: %i" % (len(times),(times == 1.0).sum()))
+        return lines
+
+    def writeSummary(self) :
+        """ Method to write the summary to the notes file
+            input :
+                none
+            returns :
+                none
+        """
+        for line in self.summary() :
+            log.writeLog(line)
+
+def readOccupancy(file,chunk=4096) :
+    """ Method to read the flags (and wflags) of a uv data set and count the flagged channels
+        input :
+            file - the name of the uv data set
+            chunk - the number of records to read at once
+        returns :
+            an Occupancy object
+    """
+    occupancy = Occupancy(file)
+    reader = uvReader.UVReader(file,variables=[v for v in ["nschan"] if v in uvReader.readVartable(file)[1]])
+    baselines = []
+    times = []
+    good = []
+    total = []
+    windowGood = numpy.zeros(0,dtype=numpy.int64)
+    windowTotal = numpy.zeros(0,dtype=numpy.int64)
+    for records in reader.records(chunk,withData=False) :
+        nrec,nchan = records["flags"].shape
+        flags = records["flags"]
+        baselines.append(records["baseline"])
+        times.append(records["time"])
+        good.append(flags.sum(axis=1))
+        total.append(numpy.zeros(nrec,dtype=numpy.int64) + nchan)
+        if("nschan" in reader.variables) :
+            nschan = records["nschan"]
+            # window of each channel (nspect for channels past the last window)
+            window = (numpy.arange(nchan)[numpy.newaxis,:,numpy.newaxis] >= numpy.cumsum(nschan,axis=1)[:,numpy.newaxis,:]).sum(axis=2)
+            nspect = nschan.shape[1]
+            windowGood = extend(windowGood,nspect)
+            windowTotal = extend(windowTotal,nspect)
+            windowGood[:nspect] += numpy.bincount(window[flags],minlength=nspect + 1)[:nspect]
+            windowTotal[:nspect] += numpy.bincount(window.ravel(),minlength=nspect + 1)[:nspect]
+    occupancy.windowGood = windowGood
+    occupancy.windowTotal = windowTotal
+    if(len(baselines) > 0) :
+        baselines = numpy.concatenate(baselines)
+        times = numpy.concatenate(times)
+        occupancy.baselines,blIndex = numpy.unique(baselines,return_inverse=True)
+        occupancy.times,timeIndex = numpy.unique(times,return_inverse=True)
+        occupancy.ant1,occupancy.ant2 = uvReader.basant(occupancy.baselines)
+        shape = (len(occupancy.baselines),len(occupancy.times))
+        index = blIndex*shape[1] + timeIndex
+        occupancy.good = numpy.bincount(index,numpy.concatenate(good),shape[0]*shape[1]).astype(numpy.int64).reshape(shape)
+        occupancy.total = numpy.bincount(index,numpy.concatenate(total),shape[0]*shape[1]).astype(numpy.int64).reshape(shape)
+    # the wide band flags are kept separately
+    if("wcorr" in reader.names) :
+        occupancy.wideGood = numpy.zeros(0,dtype=numpy.int64)
+        occupancy.wideTotal = numpy.zeros(0,dtype=numpy.int64)
+        for records in uvReader.UVReader(file,data="wcorr").records(chunk,withData=False) :
+            flags = records["flags"]
+            occupancy.wideGood = extend(occupancy.wideGood,flags.shape[1])
+            occupancy.wideTotal = extend(occupancy.wideTotal,flags.shape[1])
+            occupancy.wideGood[:flags.shape[1]] += flags.sum(axis=0)
+            occupancy.wideTotal[:flags.shape[1]] += flags.shape[0]
+    return occupancy
+
+def invalidateOccupancy(file=None) :
+    """ Method to drop the cached occupancy of a data set, or of all data sets, this must be called
+        whenever the flags are rewritten in place as the size and modification time may not change
+        input :
+            file - the name of the uv data set (None for all data sets)
+        returns :
+            none
+    """
+    occupancyLock.acquire()
+    try :
+        for path in occupancyOrder[:] :
+            if(file == None or path == os.path.abspath(file)) :
+                del occupancyCache[path]
+                occupancyOrder.remove(path)
+    finally :
+        occupancyLock.release()
+
+def getOccupancy(file) :
+    """ Method to get the flag occupancy of a uv data set, the occupancies are cached (keyed on the size and
+        modification time of the visdata, flags and wflags items) so repeated calls do not reread the data
+        input :
+            file - the name of the uv data set
+        returns :
+            an Occupancy object (shared, so it must not be changed)
+    """
+    path = os.path.abspath(file)
+    key = []
+    for item in ["visdata","flags","wflags"] :
+        if(os.path.exists(path + "/" + item)) :
+            stat = os.stat(path + "/" + item)
+            key.append((item,stat.st_size,stat.st_mtime))
+    occupancyLock.acquire()
+    try :
+        if(path in occupancyCache and occupancyCache[path][0] == key) :
+            occupancyOrder.remove(path)
+            occupancyOrder.append(path)
+            return occupancyCache[path][1]
+    finally :
+        occupancyLock.release()
+    occupancy = readOccupancy(file)
+    occupancyLock.acquire()
+    try :
+        if(path in occupancyCache) :
+            occupancyOrder.remove(path)
+        occupancyCache[path] = [key,occupancy]
+        occupancyOrder.append(path)
+        while(len(occupancyOrder) > mfunc.MAXCACHE) :
+            del occupancyCache[occupancyOrder.pop(0)]
+    finally :
+        occupancyLock.release()
+    return occupancy
@@ -1,10 +1,16 @@
 import calculations
 import math
+import os
 import logger as log
-import random
 import gproutines
+import flagJournal
+import flagOccupancy
+import preFlagging
+import uvReader
+import numpy
+import multiprocessing
+import util
 import globals
-from threading import Thread
 try :
     import preferences as p
 except ImportError:
@@ -17,24 +23,14 @@ Author: D. N. Friedel
 
 GOOD = "good"
 BAD = "bad"
-breakPoints = []
-
-antflags = dict()
-
-class FlagBadAmpsThread(Thread) :
-    def __init__(self,object,objects,onlyBirdies=False) :
-        Thread.__init__(self)
-        self.object = object
-        self.objects = objects
-        self.onlyBirdies = onlyBirdies
-    def run(self) :
-        flagBadAmps(self.object,self.objects,self.onlyBirdies)
-
-def applyFlagging(file, flagString,fileEnd) :
+def applyFlagging(file, flagString,fileEnd,flush=True) :
     """ Method to apply flagging to the given miriad data set
         input :
             file - the name of the miriad data set
             flagString - the string used for the select keyword in uvflag
+            fileEnd - the ending of the data set name
+            flush - whether to apply the flagging now, otherwise it is added to the flag journal of
+                    the data set and applied with the next flagJournal.flush
         Note: the string is parsed based on '|' to separate individual
         selections
         returns :
@@ -42,13 +38,11 @@ def applyFlagging(file, flagString,fileEnd) :
     """
     if(flagString == "" or flagString == GOOD) :
         return
-    flagSplit = flagString.split("|")
-    for i in flagSplit :
-        args = []
-        args.append(globals.Variable("vis",file,fileEnd))
-        args.append(globals.Variable("select",i))
-        args.append(globals.Variable("flagval","flag"))
-        log.run("uvflag",args)
+    journal = flagJournal.getJournal(file,fileEnd)
+    for i in flagString.split("|") :
+        journal.add(select=i)
+    if(flush) :
+        journal.apply()
 
 def flagShadowing(file) :
     """ Method to flag antenna shadowing
@@ -65,6 +59,70 @@ def flagShadowing(file) :
     args.append(globals.Variable("sarray","0"))
     log.run("csflag",args)
 
+class FlagContext :
+    def __init__(self,file,window) :
+        """ Initializer, holds the state of one flagging call so that windows and sidebands can be
+            flagged concurrently
+            file - the name of the miriad data set (without the window ending)
+            window - the window number, or LSB/USB
+        """
+        self.file = file
+        self.window = window
+        if(window == "LSB" or window == "USB") :
+            self.fileEnd = ".%s" % (window)
+            self.label = "%s" % (window)
+        else :
+            self.fileEnd = ".w%i" % (window)
+            self.label = "Window %i" % (window)
+        self.breakPoints = []          # gain break points of the antenna being flagged
+        self.anyFlagged = False        # has any flagging been done
+        self.occupancy = None          # flag occupancy of the data set, read when first needed
+
+    def flag(self,select) :
+        """ Method to add a selection to the flag journal of the data set, selections whose data are
+            already fully flagged are skipped
+            input :
+                select - the string used for the select keyword in uvflag
+            returns :
+                none
+        """
+        if(self.occupancy == None) :
+            self.occupancy = flagOccupancy.getOccupancy(self.file + self.fileEnd)
+        if(self.occupancy.fullyFlagged(select)) :
+            log.writeLog("%s: data selected by %s are already flagged" % (self.label,select))
+            return
+        applyFlagging(self.file,select,self.fileEnd,False)
+        self.anyFlagged = True
+
+    def breakGains(self,ant) :
+        """ Method to break the gain solutions of an antenna at the collected break points
+            input :
+                ant - the antenna number
+            returns :
+                none
+        """
+        if(len(self.breakPoints) > 0) :
+            args = []
+            args.append(globals.Variable("vis",self.file,self.fileEnd))
+            args.append(globals.Variable("break",",".join(calculations.unconvertTimes(self.breakPoints))))
+            args.append(globals.Variable("ants",str(ant)))
+            log.run("gpbreak",args)
+            # gpbreak rewrote the gains in place, so they must be read again
+            gproutines.invalidateTables(self.file + self.fileEnd)
+        del self.breakPoints[:]
+
+    def flush(self) :
+        """ Method to apply the flagging collected in the flag journal of the data set, the occupancy
+            read before is out of date afterwards
+            input :
+                none
+            returns :
+                none
+        """
+        flagJournal.flush(self.file,self.fileEnd)
+        flagOccupancy.invalidateOccupancy(self.file + self.fileEnd)
+        self.occupancy = None
+
 # class for gains flagging
 class GainsFlag :
     def __init__(self) :
@@ -86,44 +144,28 @@ class GainsFlag :
         else :
             self.allGood = False
 
-    def getFlags(self) :
+    def getFlags(self,breakPoints) :
         """ Method to return a string for the select= keyword in uvflag
             inputs :
-                none
+                breakPoints - list that the start and end times of the bad ranges are added to
             returns :
                 a string containing the select= value
         """
-        global breakPoints
         if(self.allGood) :
             return GOOD
         if(self.allBad) :
             return BAD
-        first = True
-        start = 0.0
-        end = 0.0
-        flagString = ""
-        times = self.flags.keys()
-        times.sort()
-        # go through all times in increasing order
-        for time in times :
-            if(not self.flags.get(time)) :
-                if(first) :
-                    start = time - (p.preferences.get("selfcalInterval") / 2.0)/60.0
-                    first = False
-                    breakPoints.append(start)
-                if(time == times[-1]) :
-                    end = time + (p.preferences.get("selfcalInterval") / 2.0)/60.0
-                    flagString = flagString + ",time'('%s,%s')'" % (calculations.unconvertTime(start), calculations.unconvertTime(end))
-                    breakPoints.append(end)
-            else :
-                if(start != 0.0) :
-                    end = time + (p.preferences.get("selfcalInterval") / 2.0)/60.0
-                    flagString = flagString + ",time'('%s,%s')'" % (calculations.unconvertTime(start), calculations.unconvertTime(end))
-                    breakPoints.append(end)
-                    start = 0.0
-                    end = 0.0
-                    first = True
-        return flagString[1:]
+        halfInterval = (p.preferences.get("selfcalInterval") / 2.0)/60.0
+        times = numpy.array(sorted(self.flags.keys()))
+        bad = numpy.array([not self.flags.get(time) for time in times.tolist()])
+        # each range of bad times runs from half an interval before its first time to half an interval
+        # after the next good time (or the last time)
+        rows,starts,ends,nexts = calculations.runIntervals(bad)
+        startTimes = times[starts] - halfInterval
+        endTimes = numpy.where(nexts >= 0,times[numpy.maximum(nexts,0)],times[ends]) + halfInterval
+        breakPoints.extend(numpy.column_stack((startTimes,endTimes)).ravel().tolist())
+        ranges = zip(calculations.unconvertTimes(startTimes),calculations.unconvertTimes(endTimes))
+        return ",".join(["time'('%s,%s')'" % (start,end) for start,end in ranges])
 
 def flagByGains(file, window) :
     """ Method to flag visibilities if the gains are outside of the range specified bu the preferences file
@@ -133,18 +175,11 @@ def flagByGains(file, window) :
         returns :
             True/False - whether any flagging was done
     """
-    # get the gains info into a text file
-    global breakPoints
-    anyFlagged = False
-    logFile = ""
-    if(window == "LSB" or window == "USB") :
-        log.writeLog("%s: Flagging on gains based on thresholds given in defaultPreferences.py" % (window))
-        log.run("gplist vis=%s.%s options=amp > gp.%s.log" % (file, window,window),[], logit=False)
-        logFile = "gp.%s.log" % (window)
-    else :
-        log.writeLog("Window %i: Flagging on gains based on thresholds given in defaultPreferences.py" % (window))
-        log.run("gplist vis=%s.w%i options=amp > gp.%i.log" % (file, window,window),[], logit=False)
-        logFile = "gp.%i.log" % (window)
+    # get the gains info into a text file, named for the data set so that concurrent calls do not share it
+    context = FlagContext(file,window)
+    log.writeLog("%s: Flagging on gains based on thresholds given in defaultPreferences.py" % (context.label))
+    logFile = "gp.%s%s.log" % (os.path.basename(file),context.fileEnd)
+    log.run("gplist vis=%s%s options=amp > %s" % (file,context.fileEnd,logFile),[], logit=False)
     input = open(logFile)
     fileList = input.readlines()
     input.close()
@@ -167,13 +202,14 @@ def flagByGains(file, window) :
                 gainFlags[i] = GainsFlag()
         elif("Time" in line) :
             line=fileList.pop()
+            entries = []
             while(len(fileList) > 0 and not("---------" in line)) :
-                splitLine = line.split()
-                tempSplit = splitLine[0].replace(":", "")
-                if(not "." in tempSplit) :
-                    tempSplit = tempSplit + ".0"
+                entries.append(line.split())
                 numTimes += 1
-                time = calculations.convertTime(tempSplit)
+                line = fileList.pop()
+            times = calculations.convertTimes([splitLine[0] for splitLine in entries]).tolist()
+            for k in range(0,len(entries)) :
+                splitLine = entries[k]
                 for i in range(1, len(splitLine)) :
                     if("*" in splitLine[i]) :
                         gain = 100.0
@@ -181,8 +217,7 @@ def flagByGains(file, window) :
                         gain = float(splitLine[i])
                     if(gain > 0.0) :
                         numGoodEntries += 1
-                    gainFlags[i].setFlag(time, ((gain == 0.0) or (gain >= p.preferences.get("amplitudeGainRange")[0]) and (gain <= p.preferences.get("amplitudeGainRange")[1])))
-                line = fileList.pop()
+                    gainFlags[i].setFlag(times[k], ((gain == 0.0) or (gain >= p.preferences.get("amplitudeGainRange")[0]) and (gain <= p.preferences.get("amplitudeGainRange")[1])))
         elif("Means:" in line) :
             numGoodEntries /= numTimes
             splitLine = line.split()
@@ -197,57 +232,28 @@ def flagByGains(file, window) :
 
     # check for bad gains and flag appropriately
     for ant in range(1, numAnts + 1) :
-        select = gainFlags.get(ant).getFlags()
+        select = gainFlags.get(ant).getFlags(context.breakPoints)
         if(select == BAD) :
-            if(window == "LSB" or window == "USB") :
-                applyFlagging(file,"antenna'('%i')'" % (ant),".%s" % (window))
-            else :
-                applyFlagging(file,"antenna'('%i')'" % (ant),".w%i" % (window))
-            anyFlagged = True
+            context.flag("antenna'('%i')'" % (ant))
         elif(select != GOOD) :
-            if(window == "LSB" or window == "USB") :
-                applyFlagging(file,"antenna'('%i')',%s" % (ant, select), ".%s" % (window))
-            else :
-                applyFlagging(file,"antenna'('%i')',%s" % (ant, select),".w%i" % (window))
-            anyFlagged = True
-            bp = ""
-            for time in breakPoints :
-                bp = bp + ",%s" % calculations.unconvertTime(time)
-            if(bp != "") :
-                args = []
-                if(window == "LSB" or window == "USB") :
-                    args.append(globals.Variable("vis",file,".%s" % (window)))
-                else:
-                    args.append(globals.Variable("vis",file,".w%i" % (window)))
-                args.append(globals.Variable("break",bp[1:]))
-                args.append(globals.Variable("ants",str(ant)))
-                log.run("gpbreak",args)
-
-            del breakPoints[:]
-    if(anyFlagged) :
+            context.flag("antenna'('%i')',%s" % (ant, select))
+            context.breakGains(ant)
+    if(context.anyFlagged) :
+        context.flush()
         return True
     for ant in range(1, numAnts + 1) :
         if(rms.get(ant) > p.preferences.get("maxGainRms")) :
-            if(window == "LSB" or window == "USB") :
-                applyFlagging(file, "antenna'('%i')'" % (ant),".%s" % (window))
-            else :
-                applyFlagging(file, "antenna'('%i')'" % (ant),".w%i" % (window))
-            anyFlagged = True
-    if(anyFlagged) :
+            context.flag("antenna'('%i')'" % (ant))
+    if(context.anyFlagged) :
+        context.flush()
         return True
     for ant in range(1, numAnts + 1) :
         if(means.get(ant) != 0.0 and (means.get(ant)/fullMean > p.preferences.get("maxAmplitudeGainFactor") or (means.get(ant)/fullMean < 1.0/p.preferences.get("maxAmplitudeGainFactor")))) :
-            if(window == "LSB" or window == "USB") :
-                applyFlagging(file, "antenna'('%i')'" % (ant),".%s" % (window))
-            else :
-                applyFlagging(file, "antenna'('%i')'" % (ant),".w%i" % (window))
-            anyFlagged = True
-    if(not anyFlagged) :
-        if(window == "LSB" or window == "USB") :
-            log.writeComment("%s: All gains look ok, no flaging done" % (window))
-        else :
-            log.writeComment("Window %i: All gains look ok, no flaging done" % (window))
-    return anyFlagged
+            context.flag("antenna'('%i')'" % (ant))
+    context.flush()
+    if(not context.anyFlagged) :
+        log.writeComment("%s: All gains look ok, no flaging done" % (context.label))
+    return context.anyFlagged
 
 def flagByBandpass(file,fEnd,chanList) :
     """ Method to flag visibilities based on badly behaving bandpass (phase only)
@@ -259,119 +265,105 @@ def flagByBandpass(file,fEnd,chanList) :
             True/False - whether any flagging was done
     """
     log.writeComment("Flagging on bandpass (very high phase scatter)")
-    # check for overlaps first
-    gain = []
-    rms = []
     flagAnts = []
     anyFlagged = False
-    # then read in the bandpass gains and flag as necessary
-    sys = log.run("gpplt vis=%s yaxis=phase options=bandpass log=bp.log" % (file + fEnd),[],logit=False)
-    if(sys != 0) :
+    # read in the bandpass gains (as phases) and flag as necessary
+    try :
+        freq,bpGains = gproutines.getBandpass(file + fEnd)
+    except Exception :
         log.writeComment("Cannot flag based on bandpass solution")
         return anyFlagged
-    input = open("bp.log")
-    gainsList = input.readlines()
-    input.close()
-    gainsList.reverse()
-    numAnts = 0
-    numPoints = 0
-    anyFlagged = False
+    phases = gproutines.bandpassPhases(bpGains)
+    numAnts = phases.shape[0]
     startChan = 0
     # go over each window
-    tx = []
-    ty = []
-    while(len(gainsList) > 0) :
-        line = gainsList.pop()
-        if("Number of" in line) :
-            splitLine = line.split()
-            numAnts = int(splitLine[4])
-            for j in range(0, numAnts) :
-                gain.append(0.0)
-                rms.append(0.0)
-                ty.append([])
-            continue
-        elif("#" in line) :
-            continue
-        numPoints += 1
-        splitLine = line.split()
-        tx.append(float(splitLine[0]))
-        splitLine = splitLine[1:]
-        k = 0
-        first = True
-        while(k < numAnts) :
-            if(not first) :
-                line = gainsList.pop()
-                splitLine = line.split()
-            for j in splitLine :
-                gain[k] += float(j)
-                ty[k].append(float(j))
-                rms[k] += float(j)**2
-                k += 1
-            first = False
-
-        # see if we have a good solution for each antenna
     for c in range(0,len(chanList)) :
-        x = None
-        y = []
         if(len(chanList) == 1) :
-            x = tx
-            y = ty
+            window = slice(0,len(freq))
         else :
-            numPoints = chanList[c]
-            x = tx[startChan:startChan+numPoints]
-            for k in range(0,numAnts) :
-                y.append(ty[k][startChan:startChan+numPoints])
-            startChan += numPoints
-        for k in range(0,numAnts) :
-            if(gain[k] != 0.0) :
-                y[k] = calculations.unwrap(y[k])
-                # try to fit polynomials of increasing order to the
-                # gains (this is necessary for windows that do not have
-                # phase flattening)
-                for order in range(0,4) :
-                    z = calculations.fitPoly(x,y[k],order)
-                    Nrms = calculations.getRms(x,y[k],z)
-                    if(Nrms > 50.0 and order == 3) :
-                        flagAnts.append(k+1)
-                    else :
-                        break
+            window = slice(startChan,startChan + chanList[c])
+            startChan += chanList[c]
+        # channels with no frequency or no gain are left out of the fits
+        good = numpy.logical_and(freq[window] != 0.0,(numpy.abs(bpGains[:,window].real) + numpy.abs(bpGains[:,window].imag)) > 0.0)
+        # only antennas with a solution are checked
+        ants = numpy.flatnonzero(phases[:,window].sum(axis=1) != 0.0)
+        y = calculations.unwrapRows(phases[ants,window],good[ants])
+        # fit polynomials of order 0-3 to the gains of all antennas at once (the higher orders are
+        # necessary for windows that do not have phase flattening), an antenna is bad if none of them fit
+        rms = calculations.polyRms(freq[window],y,range(0,4),good[ants])
+        with numpy.errstate(invalid="ignore") :
+            bad = (rms > 50.0).all(axis=1)
+        flagAnts += (ants[bad] + 1).tolist()
     flagAnts = list(set(flagAnts))
     # apply flagging, but only if there are not too many bad antennas
     if(len(flagAnts) > 0 and float(len(flagAnts))/float(numAnts) < 0.5) :
+        occupancy = flagOccupancy.getOccupancy(file + fEnd)
         for k in flagAnts :
-            applyFlagging(file, "antenna'('%i')'" % (k),fEnd)
+            if(occupancy.fullyFlagged("antenna'('%i')'" % (k))) :
+                continue
+            applyFlagging(file, "antenna'('%i')'" % (k),fEnd,False)
             anyFlagged = True
+        flagJournal.flush(file,fEnd)
     return anyFlagged
 
 
-""" Class for flagging bad amplitudes """
-class Amplitude :
-    def __init__(self,amp,rms) :
-        self._amp = amp
-        self._rms = rms
-
 """ Class for flagging birdies """
-class Birdie :
+class BirdieHistogram :
     def __init__(self,numChans) :
-        self._highChans = []         # list of peak channels for each integration
-        self._intTimes = []          # integration times
-        self._numInt = 0             # number of integrations
-        for i in range(0,numChans) :
-            self._highChans.append(0)
-
-    def addChans(self,chanList, time) :
-        """ Method to track peak channels
+        self._numChans = numChans
+        self._rows = dict()         # row of each baseline number
+        self._highChans = numpy.zeros((0,numChans),dtype=numpy.int64)   # number of times each channel was a peak channel, per baseline
+        self._numInt = numpy.zeros(0,dtype=numpy.int64)                  # number of integrations with peak channels, per baseline
+        self._intTimes = set()      # (baseline,time) of the integrations counted so far
+
+    def add(self,highChans,baselines,times) :
+        """ Method to track the peak channels of a data set
             input :
-                chanList - the list of peak channels from the last integration
-                time - the time of the last integration
+                highChans - dictionary of the per channel peak counts of each baseline
+                baselines - array of the baseline of each record with peak channels
+                times - array of the time of each record with peak channels
             returns :
                 none
         """
-        for chan in chanList:
-            self._highChans[chan - 1] += 1
-        if(not(time in self._intTimes)) :
-            self._numInt += 1
-            self._intTimes.append(time)
+        if(len(baselines) == 0) :
+            return
+        pairs = set(zip(numpy.asarray(baselines).tolist(),numpy.asarray(times).tolist())) - self._intTimes
+        baselines = numpy.unique(baselines).tolist()
+        new = [bl for bl in baselines if not bl in self._rows]
+        for bl in new :
+            self._rows[bl] = len(self._rows)
+        if(len(new) > 0) :
+            self._highChans = numpy.vstack((self._highChans,numpy.zeros((len(new),self._numChans),dtype=numpy.int64)))
+            self._numInt = numpy.concatenate((self._numInt,numpy.zeros(len(new),dtype=numpy.int64)))
+        for bl in baselines :
+            if(not bl in highChans) :
+                continue
+            length = min(len(highChans[bl]),self._numChans)
+            self._highChans[self._rows[bl],:length] += highChans[bl][:length]
+        self._intTimes |= pairs
+        rows = [self._rows[bl] for bl,time in pairs]
+        self._numInt += numpy.bincount(rows,minlength=len(self._numInt)).astype(numpy.int64)
+
+    def detect(self) :
+        """ Method to detect birdies
+            if a channel appears in both USB and LSB as the high channel 90% of the time then the channel is flagged
+            input :
+                none
+            returns :
+                boolean array (baseline x channel of the first half) of the birdies
+        """
+        halfChan = self._numChans / 2
+        cutoff = self._numInt.astype(numpy.float64)[:,numpy.newaxis] * 0.9 # birdies must appear in 90% of the data to be considered a birdie
+        return (self._highChans[:,:halfChan] >= cutoff) & (self._highChans[:,halfChan:2*halfChan] >= cutoff)
+
+    def birdies(self) :
+        """ Method to get the birdie channels of all baselines
+            input :
+                none
+            returns :
+                array of the birdie channels (1 based)
+        """
+        return numpy.flatnonzero(self.detect().any(axis=0)) + 1
 
 """ Methods to convert/unconvert the baseline numbers """
 def blconvert(ant1,ant2) :
@@ -395,26 +387,17 @@ def blunconvert(blNumber) :
     ant2 = blNumber % 256
     return [ant1,ant2]
 
-# ONLY FLAG ON SOURCE AND GAINCAL - they are the only ones observed long enough for this to be reasonable
-#   apply their solutions to the other calibrators based on bandwidth
-def flagBadAmps(object,objects,onlyBirdies=False) :
-    """ Method to flag bad amplitudes
-        Should only be done on source(s) and gaincal(s) as other objects will not have the s/n
-        inputs :
+def badAmpFiles(object) :
+    """ Method to get the data sets of an object which are checked for bad amplitudes
+        input :
             object - the object to work on
-            objects - the full objects list
-            onlyBirdies - True/False only flag the birdies
+        returns :
+            list of [data set name,ending] (one per window, or one per sideband for super windows)
     """
-    fileName = str(random.randint(1,100000))
-    log.writeComment("Flagging bad amplitudes (including birdies) in %s" % (object._name))
-    birdies = dict()
-    numChans = 0
+    files = []
     LSBDone = False
     USBDone = False
-    for chans in object._numChans :
-        numChans += chans
     for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
-        vis = object._file
         fEnd = ".w%i" % (window)
         if(object.haveSuper() and object.isSuper(window)) :
             if(not LSBDone) :
@@ -425,99 +408,115 @@ def flagBadAmps(object,objects,onlyBirdies=False) :
                 USBDone = True
             else :
                 continue
-        amps = dict()
-        numPoints = 0
-        avgRms = 0.0
-        avgAmp = 0.0
-        # get all of the visibility averages and rms values
-        log.run("uvlist vis=%s options=stat log=%s recnum=0" % (vis,"uvlist." + fileName),[],logit=False)
-        input = open("uvlist." + fileName)
-        dataList = input.readlines()
-        input.close()
-        dataList.reverse()
-        # accumulate the data
-        while(len(dataList) > 0) :
-            line = dataList.pop()
-            splitLine = line.split()
-            try :
-               visnum = int(splitLine[0])
-            except:
-                pass # do nothing
-            else :
-                ant1 = int(splitLine[2][:-1])
-                ant2 = int(splitLine[3])
-                blNumber = blconvert(ant1,ant2)
-                time = calculations.convertTime(splitLine[1].replace(":", ""))
-                temp = None
-                if(blNumber in amps) :
-                    temp = amps.get(blNumber)
-                else :
-                    temp = dict()
-                avgRms += float(splitLine[7])
-                avgAmp += float(splitLine[6])
-                numPoints += 1
-                temp[time] = Amplitude(float(splitLine[6]),float(splitLine[7]))
-                amps[blNumber] = temp
-                # deal with the birdies, gather all high channels
-                if(int(splitLine[9]) != 0) :
-                    line = dataList.pop()
-                    splitLine = line.split()
-                    hiChans = []
-                    for i in range(1,len(splitLine)) :
-                        hiChans.append(int(splitLine[i]))
-                    temp = None
-                    if(blNumber in birdies) :
-                        temp = birdies.get(blNumber)
-                    else :
-                        temp = Birdie(numChans)
-                    temp.addChans(hiChans,time)
-                    birdies[blNumber] = temp
-        if(not onlyBirdies) :
-            avgRms /= float(numPoints)
-            avgAmp /= float(numPoints)
-            for bl in amps :
-                detectBadAmps(bl,amps.get(bl),avgAmp,avgRms,vis,fEnd)
-    log.run("rm -rf uvlist." + fileName, [],logit=False)
+        files.append([object._file,fEnd])
+    return files
+
+def badAmpWork(vis,fEnd,onlyBirdies=False) :
+    """ Method to find the bad amplitudes and high channels of a data set, nothing is flagged or logged so
+        this can be run in a separate process
+        input :
+            vis - the data set name
+            fEnd - the ending of the data set name
+            onlyBirdies - True/False only look for the birdies
+        returns :
+            a list of the data set name and ending, the select strings of the bad amplitudes, the dictionary of the high
+            channel counts of each baseline, and arrays of the baseline and time of the records with high channels
+    """
+    # get all of the visibility averages and rms values
+    stats,highChans = uvReader.amplitudeStatistics(vis + fEnd)
+    selects = []
+    if(not onlyBirdies and len(stats) > 0) :
+        avgRms = stats["rms"].mean()
+        avgAmp = stats["amp"].mean()
+        baselines,blIndex = numpy.unique(stats["baseline"],return_inverse=True)
+        times,timeIndex = numpy.unique(stats["time"],return_inverse=True)
+        amps = numpy.empty((len(baselines),len(times)))
+        amps[:] = numpy.nan
+        amps[blIndex,timeIndex] = stats["amp"]
+        selects = badAmpIntervals(baselines,times,amps,avgAmp,avgRms)
+    high = stats[stats["nhigh"] > 0]
+    return [vis,fEnd,selects,highChans,high["baseline"].copy(),high["time"].copy()]
 
+# ONLY FLAG ON SOURCE AND GAINCAL - they are the only ones observed long enough for this to be reasonable
+#   apply their solutions to the other calibrators based on bandwidth
+def flagBadAmpsPool(jobs,objects) :
+    """ Method to flag bad amplitudes of several objects, the data sets are scanned on a process pool
+        sized to the number of CPUs and the results are applied here
+        inputs :
+            jobs - list of [object,onlyBirdies], the object to work on and True/False only flag its birdies
+            objects - the full objects list
+        returns :
+            none
+    """
+    work = []
+    for object,onlyBirdies in jobs :
+        for vis,fEnd in badAmpFiles(object) :
+            work.append([object,vis,fEnd,onlyBirdies])
+    if(len(work) == 0) :
+        return
+    pool = multiprocessing.Pool(max(1,min(util.determineNumberOfCPUs(),len(work))))
+    try :
+        pending = [pool.apply_async(badAmpWork,(vis,fEnd,onlyBirdies)) for object,vis,fEnd,onlyBirdies in work]
+        pool.close()
+        # wait for every data set before flagging, the birdie flags go to data sets still being scanned
+        results = [result.get() for result in pending]
+    except :
+        pool.terminate()
+        raise
+    pool.join()
+    for object,onlyBirdies in jobs :
+        log.writeComment("Flagging bad amplitudes (including birdies) in %s" % (object._name))
+        applyBadAmps(object,objects,[results[i] for i in range(0,len(work)) if work[i][0] is object])
+
+def applyBadAmps(object,objects,results) :
+    """ Method to apply the bad amplitude flags of an object and flag its birdies
+        inputs :
+            object - the object to work on
+            objects - the full objects list
+            results - list of the badAmpWork results of the data sets of the object
+        returns :
+            none
+    """
+    numChans = 0
+    for chans in object._numChans :
+        numChans += chans
+    histogram = BirdieHistogram(numChans)
+    for vis,fEnd,selects,highChans,baselines,times in results :
+        # deal with the birdies, gather all high channels
+        histogram.add(highChans,baselines,times)
+        for select in selects :
+            applyFlagging(vis,select,fEnd,False)
+        flagJournal.flush(vis,fEnd)
+    flagBirdies(object,objects,histogram)
+
+def flagBirdies(object,objects,histogram) :
+    """ Method to flag the birdies found in an object, on all objects with matching windows
+        inputs :
+            object - the object the birdies were found in
+            objects - the full objects list
+            histogram - the BirdieHistogram of the object
+        returns :
+            none
+    """
     # do birdie detection
-    for bl in birdies :
-        birdieList = birdieDetect(birdies.get(bl))
-        if(len(birdieList) == 0) :
-            log.writeComment("No birdies found in %s" % (object._name))
-            return
-        for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
-            flagString = ""
-            bw = object._bandwidths[window - 1]
-            nchan = object._numChans[window - 1]
-            isSuper = False
-            for chan in birdieList :
-                if(chan >= object._channels[window - 1] and chan < (object._channels[window - 1] + nchan)) :
-                    if(object.isSuper(window)) :
-                        allSuper = True
-                        nonList = []
-                        chanShift = 0
-                        for w in range(globals.STARTWINDOW,window) :
-                            allSuper = allSuper and object.isSuper(w)
-                        if(not allSuper) :
-                            for w in nonList :
-                                chanShift += object._channels[w - 1]
-                        flagstring = flagString + "|channel,1,%i,1,1" % (chan - chanShift + 1)
-                    else :
-                        flagString = flagString + "|channel,1,%i,1,1" % (chan - object._channels[window - 1] + 1)
-            if(flagString == "") :
-                continue
-            for source in objects._sources :
-                if(source._bandwidths[window - 1] == bw and source._numChans[window - 1] == nchan) :
-                    flagBirdie(source._file,flagString,".w%i" % (window))
-            for fcal in objects._fluxcals :
-                if(fcal._bandwidths[window - 1] == bw and fcal._numChans[window - 1] == nchan) :
-                    flagBirdie(fcal._file,flagString,".w%i" % (window))
-            for pcal in objects._passcals :
-                if(pcal._hybrid) :
-                    if(pcal._hybridConf.get(bw)) :
-                        flagBirdie(pcal._file,flagString,".%i.w%i" % (bw,window))
-                else :
-                    flagBirdie(pcal._file,flagString,".w%i" % (window))
+    birdieList = histogram.birdies()
+    if(len(birdieList) == 0) :
+        log.writeComment("No birdies found in %s" % (object._name))
+        return
+    targets = birdieTargets(objects)
+    for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
+        # super windows are not flagged
+        if(object.isSuper(window)) :
+            continue
+        bw = object._bandwidths[window - 1]
+        nchan = object._numChans[window - 1]
+        start = object._channels[window - 1]
+        chans = birdieList[(birdieList >= start) & (birdieList < start + nchan)]
+        if(len(chans) == 0) :
+            continue
+        flagString = "|".join(["channel,1,%i,1,1" % (chan - start + 1) for chan in chans])
+        for file,endString in birdieLookup(targets,window,bw,nchan) :
+            flagBirdie(file,flagString,endString)
 
 def flagBirdie(file,flagString,endString) :
     """ Method to flag birides
@@ -529,67 +528,79 @@ def flagBirdie(file,flagString,endString) :
     """
     if(flagString == "") :
         return
-    splitLine = flagString.split("|")
-    for i in splitLine :
-        args = []
-        args.append(globals.Variable("vis",file,endString))
-        args.append(globals.Variable("line",str(i)))
-        args.append(globals.Variable("flagval","flag"))
-        log.run("uvflag",args)
+    journal = flagJournal.getJournal(file,endString)
+    for i in flagString.split("|") :
+        if(i != "") :
+            journal.add(line=str(i))
+    journal.apply()
 
-def birdieDetect(baseline) :
-    """ Method to detect birdies
-        if a channel appears in both USB and LSB as the high channel 90% of the time then the channel is flagged
+def birdieTargets(objects) :
+    """ Method to build the table of data sets which birdie flags are applied to
         input :
-            baseline - the baseline number
+            objects - the full objects list
         returns :
-            list of birdies
+            dictionary keyed on (window,bandwidth) of lists of [number of channels (None for any),file,ending],
+            bandwidth is None for the data sets which take all bandwidths
     """
-    halfChan = len(baseline._highChans) / 2
-    cutoff = float(baseline._numInt) * 0.9 # birdies must appear in 90% of the data to be considered a birdie
-    birdieList = []
-    for chan in range(1, halfChan + 1) :
-        if(baseline._highChans[chan - 1] >= cutoff and baseline._highChans[chan - 1 + halfChan] >= cutoff) :
-            birdieList.append(chan)
-    return birdieList
-
-def detectBadAmps(baseline,data,avgAmp,avgRms,visFile,fEnd) :
-    """ Method to detect bad amplitides by time
-        any amplitude which is > 2*rms from the average amplitude gets flagged
+    targets = dict()
+    for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
+        for obj in objects._sources + objects._fluxcals :
+            key = (window,obj._bandwidths[window - 1])
+            targets.setdefault(key,[]).append([obj._numChans[window - 1],obj._file,".w%i" % (window)])
+        for pcal in objects._passcals :
+            if(pcal._hybrid) :
+                for bw in pcal._hybridConf :
+                    if(pcal._hybridConf.get(bw)) :
+                        targets.setdefault((window,bw),[]).append([None,pcal._file,".%i.w%i" % (bw,window)])
+            else :
+                targets.setdefault((window,None),[]).append([None,pcal._file,".w%i" % (window)])
+    return targets
+
+def birdieLookup(targets,window,bw,nchan) :
+    """ Method to get the data sets which birdie flags of a window are applied to
         input :
-            baseline - the baseline number
-            data - the list of amplitudes
+            targets - the table from birdieTargets
+            window - the window number
+            bw - the bandwidth of the window
+            nchan - the number of channels in the window
+        returns :
+            list of [file,ending]
+    """
+    found = []
+    for chans,file,endString in targets.get((window,bw),[]) + targets.get((window,None),[]) :
+        if(chans == None or chans == nchan) :
+            found.append([file,endString])
+    return found
+
+def badAmpIntervals(baselines,times,amps,avgAmp,avgRms) :
+    """ Method to find the time intervals of bad amplitudes, all baselines are done at once
+        any amplitude which is > 2*rms from the average amplitude is bad
+        input :
+            baselines - the baseline numbers
+            times - the times (sorted)
+            amps - array (baselines,times) of the amplitudes (NaN where a baseline has no data)
             avgAmp - average amplitude
             avgRms - average rms
-            visFile - the visibility file
         returns :
-            none
+            list of the uvflag select strings, one per baseline with bad amplitudes
     """
-    first = True
-    start = 0.0
-    end = 0.0
-    flagString = ""
-    times = data.keys()
-    times.sort()
-    for time in times :
-        datum = data.get(time)
-        if(abs(datum._amp - avgAmp) > 2.0 * avgRms) :
-            if(first) :
-                start = time - 1.0/3600.0
-                first = False
-            if(time == times[-1]) :
-                end = time + 1.0/3600.0
-                flagString = flagString + ",time'('%s,%s')'" % (calculations.unconvertTime(start),calculations.unconvertTime(end))
-        else :
-            if(start != 0.0) :
-                end = time - 1.0/3600.0
-                flagString = flagString + ",time'('%s,%s')'" % (calculations.unconvertTime(start),calculations.unconvertTime(end))
-                start = 0.0
-                end = 0.0
-                first = True
-    if(flagString != "") :
-        bl = blunconvert(baseline)
-        applyFlagging(visFile,"antennae'('%i,%i')',%s" % (bl[0],bl[1],flagString[1:]),fEnd)
+    valid = numpy.isfinite(amps)
+    bad = calculations.outliers(amps,avgAmp,avgRms,2.0)
+    rows,starts,ends,nexts = calculations.runIntervals(bad,valid)
+    # each bad interval runs from 1 second before the first bad time to 1 second before the next good time
+    # (or 1 second after the last time)
+    startTimes = times[starts] - 1.0/3600.0
+    endTimes = numpy.where(nexts >= 0,times[numpy.maximum(nexts,0)] - 1.0/3600.0,times[ends] + 1.0/3600.0)
+    startTimes = calculations.unconvertTimes(startTimes)
+    endTimes = calculations.unconvertTimes(endTimes)
+    flagStrings = dict()
+    for i in range(0,len(rows)) :
+        flagStrings.setdefault(rows[i],[]).append("time'('%s,%s')'" % (startTimes[i],endTimes[i]))
+    selects = []
+    for row in sorted(flagStrings) :
+        bl = blunconvert(int(baselines[row]))
+        selects.append("antennae'('%i,%i')',%s" % (bl[0],bl[1],",".join(flagStrings[row])))
+    return selects
 
 def flagTsys(file) :
     """ Method to flag the system temperatures of uv data
@@ -618,3 +629,49 @@ def flagElevation(file) :
     args.append(globals.Variable("select","'elev(85,90)'"))
     args.append(globals.Variable("flagval","flag"))
     log.run("uvflag",args)
+
+def flagTsysShadowingElevation(file) :
+    """ Method to flag high system temperatures, shadowing and high elevations in a single pass through the
+        data (see flagTsys, flagShadowing and flagElevation), checks whose uv variables are not in the data
+        are done with the miriad tasks
+        input :
+            file - the file to flag
+        returns :
+            none
+    """
+    fractions = [p.preferences.get("OVROShadowFraction"),p.preferences.get("BIMAShadowFraction"),p.preferences.get("SZAShadowFraction")]
+    checks = preFlagging.availableChecks(file)
+    flagJournal.flush(file)
+    counts = preFlagging.preFlag(file,checks,p.preferences.get("tsysThreshold"),[85.0,90.0],fractions)
+    # record the equivalent miriad commands in the script
+    if(preFlagging.TSYS in checks) :
+        log.writeComment("Flagging high system temperatures. Cutoff is %i K (%i records flagged)" % (p.preferences.get("tsysThreshold"),counts[preFlagging.TSYS]))
+        args = []
+        args.append(globals.Variable("vis",file))
+        args.append(globals.Variable("tsys",str(p.preferences.get("tsysThreshold"))))
+        args.append(globals.Variable("flagval","flag"))
+        log.run("uvflag",args,execute=False)
+    else :
+        flagTsys(file)
+    log.writeAll("\n")
+    if(preFlagging.SHADOWING in checks) :
+        log.writeComment("Flagging shadowed data with the following options: OVRO shadow fraction %f, BIMA shadow fraction %f, SZA shadow fraction %f (%i records flagged)" % (fractions[0],fractions[1],fractions[2],counts[preFlagging.SHADOWING]))
+        args = []
+        args.append(globals.Variable("vis",file))
+        args.append(globals.Variable("carma","true"))
+        args.append(globals.Variable("cfraction",",".join([str(fraction) for fraction in fractions])))
+        args.append(globals.Variable("sarray","0"))
+        log.run("csflag",args,execute=False)
+    else :
+        flagShadowing(file)
+    log.writeAll("\n")
+    if(preFlagging.ELEVATION in checks) :
+        log.writeComment("Flagging data taken at high elevations (between 85 and 90 deg) (%i records flagged)" % (counts[preFlagging.ELEVATION]))
+        args = []
+        args.append(globals.Variable("vis",file))
+        args.append(globals.Variable("select","'elev(85,90)'"))
+        args.append(globals.Variable("flagval","flag"))
+        log.run("uvflag",args,execute=False)
+    else :
+        flagElevation(file)
+    flagOccupancy.getOccupancy(file).writeSummary()
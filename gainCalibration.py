@@ -1,6 +1,7 @@
 import logger as log
 import flagging
 import calculations
+import gproutines
 from threading import Thread
 import random
 import globals
@@ -15,25 +16,6 @@ Part of the CARMA data reduction pipeline
 Author: D. N. Friedel
 """
 
-class continuumThread(Thread) :
-    def __init__(self,objects,refant,window) :
-        Thread.__init__(self)
-        self.objects = objects
-        self.refant = refant
-        self.window = window
-    def run(self) :
-        continuum(self.objects, self.refant, self.window)
-
-class bootstrapThread(Thread) :
-    def __init__(self,objects,refant,refWindow,window) :
-        Thread.__init__(self)
-        self.objects = objects
-        self.refant = refant
-        self.refWindow = refWindow
-        self.window = window
-    def run(self) :
-        bootstrap(self.objects, self.refant, self.refWindow, self.window)
-
 class bootcalThread(Thread) :
     def __init__(self,objects,gcal,refant,refWindow,window) :
         Thread.__init__(self)
@@ -229,6 +211,8 @@ def continuum(objects, refant, window) :
                 log.writeComment("Flagging any bad gains")
                 while(not allGood and count < 15) :
                     sys = log.run("mselfcal vis=%s interval=%f options=amplitude,apriori,noscale refant=%i line=chan,1,%i,%i" % (gcal._file + "." + sideband,p.preferences.get("selfcalInterval"), refant, startChan,numChans),[],logit=False)
+                    # mselfcal rewrote the gains in place, so they must be read again
+                    gproutines.invalidateTables(gcal._file + "." + sideband)
                     allGood = (not flagging.flagByGains(gcal._file, sideband)) or (sys != 0)
                     count += 1
                 if(sys == 0) :
@@ -271,6 +255,8 @@ def continuum(objects, refant, window) :
                 log.writeComment("Flagging any bad gains")
                 while(not allGood and count < 15) :
                     sys = log.run("mselfcal vis=%s interval=%f options=amplitude,noscale flux=%f refant=%i line=chan,1,%i,%i" % (gcal._file + ".%s" %(sideband), p.preferences.get("selfcalInterval"),gcal._flux, refant, startChan, numChans),[],logit=False)
+                    # mselfcal rewrote the gains in place, so they must be read again
+                    gproutines.invalidateTables(gcal._file + ".%s" %(sideband))
                     allGood = (not flagging.flagByGains(gcal._file, sideband)) or (sys != 0)
                     count += 1
                 if(sys == 0) :
@@ -320,6 +306,8 @@ def continuum(objects, refant, window) :
                 log.writeComment("Flagging any bad gains")
                 while(not allGood and count < 15) :
                     sys = log.run("mselfcal vis=%s interval=%f options=amplitude,apriori,noscale refant=%i line=chan,1,%i,%i" % (gcal._file + ".w%i" %(window),p.preferences.get("selfcalInterval"), refant, startChan,numChans),[],logit=False)
+                    # mselfcal rewrote the gains in place, so they must be read again
+                    gproutines.invalidateTables(gcal._file + ".w%i" %(window))
                     allGood = (not flagging.flagByGains(gcal._file, window)) or (sys != 0)
                     count += 1
                 if(sys == 0) :
@@ -366,6 +354,8 @@ def continuum(objects, refant, window) :
                 log.writeComment("Flagging any bad gains")
                 while(not allGood and count < 15) :
                     sys = log.run("mselfcal vis=%s interval=%f options=amplitude,noscale flux=%f refant=%i line=chan,1,%i,%i" % (gcal._file + ".w%i" %(window), p.preferences.get("selfcalInterval"),gcal._flux, refant, startChan, numChans),[],logit=False)
+                    # mselfcal rewrote the gains in place, so they must be read again
+                    gproutines.invalidateTables(gcal._file + ".w%i" %(window))
                     allGood = (not flagging.flagByGains(gcal._file, window)) or (sys != 0)
                     count += 1
                 if(sys == 0) :
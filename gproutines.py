@@ -1,6 +1,10 @@
 import calculations
 import math
 import random
+import os
+import threading
+import numpy
+import miriad_functions as mfunc
 from pipeline_miriadwrap import *
 
 """
@@ -8,6 +12,14 @@ Module for reading in gains from a miriad data set
 behaves like gplist with options=amp
 """
 
+# parsed gains and bandpass tables keyed on (path,item), each entry is [key,table], the key is the size and
+# modification time of the items the table is read from, so a table rewritten by a miriad task is read again
+tableCache = dict()
+tableOrder = []             # keys of tableCache, least recently used first
+tableLock = threading.Lock()
+tableCounts = {"hits" : 0, "misses" : 0}
+TABLE_ITEMS = {"gains" : ["gains","header"], "bandpass" : ["bandpass","freqs","header"]}
+
 class Gains:
     """
     Class to hold the gains for all antennas and a time stamp
@@ -22,6 +34,100 @@ class Gains:
     def getFreq(self) :
         return self.label
 
+def rdhdi_np(header,item,default=0) :
+    """ Method to get an integer header item, like rdhdi but from a parsed header
+        input :
+            header - the Header object (see miriad_functions.readHeader)
+            item - the name of the item
+            default - the value to return if the item is not present
+        returns :
+            the value of the item
+    """
+    if(header.getType(item) == "none") :
+        return default
+    return header.getValue(item)
+
+class GainsTable :
+    """
+    Class to hold the whole gains table of a miriad data set
+    """
+    def __init__(self,file) :
+        """ Initializer, reads the gains table in a single read
+            file - the name of the uv data set
+        """
+        if(not os.path.exists(file)) :
+            raise Exception, "File %s not found" % (file)
+        if(not os.path.exists(file + "/gains")) :
+            raise Exception,  "No gains present in %s" % (file)
+        header = mfunc.readHeader(file)
+        ngains = rdhdi_np(header,"ngains")
+        nfeeds = rdhdi_np(header,"nfeeds",1)
+        ntau = rdhdi_np(header,"ntau")
+        if(nfeeds <= 0 or nfeeds > 2 or ngains%(nfeeds+ntau)!= 0 or ntau > 1 or ntau < 0) :
+            raise Exception, "Bad number of gains or feeds in %s" % (file)
+        self.file = file
+        self.nfeeds = nfeeds
+        self.ntau = ntau
+        self.nants = ngains / (nfeeds + ntau)
+        # each solution is a double time followed by ngains complex gains
+        solution = numpy.dtype([("time",">f8"),("gains",">c8",(ngains,))])
+        input = open(file + "/gains","rb")
+        input.seek(8)
+        buffer = input.read()
+        input.close()
+        nsols = len(buffer) / solution.itemsize
+        table = numpy.frombuffer(buffer,dtype=solution,count=nsols)
+        self.times = table["time"].astype(numpy.float64)
+        self.gains = table["gains"].astype(numpy.complex128).reshape(nsols,self.nants,nfeeds + ntau)
+        # the tables are shared through the cache, so they must not be changed
+        self.times.setflags(write=False)
+        self.gains.setflags(write=False)
+
+    def amplitudes(self) :
+        """ Method to get the gain amplitudes of the first feed of each antenna
+            input :
+                none
+            returns :
+                an array (nsols,nants) of the amplitudes
+        """
+        return numpy.abs(self.gains[:,:,0])
+
+    def labels(self) :
+        """ Method to get the time of each solution
+            input :
+                none
+            returns :
+                a list of the solution times in the form of hh:mm:ss.s
+        """
+        return calculations.julianToTime(self.times)
+
+    def statistics(self) :
+        """ Method to calculate the mean, median and rms of the gain amplitude of each antenna,
+            only non-zero amplitudes are used
+            input :
+                none
+            returns :
+                arrays (nants) of the mean, median and rms gains, an antenna with less than 3 good
+                solutions has a median and rms of 0.0
+        """
+        amps = self.amplitudes()
+        good = amps > 0.0
+        count = good.sum(axis=0)
+        total = numpy.where(good,amps,0.0).sum(axis=0)
+        squares = numpy.where(good,amps**2,0.0).sum(axis=0)
+        mean = total/numpy.maximum(count,1)
+        # the zeros sort to the end, the median is element count/2 of the good amplitudes sorted high to low
+        ordered = numpy.sort(numpy.where(good,amps,numpy.inf),axis=0)
+        median = numpy.zeros(self.nants)
+        rms = numpy.zeros(self.nants)
+        enough = count > 2
+        if(enough.any()) :
+            ants = numpy.arange(self.nants)[enough]
+            n = count[enough]
+            median[enough] = ordered[n - 1 - n/2,ants]
+            rms[enough] = numpy.sqrt(numpy.maximum((squares[enough] - n*mean[enough]**2)/(n - 1),0.0))
+        return mean,median,rms
+
 def gplist(file):
     """Method to list the amplitude gains for a uv data set
         input :
@@ -29,111 +135,42 @@ def gplist(file):
         returns :
             The gains, mean gain, median gain, and gain rms as a tuple
     """
-    # open the file
-    handle, iostat = hopen(file, "old")
-    if(iostat != 0):
-        raise Exception, "File %s not found" % (file)
-    if(not hexists(handle, "gains")):
-        raise Exception,  "No gains present in %s" % (file)
-    ngains = rdhdi(handle, "ngains")
-    nfeeds = rdhdi(handle, "nfeeds", 1)
-    ntau = rdhdi(handle, "ntau")
-    if(nfeeds <= 0 or nfeeds > 2 or ngains%(nfeeds+ntau)!= 0 or ntau > 1 or ntau < 0) :
-        raise Exception, "Bad number of gains or feeds in %s" % (file)
-    nants = ngains / (nfeeds + ntau)
-    nantsd = nants
-    antsd = [0] * nants
-    for i in range(0,nants) :
-        antsd[i] = i + 1
-    # do the work
-    tGains, iostat = haccess(handle,"gains","read")
-    if(iostat != 0) :
-        raise Exception, "Error opening gains table in %s" % (file)
-    nsols = (hsize(tGains)-8)/(8*nants*(nfeeds+ntau)+8)
-    ngains = nants*(nfeeds+ntau)
-    offset = 8
-    pnt = 0
-    time = [0.0] * nsols
-    gains = [complex()] * 100000
-    for i in range(0,nsols) :
-        temp,iostat = hreadd(tGains,offset,8)
-        time[i] = temp[0]
-        offset += 8
-        if(iostat == 0) :
-            temp,iostat = hreadr(tGains,offset,8*ngains)
-        for j in range(0,ngains*2,2) :
-            gains[pnt + (j/2)] = complex(temp[j],temp[j+1])
-        pnt += ngains
-        offset = offset + 8*ngains
-        if(iostat != 0) :
-            raise Exception, "Error reading gain table of %s" % (file)
-    radtodeg=180.0/3.14159
-    iostat = hdaccess(tGains)
-    if(iostat != 0) :
-        raise Exception, "Error closing gain table in %s" % (file)
-    MeanGain = [0.0] * (nants)
-    MednGain = [0.0] * (nants)
-    GainRms = [0.0] * (nants)
-    MedArr = [0.0] * (nsols)
-    jant = [0] * (nants)
-    GainArr = []
-    for i in range(0,nants) :
-        GainArr.append([0.0]* nsols)
+    table = getGainsTable(file)
+    amps = table.amplitudes()
+    MeanGain,MednGain,GainRms = table.statistics()
     gainList = []
-    for i in range(0,nsols) :
-        calday = julday(time[i],'H').strip()
-        ctime = calday[8:18]
-        Gain = Gains(ctime)
-        for m in range(0,nantsd) :
-            Gain.addGain(antsd[m],calculations.cabs(gains[i*nants+antsd[m] - 1]))
-        for j in range(0,nants) :
-            if (calculations.cabs(gains[i*nants+j]) > 0.0) :
-                MeanGain[j] += calculations.cabs(gains[i*nants+j])
-                GainRms[j] += calculations.cabs(gains[i*nants+j]**2)
-                GainArr[j][jant[j]]= calculations.cabs(gains[i*nants+j])
-                jant[j] += 1
+    labels = table.labels()
+    for i in range(0,len(labels)) :
+        Gain = Gains(labels[i])
+        Gain.gains = dict(zip(range(1,table.nants + 1),amps[i].tolist()))
         gainList.append(Gain)
-    doMed = False
-    for j in range(0,nants) :
-        if(jant[j] > 0) :
-            MeanGain[j] = MeanGain[j]/jant[j]
-        if(jant[j] > 2) :
-            doMed = True
-            for k in range(0,jant[j]) :
-                MedArr[k] = GainArr[j][k]
-            jind = calculations.sortidx(MedArr)
-            MednGain[j]=MedArr[jind[int(jant[j]/2)]]
-            GainRms[j]=math.sqrt((GainRms[j]- jant[j]*MeanGain[j]*MeanGain[j])/(jant[j]-1))
-        else :
-            GainRms[j]=0.0
-    hclose(handle)
     # convert outputs to dictionary
     mean = dict()
     median = dict()
     rms = dict()
-    for i in range(0,nants) :
-        mean[i+1] = MeanGain[i]
-        median[i+1] = MednGain[i]
-        rms[i+1] = GainRms[i]
+    for i in range(0,table.nants) :
+        mean[i+1] = float(MeanGain[i])
+        median[i+1] = float(MednGain[i])
+        rms[i+1] = float(GainRms[i])
     return gainList,mean,median,rms
 
-def gpplt(file) :
-    """ python version of miriad's gpplt
+def readBandpass(file) :
+    """ Method to read the bandpass table of a uv data set, the gains are inverted (as gpplt does)
         input :
-            file -  the file to work on
+            file - the name of the uv data set
         returns :
-            a list of the gains
+            an array of the channel frequencies and an array (nants*nfeeds,nchan) of the complex gains
     """
-    handle, iostat = hopen(file, "old")
-    if(iostat != 0):
+    if(not os.path.exists(file)) :
         raise Exception, "File %s not found" % (file)
-    if(not hdprsnt(handle, "bandpass")):
+    if(not os.path.exists(file + "/bandpass")):
         raise Exception,  "No bandpass present in %s" % (file)
-    nfeeds = rdhdi(handle,"nfeeds",1)
-    ngains = rdhdi(handle,"ngains",1)
-    ntau = rdhdi(handle,"ntau")
-    nchan = rdhdi(handle,"nchan0")
-    nspect = rdhdi(handle,"nspect0")
+    header = mfunc.readHeader(file)
+    nfeeds = rdhdi_np(header,"nfeeds",1)
+    ngains = rdhdi_np(header,"ngains",1)
+    ntau = rdhdi_np(header,"ntau")
+    nchan = rdhdi_np(header,"nchan0")
+    nspect = rdhdi_np(header,"nspect0")
     if(nfeeds <= 0 or ngains <= 0) :
         raise Exception, "Bad gain table size information"
     nants = ngains / (nfeeds+ntau)
@@ -143,67 +180,181 @@ def gpplt(file) :
         raise Exception, "Bad number of frequencies"
     if(nspect <= 0 or nspect > nchan) :
         raise Exception, "Bad number of frequency spectral windows"
-    item, iostat = haccess(handle,"freqs","read")
-    if(iostat != 0) :
+    # each window is the number of channels (padded to 8 bytes), the start frequency and the channel width
+    window = numpy.dtype([("nschan",">i4"),("pad",">i4"),("sfreq",">f8"),("sdf",">f8")])
+    try :
+        input = open(file + "/freqs","rb")
+    except IOError :
         raise Exception, "Error accessing the bandpass frequency table"
+    input.seek(8)
+    buffer = input.read()
+    input.close()
+    windows = numpy.frombuffer(buffer,dtype=window,count=len(buffer)/window.itemsize)
+    if(len(windows) < nspect) :
+        raise Exception, "Error reading bandpass frequency table"
+    freq = numpy.zeros(nchan)
     n = 0
-    off = 8
-    freq = [0.0] * nspect*nchan
-    select = [True] * nspect
     for i in range(0,nspect) :
-        nschan,iostat = hreadi(item,off,4)
-        off = off + 8
-        if(iostat == 0) :
-            freqs,iostat = hreadd(item,off,2*8)
-            print freqs,iostat
-        off = off + 2*8
-        if(iostat != 0) :
-            raise Exception, "Error reading bandpass frequency table"
-        for j in range(1,nschan[0] + 1) :
-            freq[n] = freqs[0] + (j-1)*freqs[1]
-            n += 1
-    iostat = hdaccess(item)
-    if(iostat != 0) :
-        raise Exception, "" + iostat
-    item,iostat = haccess(handle,'bandpass','read')
-    if(iostat != 0) :
-        raise Exception, "Error accessing the bandpass table"
-
-    off = 8
-    temp,iostat = hreadr(item,off,8*nants*nfeeds*nchan)
-    pnt = 0
-    Gains2 = [complex(0.0,0.0)] * (nants*nfeeds*nchan)
-    for j in range(0,nants*nfeeds*nchan*2,2) :
-        Gains2[pnt + (j/2)] = complex(temp[j],temp[j+1])
-    pnt += nants*nfeeds*nchan
-    if(iostat != 0) :
+        nschan = min(int(windows["nschan"][i]),nchan - n)
+        freq[n:n + nschan] = windows["sfreq"][i] + numpy.arange(nschan)*windows["sdf"][i]
+        n += nschan
+    gains = numpy.fromfile(file + "/bandpass",dtype=">c8")[1:]
+    if(len(gains) < nants*nfeeds*nchan) :
         raise Exception, "Error reading the bandpass table"
-    iostat = hdaccess(item)
-    if(iostat != 0) :
-        raise Exception, "" + iostat
-
-    offi = 0
-    for k in range(0,nants) :
-        for j in range(0,nfeeds) :
-            for i in range(0,nchan) :
-                if(abs(Gains2[offi].real) + abs(Gains2[offi].imag) > 0.0) :
-                    Gains2[offi] = 1.0/Gains2[offi]
-                offi += 1
-    offi -= 1
-    Value = [0] * (nants*nfeeds)
+    gains = gains[:nants*nfeeds*nchan].astype(numpy.complex128).reshape(nants*nfeeds,nchan)
+    good = (numpy.abs(gains.real) + numpy.abs(gains.imag)) > 0.0
+    gains[good] = 1.0/gains[good]
+    return freq,gains
+
+def tableKey(file,table) :
+    """ Method to get the cache key of a gains or bandpass table
+        input :
+            file - the name of the uv data set
+            table - the table ("gains" or "bandpass")
+        returns :
+            a list of the name, size and modification time of each item the table is read from
+    """
+    key = []
+    for item in TABLE_ITEMS[table] :
+        if(os.path.exists(file + "/" + item)) :
+            stat = os.stat(file + "/" + item)
+            key.append((item,stat.st_size,stat.st_mtime))
+    return key
+
+def cachedTable(file,table,reader) :
+    """ Method to get a table from the cache, reading it if it is not there or the items it is read from
+        have changed, the cache is shared by all threads
+        input :
+            file - the name of the uv data set
+            table - the table ("gains" or "bandpass")
+            reader - the function which reads the table, called with the name of the data set
+        returns :
+            the table, as returned by reader (shared, so it must not be changed)
+    """
+    path = os.path.abspath(file)
+    if(not os.path.exists(path + "/" + table)) :
+        # let the reader report the problem
+        return reader(file)
+    name = (path,table)
+    key = tableKey(path,table)
+    tableLock.acquire()
+    try :
+        if(name in tableCache and tableCache[name][0] == key) :
+            tableOrder.remove(name)
+            tableOrder.append(name)
+            tableCounts["hits"] += 1
+            return tableCache[name][1]
+        tableCounts["misses"] += 1
+    finally :
+        tableLock.release()
+    value = reader(file)
+    tableLock.acquire()
+    try :
+        if(name in tableCache) :
+            tableOrder.remove(name)
+        tableCache[name] = [key,value]
+        tableOrder.append(name)
+        while(len(tableOrder) > mfunc.MAXCACHE) :
+            del tableCache[tableOrder.pop(0)]
+    finally :
+        tableLock.release()
+    return value
+
+def getGainsTable(file) :
+    """ Method to get the gains table of a uv data set through the table cache
+        input :
+            file - the name of the uv data set
+        returns :
+            a GainsTable object (shared, so it must not be changed)
+    """
+    return cachedTable(file,"gains",GainsTable)
 
+def readSharedBandpass(file) :
+    """ Method to read the bandpass table of a uv data set for the table cache, the arrays are made read only
+        input :
+            file - the name of the uv data set
+        returns :
+            an array of the channel frequencies and an array (nants*nfeeds,nchan) of the complex gains
+    """
+    freq,gains = readBandpass(file)
+    freq.setflags(write=False)
+    gains.setflags(write=False)
+    return freq,gains
+
+def getBandpass(file) :
+    """ Method to get the bandpass table of a uv data set through the table cache
+        input :
+            file - the name of the uv data set
+        returns :
+            an array of the channel frequencies and an array (nants*nfeeds,nchan) of the complex gains
+            (shared, so they must not be changed)
+    """
+    return cachedTable(file,"bandpass",readSharedBandpass)
+
+def invalidateTables(file=None) :
+    """ Method to drop the cached tables of a data set, or of all data sets
+        input :
+            file - the name of the uv data set (None for all data sets)
+        returns :
+            none
+    """
+    tableLock.acquire()
+    try :
+        for name in tableOrder[:] :
+            if(file == None or name[0] == os.path.abspath(file)) :
+                del tableCache[name]
+                tableOrder.remove(name)
+    finally :
+        tableLock.release()
+
+def tableSummary() :
+    """ Method to get a summary of the use of the table cache
+        input :
+            none
+        returns :
+            a string with the number of hits and misses
+    """
+    tableLock.acquire()
+    try :
+        hits = tableCounts["hits"]
+        misses = tableCounts["misses"]
+    finally :
+        tableLock.release()
+    return "Gains/bandpass table cache: %i hits, %i misses" % (hits,misses)
+
+def bandpassPhases(gains) :
+    """ Method to get the phases (in degrees) of the bandpass gains, unwrapped along each spectrum in
+        the same way as GetPhase (channels with no gain have a phase of 0.0)
+        input :
+            gains - an array (nants*nfeeds,nchan) of the complex gains
+        returns :
+            an array (nants*nfeeds,nchan) of the phases
+    """
+    good = (numpy.abs(gains.real) + numpy.abs(gains.imag)) > 0.0
+    phases = numpy.where(good,numpy.degrees(numpy.arctan2(gains.imag,gains.real)),0.0)
+    # the unwrapping depends on the previous channels, so step along the channels doing all spectra at once
+    pPhase = numpy.zeros(gains.shape[0])
+    for chan in range(0,gains.shape[1]) :
+        phase = phases[:,chan]
+        phase -= 360 * numpy.trunc((phase - pPhase)/360.)
+        phase[numpy.logical_not(good[:,chan])] = 0.0
+        pPhase = numpy.where(good[:,chan],0.5*(phase + pPhase),pPhase)
+    return phases
+
+def gpplt(file) :
+    """ python version of miriad's gpplt
+        input :
+            file -  the file to work on
+        returns :
+            a list of the gains
+    """
+    freq,gains = getBandpass(file)
+    y = bandpassPhases(gains)
     gainList = []
-    y = [0.0] * (nants*nfeeds*nchan)
-    for ichan in range(0,nchan) :
-        offset = 0
-        for iant in range(0,nants) :
-            for ifeed in range(0,nfeeds) :
-                Gn = Gains2[ichan+nchan*offset]
-                y[offset],Value[offset] = GetPhase(Gn,Value[offset])
-                offset = offset + 1
+    ants = range(1,y.shape[0] + 1)
+    for ichan in range(0,y.shape[1]) :
         temp = Gains(freq[ichan])
-        for ant in range(0,nfeeds*nants) :
-            temp.addGain(ant+1,y[ant])
+        temp.gains = dict(zip(ants,y[:,ichan].tolist()))
         gainList.append(temp)
     return gainList
 
@@ -5,11 +5,11 @@ import calculations
 import math
 import globals
 import startupTeardown
-from threading import Thread
 import random
 import peakLocator
 import continuumSubtraction
 import miriadClasses
+import scheduler
 from copy import deepcopy
 
 try :
@@ -22,6 +22,7 @@ imsize = None
 continDone = False
 regions = dict()
 rmsList = dict()
+IMAGE_COPIES = 4        # images of each window held at once (map, beam, model and restored), for the memory estimates
 
 """
 Module to invert uv data and produce images
@@ -30,36 +31,6 @@ Current Version (this file): 1.1
 Released with pipeline version: 1.1
 Author: D. N. Friedel
 """
-class invertWindowThread(Thread) :
-    def __init__(self,source,window,iterate,AvgBaseline = 0,csub = False) :
-        Thread.__init__(self)
-        self.source = source
-        self.window = window
-        self.iterate = iterate
-        self.avgBaseline = AvgBaseline
-        self.csub = csub
-    def run(self) :
-        invert(self.source,self.window,self.iterate,self.csub,self.avgBaseline)
-
-class cleanWindowThread(Thread) :
-    def __init__(self,source,window,csub = False) :
-        Thread.__init__(self)
-        self.source = source
-        self.window = window
-        self.csub = csub
-    def run(self) :
-        cleanWindow(self.source,self.window,self.csub)
-
-class invertContinuumThread(Thread) :
-    def __init__(self,objects, obsFreq, avgBaseline ,window) :
-        Thread.__init__(self)
-        self.objects = objects
-        self.window = window
-        self.obsFreq = obsFreq
-        self.avgBaseline = avgBaseline
-    def run(self) :
-        invertContinuum(self.objects, self.obsFreq, self.avgBaseline, [self.window], individual = True)
-
 
 def invert(source,window,iterate,csub,avgBaseline = 0) :
     """ Method to invert a spectral window
@@ -635,6 +606,20 @@ def invertContinuum(objects, obsFreq, avgBaseline, windows, individual = False)
             log.writeComment("Data reduction of %s complete. Final map(%s.finalmap) has a noise level of %f Jy/beam" % (source._name, fileName + end, rms))
             startupTeardown.endFile("%s.finalmap" % (fileName + end))
 
+def setCleanRegion(source) :
+    """ Method to set the clean region of a source from the regions found in each window
+        input :
+            source - the source data
+        returns :
+            none
+    """
+    if(len(regions) > 0) :
+        # get clean region
+        regions[0] = source.getContinuumCleanRegion()
+        source.setCleanRegion(peakLocator.compactCleanRegions(regions,[imsize,imsize]))
+    log.writeComment("Cleaning images to %f times the noise level, or 100000 iterations, whichever comes first" % (p.preferences.get("cleanThreshold")))
+    log.writeComment("Note that these are threaded and may appear out of window order")
+
 def invertSpectra(objects, obsFreq, avgBaseline, windows) :
     """ Method to create spectral line channel maps
         input:
@@ -671,47 +656,30 @@ def invertSpectra(objects, obsFreq, avgBaseline, windows) :
                 imsize = int(imsize * 1.5)
             else :
                 imsize = int(imsize * 2.0)
-        threadList = []
+        # each window is cleaned once the clean region, which comes from all of the windows, is known
+        stages = scheduler.StageScheduler()
+        inverts = []
         for window in windows :
-            current = invertWindowThread(source,window,iterate,AvgBaseline=avgBaseline)
-            threadList.append(current)
-            current.start()
-        for thread in threadList :
-            thread.join()
-        if(len(regions) > 0) :
-            # get clean region
-            regions[0] = source.getContinuumCleanRegion()
-            source.setCleanRegion(peakLocator.compactCleanRegions(regions,[imsize,imsize]))
-        del threadList[:]
-        log.writeComment("Cleaning images to %f times the noise level, or 100000 iterations, whichever comes first" % (p.preferences.get("cleanThreshold")))
-        log.writeComment("Note that these are threaded and may appear out of window order")
+            size = IMAGE_COPIES * 4 * imsize**2 * source._numChans[window - 1]
+            inverts.append(stages.add("invert w%i" % (window),invert,[source,window,iterate,False,avgBaseline],memory=size))
+        stages.add("clean region",setCleanRegion,[source],inverts)
         for window in windows :
-            current = cleanWindowThread(source,window)
-            threadList.append(current)
-            current.start()
-        for thread in threadList :
-            thread.join()
+            size = IMAGE_COPIES * 4 * imsize**2 * source._numChans[window - 1]
+            stages.add("clean w%i" % (window),cleanWindow,[source,window,False],["clean region"],size)
+        stages.run()
         regions.clear()
         # now do continuum subtraction
         if(p.preferences.get("doContinuumSubtraction")) :
-            del threadList[:]
+            threadList = []
             for window in windows :
                 current = continuumSubtraction.continuumSubtractionThread(source, window, 3.0*rmsList[window])
                 threadList.append(current)
                 current.start()
             for thread in threadList :
                 thread.join()
-            del threadList[:]
+            stages = scheduler.StageScheduler()
             for window in windows :
-                current = cleanWindowThread(source,window,True)
-                threadList.append(current)
-                current.start()
-            for thread in threadList :
-                thread.join()
-            del threadList[:]
-            for window in windows :
-                current = invertWindowThread(source,window,True)
-                threadList.append(current)
-                current.start()
-            for thread in threadList :
-                thread.join()
+                size = IMAGE_COPIES * 4 * imsize**2 * source._numChans[window - 1]
+                stages.add("clean w%i" % (window),cleanWindow,[source,window,True],memory=size)
+                stages.add("invert w%i" % (window),invert,[source,window,True,False],["clean w%i" % (window)],size)
+            stages.run()
@@ -286,7 +286,7 @@ def runListobs(visFile, objects) :
     except :
         raise Exception,  "Could not open file: %s" % (visFile)
     # read in the preamble and intial variables
-    preamble,data,flags = uvread(handle)
+    preamble,data,flags = uvread_np(handle)
     nants = uvgetvri(handle,"nants",1)
     nspect = uvgetvri(handle,"nspect",1)
     goodAnts = [False] * (nants + 1)
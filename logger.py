@@ -136,15 +136,13 @@ def closeLog() :
     global messageLog
     messageLog.close()
 
-def run(command, args,  fatal=False, logit=True, execute=True) :
-    """ Method to run a command line program
+def commandLines(command, args) :
+    """ Method to form the command line of a program and the line written to the script for it
         input :
             command - the command to run
             args - a dictionary of the arguments to the command
-            fatal - if an error occurs is it fatal
-            logit - log the results of the command line operation
         returns :
-            the return state of the command
+            the command line and the script line
     """
     commandLine = command
     logLine = command
@@ -183,10 +181,19 @@ def run(command, args,  fatal=False, logit=True, execute=True) :
                 logLine += arg.getOption() + "=" + arg.getPrefix() + "$" + globals.scriptVarList[arg.getArg()] + arg.getPostfix()
             else :
                 logLine += arg.getOption() + "=" + arg.getPrefix() + arg.getArg() + arg.getPostfix()
-    # run the command line call
-    sys = 0
-    if(execute) :
-        sys = os.system("""%s""" % (commandLine))
+    return commandLine,logLine
+
+def report(sys, commandLine, logLine, fatal=False, logit=True) :
+    """ Method to log the result of a command line program
+        input :
+            sys - the return state of the command
+            commandLine - the command line that was run
+            logLine - the line for the script
+            fatal - if an error occurs is it fatal
+            logit - log the results of the command line operation
+        returns :
+            none
+    """
     # if the call failed
     if(sys != 0 and (logit or fatal)) :
         if(logit):
@@ -197,4 +204,21 @@ def run(command, args,  fatal=False, logit=True, execute=True) :
     else:
         if(logit) :
             writeScript(logLine,commandLine)
+
+def run(command, args,  fatal=False, logit=True, execute=True) :
+    """ Method to run a command line program
+        input :
+            command - the command to run
+            args - a dictionary of the arguments to the command
+            fatal - if an error occurs is it fatal
+            logit - log the results of the command line operation
+        returns :
+            the return state of the command
+    """
+    commandLine,logLine = commandLines(command,args)
+    # run the command line call
+    sys = 0
+    if(execute) :
+        sys = os.system("""%s""" % (commandLine))
+    report(sys,commandLine,logLine,fatal,logit)
     return sys
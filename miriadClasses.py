@@ -1,4 +1,5 @@
 import struct
+import numpy
 import miriad_functions as mfunc
 
 """
@@ -141,28 +142,22 @@ class Image :
 
 # class to read in a miriad image to a python array
 class ImageReader :
-    def __init__(self,file,cutoff) :
+    def __init__(self,file,cutoff=None,readahead=0) :
         """ Initializer
             file - the name of the file to read in
-            cutoff - only read in values above this one
-        """
-        handle = mfunc.xyopen(file,"old")[0]
-        self.header = mfunc.getHeader(handle)
-        mfunc.xyclose(handle)
-        self.handle = open(file + "/image")
-        img = self.handle.read(4)
-        self.size = struct.unpack(">l",img)[0]
+            cutoff - only read in values above this one (None for no cutoff)
+            readahead - the number of planes to read from disk at once when iterating over planes,
+                        0 returns views of the mapped image and only reads the data as it is accessed
+        """
+        self.file = file
+        self.header = mfunc.readHeader(file)
+        self.cube = mfunc.imageMap(file,self.header)
+        self.size = self.cube.dtype.itemsize
         self.x = self.header.getValue("naxis1")
         self.y = self.header.getValue("naxis2")
+        self.z = self.cube.shape[0]
         self.cutoff = cutoff
-        self.type = ">"
-        if(self.size == 4) :
-            for i in range(0,self.x) :
-                self.type += "f"
-
-        elif(size == 8) :
-            for i in range(0,self.x) :
-                self.type += "d"
+        self.readahead = readahead
 
     def setHeader(self,header) :
         """ Method to set the header
@@ -200,6 +195,22 @@ class ImageReader :
         """
         return self.header.getDesc(item)
 
+    def clip(self,data,cutoff=None) :
+        """ Method to apply the cutoff to image data
+            input :
+                data - the image data
+                cutoff - values below this are set to 0.0 (defaults to the cutoff of the reader)
+            returns :
+                the data (a copy if anything was clipped)
+        """
+        if(cutoff == None) :
+            cutoff = self.cutoff
+        if(cutoff == None) :
+            return data
+        data = numpy.array(data)
+        data[data < cutoff] = 0.0
+        return data
+
     def getRow(self,plane,row) :
         """ Method to read in a miriad image row
             input :
@@ -208,13 +219,72 @@ class ImageReader :
             returns :
                 a list containing the row data
         """
-        self.handle.seek(plane*self.size*self.x*self.y+self.size + self.size*row*self.x)
-        rawData = self.handle.read(self.size*self.x)
-        data = list(struct.unpack(self.type,rawData))
-        for d in range(0,len(data)) :
-            if(data[d] < self.cutoff) :
-                data[d] = 0.0
-        return data
+        return self.clip(self.cube[plane][:,row]).tolist()
+
+    def plane(self,plane,cutoff=None) :
+        """ Method to get an image plane
+            input :
+                plane - the plane to get (0 based)
+                cutoff - values below this are set to 0.0 (defaults to the cutoff of the reader)
+            returns :
+                a 2D array (x,y) of the plane, a view of the mapped image if no cutoff is applied
+        """
+        return self.clip(self.cube[plane],cutoff)
+
+    def planes(self,start=0,stop=None,cutoff=None) :
+        """ Generator which steps through a range of image planes, at most readahead planes are in memory at once
+            input :
+                start - the first plane (0 based)
+                stop - the plane to stop before (defaults to all planes)
+                cutoff - values below this are set to 0.0 (defaults to the cutoff of the reader)
+            returns :
+                yields a 2D array (x,y) for each plane
+        """
+        if(stop == None) :
+            stop = self.z
+        step = max(1,self.readahead)
+        for first in range(start,stop,step) :
+            block = self.cube[first:min(first + step,stop)]
+            if(self.readahead > 0) :
+                block = numpy.array(block)
+            for plane in block :
+                yield self.clip(plane,cutoff)
+
+    def tiles(self,shape,start=0,stop=None,cutoff=None) :
+        """ Generator which steps through a range of image planes in tiles
+            input :
+                shape - the (x,y) size of the tiles, tiles at the edges of the image may be smaller
+                start - the first plane (0 based)
+                stop - the plane to stop before (defaults to all planes)
+                cutoff - values below this are set to 0.0 (defaults to the cutoff of the reader)
+            returns :
+                yields a tuple of the plane number, x and y of the first pixel of the tile, and the tile (2D array)
+        """
+        plane = start
+        for data in self.planes(start,stop,cutoff) :
+            for x in range(0,self.x,shape[0]) :
+                for y in range(0,self.y,shape[1]) :
+                    yield plane,x,y,data[x:x + shape[0],y:y + shape[1]]
+            plane += 1
+
+    def spectrum(self,x,y,cutoff=None) :
+        """ Method to get the spectrum through a pixel
+            input :
+                x,y - the pixel (0 based)
+                cutoff - values below this are set to 0.0 (defaults to the cutoff of the reader)
+            returns :
+                an array of the pixel value in each plane
+        """
+        return self.clip(self.cube[:,x,y],cutoff)
+
+    def getMask(self,plane) :
+        """ Method to read in the mask of a miriad image plane
+            input :
+                plane - the plane to read
+            returns :
+                a boolean array (x,y) which is True where the image is unmasked
+        """
+        return mfunc.imageMask(self.file,self.header,plane + 1)[0]
 
 def imhead(file,key) :
     """ Method to read a specific header value from an image
@@ -224,7 +294,4 @@ def imhead(file,key) :
         returns :
             the value of the item
     """
-    handle,num = mfunc.xyopen(file,"old")
-    desc,typeX,nr = mfunc.hdprobe(handle,key)
-    mfunc.xyclose(handle)
-    return desc
+    return mfunc.readHeader(file).getValue(key)
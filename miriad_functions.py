@@ -4,11 +4,11 @@ import time
 import math
 import calculations
 from threading import Thread
+import threading
 import struct
 import os
 import shutil
 import time
-import threadpool as tp
 import sources
 import numpy
 
@@ -26,6 +26,23 @@ AXIS_VEL = "VEL"
 
 beam = [0,0,0.0]    #beam size (in pixels) and pa
 
+# numpy types of the image item, keyed on the element size stored in the first 4 bytes of the item
+IMAGE_TYPES = {4 : ">f4", 8 : ">f8"}
+BITS_PER_INT = 31           # number of bits used in each word of a mask item
+ALL_BITS = 0x7fffffff       # a mask word with all bits set
+MAXCACHE = 64               # maximum number of entries kept in each of the pointing and header caches
+HEADER_TYPES = {1 : "S", 2 : ">i4", 3 : ">i2", 4 : ">f4", 5 : ">f8", 7 : ">c8", 8 : ">i8"}  # type codes of the header item
+HEADER_SIZES = {1 : 1, 2 : 4, 3 : 2, 4 : 4, 5 : 8, 7 : 8, 8 : 8}
+HEADER_ALIGN = 16           # every entry of the header item starts on a 16 byte boundary
+HEADER_NAME = 15            # maximum length of a header item name
+HEADER_TYPE_NAMES = {1 : "character", 2 : "integer", 3 : "integer*2", 4 : "real", 5 : "double", 7 : "complex", 8 : "integer*8"}
+
+pointingDistances = dict()  # distance to the closest pointing for each pixel, keyed on (shape,pointings)
+pointingMasks = dict()      # inside the primary beam masks, keyed on (shape,pointings,radius)
+headerCache = dict()        # parsed headers keyed on path, each entry is [(size,mtime),header]
+headerOrder = []            # paths in headerCache, least recently used first
+headerLock = threading.Lock()
+
 keywords = ["btype","bpa","bmin","bmaj","niters","bunit","vobs","epoch","cdelt4","cdelt3","cdelt2","cdelt1","crval4","crval3","crval2","crval1","ctype4","ctype3","ctype2","ctype1","crpix4","crpix3","crpix2","crpix1","lstep","lwidth","lstart","ltype","restfreq","telescop","object","naxis7","naxis6","naxis5","naxis4","naxis3","naxis2","naxis1","naxis","history"]
 
 def getHeader(handle):
@@ -72,66 +89,173 @@ def minDistance(point,pointings) :
         minD = min(minD,calculations.distance(p,point))
     return minD
 
-def int2bin(n, count=24):
-  """returns the binary of integer n, using count number of digits"""
-  return "".join([str((n >> y) & 1) for y in range(count-1, -1, -1)])
+def pointingMask(shape,pointings,radius) :
+    """ Method to determine which pixels of a plane are inside the primary beam of any pointing
+        the masks (and the distance maps they come from) are cached, so each is only calculated once
+        per image shape and pointing list no matter how many planes or windows use it
+        input :
+            shape - the shape of the plane (rows,columns)
+            pointings - a list of the pointing centers (in pixels)
+            radius - the primary beam radius (in pixels)
+        returns :
+            a 2D boolean array (rows,columns) which is True inside the primary beam(s)
+    """
+    global pointingMasks
+    global pointingDistances
+    points = tuple([tuple(p) for p in pointings])
+    key = (tuple(shape),points,radius)
+    if(key in pointingMasks) :
+        return pointingMasks[key]
+    dkey = (tuple(shape),points)
+    if(not dkey in pointingDistances) :
+        rows = numpy.arange(shape[0],dtype=numpy.float64)[:,numpy.newaxis]
+        columns = numpy.arange(shape[1],dtype=numpy.float64)[numpy.newaxis,:]
+        dist = numpy.empty(shape,dtype=numpy.float64)
+        dist[:] = 100000000.0**2
+        for p in points :
+            numpy.minimum(dist,(rows - p[0])**2 + (columns - p[1])**2,dist)
+        if(len(pointingDistances) >= MAXCACHE) :
+            pointingDistances.clear()
+        pointingDistances[dkey] = numpy.sqrt(dist)
+    if(len(pointingMasks) >= MAXCACHE) :
+        pointingMasks.clear()
+    mask = pointingDistances[dkey] <= radius
+    pointingMasks[key] = mask
+    return mask
+
+def maskBits(item,start,length) :
+    """ Method to decode a range of bits from a miriad mask item (the mask of an image or the
+        flags/wflags of a uv data set). Mask items hold 31 bits in each 32 bit word, lowest bit
+        first, and the 4 byte item header takes up the first word.
+        input :
+            item - the full path to the mask item (e.g. <image>/mask)
+            start - the first bit to decode (0 based)
+            length - the number of bits to decode
+        returns :
+            a numpy boolean array of the bits, True is good (unmasked/unflagged)
+    """
+    first = start + BITS_PER_INT
+    firstWord = first / BITS_PER_INT
+    lastWord = (first + length - 1) / BITS_PER_INT + 1
+    # anything past the end of the item was never written and is good
+    words = numpy.empty(lastWord - firstWord,dtype=numpy.int32)
+    words[:] = ALL_BITS
+    available = os.path.getsize(item)/4 - firstWord
+    if(available > 0) :
+        mapped = numpy.memmap(item,dtype=">i4",mode="r")
+        available = min(available,len(words))
+        words[:available] = mapped[firstWord:firstWord + available]
+        del mapped
+    bits = ((words[:,numpy.newaxis] >> numpy.arange(BITS_PER_INT)) & 1).astype(numpy.bool_).ravel()
+    offset = first % BITS_PER_INT
+    return bits[offset:offset + length]
+
+def writeMaskBits(item,start,bits) :
+    """ Method to write a range of bits of a miriad mask item in place (see maskBits), the item
+        is created or extended if needed
+        input :
+            item - the full path to the mask item (e.g. <uv data>/flags)
+            start - the first bit to write (0 based)
+            bits - a numpy boolean array of the bits to write, True is good (unmasked/unflagged)
+        returns :
+            none
+    """
+    length = len(bits)
+    if(length == 0) :
+        return
+    first = start + BITS_PER_INT
+    firstWord = first / BITS_PER_INT
+    lastWord = (first + length - 1) / BITS_PER_INT + 1
+    if(not os.path.exists(item)) :
+        output = open(item,"wb")
+        output.write(struct.pack(">l",2))
+        output.close()
+    # extend the item with good words so the whole range exists
+    size = os.path.getsize(item) / 4
+    if(size < lastWord) :
+        output = open(item,"ab")
+        words = numpy.empty(lastWord - size,dtype=">i4")
+        words[:] = ALL_BITS
+        words.tofile(output)
+        output.close()
+    # merge the new bits with the existing partial words at either end of the range
+    offset = first % BITS_PER_INT
+    current = maskBits(item,firstWord * BITS_PER_INT - BITS_PER_INT,(lastWord - firstWord) * BITS_PER_INT)
+    current[offset:offset + length] = bits
+    words = (current.reshape(lastWord - firstWord,BITS_PER_INT).astype(numpy.int32) << numpy.arange(BITS_PER_INT)).sum(axis=1)
+    mapped = numpy.memmap(item,dtype=">i4",mode="r+")
+    mapped[firstWord:lastWord] = words
+    mapped.flush()
+    del mapped
+
+def imageMask(file,header,start=1,stop=None) :
+    """ Method to read the mask of a range of image planes
+        input :
+            file - the name of the miriad image
+            header - the header object of the image
+            start - the first plane to read (1 based)
+            stop - the last plane to read (inclusive), defaults to start
+        returns :
+            a numpy boolean array ordered as z,x,y (the same as imageMap), True is unmasked
+    """
+    if(stop == None) :
+        stop = start
+    x = header.getValue("naxis1")
+    y = header.getValue("naxis2")
+    if(not os.path.exists(file + "/mask")) :
+        return numpy.ones((stop - start + 1,x,y),dtype=numpy.bool_)
+    bits = maskBits(file + "/mask",(start - 1)*x*y,(stop - start + 1)*x*y)
+    return bits.reshape(stop - start + 1,y,x).swapaxes(1,2)
 
-def getPlane(file,plane,header,region,radius,pointings,doMask,cutoff=-1000.0) :
+def imageMap(file,header=None) :
+    """ Method to map the image item of a miriad image directly into memory
+        no data are read until they are accessed and nothing is copied
+        input :
+            file - the name of the miriad image
+            header - the header object of the image (read from the image if not given)
+        returns :
+            a read only numpy.memmap view of the image ordered as z,x,y
+    """
+    if(header == None) :
+        header = readHeader(file)
+    handle = open(file + "/image","rb")
+    size = struct.unpack(">l",handle.read(4))[0]
+    handle.close()
+    if(not size in IMAGE_TYPES) :
+        raise Exception, "Unknown image element size %i in %s" % (size,file)
+    x = header.getValue("naxis1")
+    y = header.getValue("naxis2")
+    z = max(1,header.getValue("naxis3"))
+    cube = numpy.memmap(file + "/image",dtype=IMAGE_TYPES[size],mode="r",offset=4,shape=(z,y,x))
+    # the planes are stored row by row, swapping the last two axes gives z,x,y without a copy
+    return cube.swapaxes(1,2)
+
+def getPlane(file,plane,header,region,radius,pointings,doMask,cutoff=-1000.0,cube=None) :
     """ Method to retrieve a plane from an image
         inputs :
-            handle - handle to the miriad image
+            file - the name of the miriad image
             plane - the plane number to retrieve
-            xrange - the width of the image
+            header - the header object of the image
+            region - the selection region
+            radius - the clipping radius (in pixels) around the pointings
+            pointings - the pointing centers (in pixels)
+            doMask - whether to apply the image mask
+            cutoff - any value below this is set to 0.0
+            cube - the mapped image (from imageMap), if None the image is mapped here
         returns :
-            the plane as a 2D array
+            the plane number and the plane as a 2D array (row ordered)
     """
     # don't need to apply a mask if there isn't one
     if(not os.path.exists(file + "/mask") and doMask) :
         doMask = False
-    t0 = time.time()
-    handle = open(file + "/image")
-    img = handle.read(4)
-    size = struct.unpack(">l",img)[0]
+    if(cube is None) :
+        cube = imageMap(file,header)
     x = header.getValue("naxis1")
     y = header.getValue("naxis2")
-    type = ">"
-    if(size == 4) :
-        for i in range(0,x) :
-            type += "f"
-
-    elif(size == 8) :
-        for i in range(0,x) :
-            type += "d"
-    handle.seek((plane-1)*size*x*y,os.SEEK_CUR)
     #read the mask
-    mask = []
+    mask = None
     if(doMask) :
-        mhandle = open(file + "/mask")
-        m = mhandle.read(4)
-        tmask = ""
-        msize = int(x*y/31) + 2
-        loc = int(math.floor(((plane-1)*x*y)/31))*4
-        mhandle.seek(loc,os.SEEK_CUR)
-        place = ((plane-1)*length*height) % 31
-        for i in range(0,msize) :
-            try :
-                m = mhandle.read(4)
-                num = struct.unpack(">i",m)[0]
-                temp= int2bin(num,32)[::-1]
-                tmask += temp[place:-1]
-                place = 0
-            except :
-                pass
-        for i in range(0,y) :
-            trow = []
-            for j in range(0,x) :
-                if(tmask[i*x + j] == "0") :
-                    trow.append(False)
-                else :
-                    trow.append(True)
-            mask.append(trow)
-        mhandle.close()
-    image = []
+        mask = imageMask(file,header,plane)[0].T
     halfx = x/2
     halfy = y/2
     startx = 0
@@ -143,86 +267,280 @@ def getPlane(file,plane,header,region,radius,pointings,doMask,cutoff=-1000.0) :
         starty = int(halfy/2)
         stopx = startx + halfx
         stopy = starty + halfy
-        handle.seek(starty*x*size)
-    # start reading in the image data
-    for row in range(starty,stopy) :
-        rawData = handle.read(size*x)
-        data = list(struct.unpack(type,rawData))
-        if(doMask) :
-            maskRow = mask[row]
-            # clip the data if masked or if there is a cutoff or if the point is outside the selected region
-            if(cutoff > -999.9) :
-                for point in range(startx,stopx) :
-                    if(not maskRow[point] or data[point] < cutoff or minDistance([row,point],pointings) > radius) :
-                        data[point] = 0.0
-            else :
-                for point in range(startx,stopx) :
-                    if(not maskRow[point] or minDistance([row,point],pointings) > radius) :
-                        data[point] = 0.0
-        else :
-            # clip the data if there is a cutoff or if the point is outside the selected region
-            if(cutoff > -999.9) :
-                for point in range(startx,stopx) :
-                    if(data[point] < cutoff or minDistance([row,point],pointings) > radius) :
-                        data[point] = 0.0
-            else :
-                for point in range(startx,stopx) :
-                    if(minDistance([row,point],pointings) > radius) :
-                        data[point] = 0.0
-        image.append(data[startx:stopx + 1])
-    handle.close()
-    t1 = time.time()
-    return plane,image
+    # copy the selected rows out of the mapped image, the image itself is never modified
+    image = numpy.array(cube[plane - 1].T[starty:stopy],dtype=numpy.float32)
+    # clip the data if the point is outside the selected region, masked, or if there is a cutoff
+    clip = numpy.logical_not(pointingMask((y,x),pointings,radius)[starty:stopy])
+    if(doMask) :
+        clip |= numpy.logical_not(mask[starty:stopy])
+    if(cutoff > -999.9) :
+        clip |= image < cutoff
+    clip[:,:startx] = False
+    clip[:,stopx:] = False
+    image[clip] = 0.0
+    return plane,image[:,startx:stopx + 1]
 
+def readCube(file,header,region,radii,pointings,doMask,cutoff=-1000.0) :
+    """ Method to read all planes of an image into a single array
+        inputs :
+            file - the name of the miriad image
+            header - the header object of the image
+            region - the selection region
+            radii - list of the clipping radius (in pixels) for each plane
+            pointings - the pointing centers (in pixels)
+            doMask - whether to apply the image mask
+            cutoff - any value below this is set to 0.0
+        returns :
+            the image as a 3D array ordered as z,x,y
+    """
+    cube = imageMap(file,header)
+    image = None
+    for plane in range(1,len(radii) + 1) :
+        t,img = getPlane(file,plane,header,region,radii[plane - 1],pointings,doMask,cutoff,cube)
+        if(image is None) :
+            image = numpy.empty((len(radii),) + img.shape,dtype=img.dtype)
+        image[plane - 1] = img
+    del cube
+    # rotate the cube so that the order is z,x,y  (0,0,0) is top left of first plane
+    return image.swapaxes(1,2)
 
-def getResult(request,result) :
-    """ Helper method for threading
+def headerRecords(file) :
+    """ Method to read the raw entries of the header item of a miriad data set
+        input :
+            file - the name of the miriad data set
+        returns :
+            a list of [name,data] pairs in file order, data is the packed type code and value
     """
-    request.result[result[0]] = result[1]
+    records = []
+    if(not os.path.exists(file + "/header")) :
+        return records
+    input = open(file + "/header","rb")
+    buffer = input.read()
+    input.close()
+    offset = 0
+    while(offset + HEADER_ALIGN <= len(buffer)) :
+        name = buffer[offset:offset + HEADER_NAME].split("\0")[0]
+        length = ord(buffer[offset + HEADER_NAME])
+        offset += HEADER_ALIGN
+        records.append([name,buffer[offset:offset + length]])
+        offset += ((length + HEADER_ALIGN - 1) / HEADER_ALIGN) * HEADER_ALIGN
+    return records
+
+def packHeaderValue(value,type) :
+    """ Method to pack a value as the data of a header item entry
+        input :
+            value - the value (a string for type 1)
+            type - the header type code (see HEADER_TYPES)
+        returns :
+            the packed type code and value
+    """
+    data = struct.pack(">i",type)
+    data += "\0" * (max(4,HEADER_SIZES[type]) - 4)
+    if(type == 1) :
+        return data + str(value)
+    return data + numpy.array([value],dtype=HEADER_TYPES[type]).tostring()
+
+def writeHeaderRecords(file,records) :
+    """ Method to write the header item of a miriad data set
+        input :
+            file - the name of the miriad data set
+            records - a list of [name,data] pairs (see headerRecords)
+        returns :
+            none
+    """
+    output = open(file + "/header","wb")
+    for name,data in records :
+        if(len(name) > HEADER_NAME or len(data) > 255) :
+            raise Exception, "Header item %s is too large for %s" % (name,file)
+        output.write(name.ljust(HEADER_NAME,"\0") + chr(len(data)))
+        output.write(data.ljust(((len(data) + HEADER_ALIGN - 1) / HEADER_ALIGN) * HEADER_ALIGN,"\0"))
+    output.close()
+    headerLock.acquire()
+    try :
+        path = os.path.abspath(file)
+        if(path in headerCache) :
+            del headerCache[path]
+            headerOrder.remove(path)
+    finally :
+        headerLock.release()
+
+def unpackHeaderValue(data) :
+    """ Method to unpack the data of a header item entry
+        input :
+            data - the packed type code and value (see headerRecords)
+        returns :
+            the value and the header type code
+    """
+    type = struct.unpack(">i",data[:4])[0]
+    if(not type in HEADER_TYPES) :
+        raise Exception, "Unknown header item type %i" % (type)
+    data = data[max(4,HEADER_SIZES[type]):]
+    if(type == 1) :
+        return data.rstrip("\0"),type
+    return numpy.fromstring(data[:HEADER_SIZES[type]],dtype=HEADER_TYPES[type])[0].item(),type
+
+def parseHeader(file) :
+    """ Method to read all header information of a miriad data set directly from its header item
+        input :
+            file - the name of the miriad data set
+        returns :
+            a Header object containing every item of the header, with its native type
+    """
+    header = miriadClasses.Header()
+    for name,data in headerRecords(file) :
+        value,type = unpackHeaderValue(data)
+        header.add(name,miriadClasses.ValueDescPair(value,str(value),HEADER_TYPE_NAMES[type]))
+    return header
+
+def readHeader(file) :
+    """ Method to get all header information of a miriad data set, the parsed headers are cached
+        (keyed on the size and modification time of the header item) so repeated calls do not reread the file
+        input :
+            file - the name of the miriad data set
+        returns :
+            a Header object containing every item of the header
+    """
+    path = os.path.abspath(file)
+    stat = os.stat(path + "/header")
+    key = (stat.st_size,stat.st_mtime)
+    headerLock.acquire()
+    try :
+        if(path in headerCache and headerCache[path][0] == key) :
+            headerOrder.remove(path)
+            headerOrder.append(path)
+            header = headerCache[path][1]
+        else :
+            header = None
+    finally :
+        headerLock.release()
+    if(header == None) :
+        header = parseHeader(path)
+        headerLock.acquire()
+        try :
+            if(path in headerCache) :
+                headerOrder.remove(path)
+            headerCache[path] = [key,header]
+            headerOrder.append(path)
+            while(len(headerOrder) > MAXCACHE) :
+                del headerCache[headerOrder.pop(0)]
+        finally :
+            headerLock.release()
+    # hand out a copy so callers cannot change the cached header
+    copy = miriadClasses.Header()
+    copy.data_ = dict(header.data_)
+    return copy
+
+def setHeaderValues(file,values,types={}) :
+    """ Method to set header items of a miriad data set without going through the miriad routines
+        input :
+            file - the name of the miriad data set
+            values - dictionary of the header item names and their new values
+            types - dictionary of the header type codes of any new items (existing items keep their type),
+                    by default new integers are type 2 (integer) and other numbers type 5 (double)
+        returns :
+            none
+    """
+    records = headerRecords(file)
+    names = [record[0] for record in records]
+    for name in sorted(values) :
+        if(name in names) :
+            type = struct.unpack(">i",records[names.index(name)][1][:4])[0]
+        elif(name in types) :
+            type = types[name]
+        elif(isinstance(values[name],str)) :
+            type = 1
+        elif(isinstance(values[name],(int,long,numpy.integer))) :
+            type = 2
+        else :
+            type = 5
+        data = packHeaderValue(values[name],type)
+        if(name in names) :
+            records[names.index(name)][1] = data
+        else :
+            records.append([name,data])
+            names.append(name)
+    writeHeaderRecords(file,records)
 
 def putImage(file,header,image,orig,doMask=True) :
-    """ Method to write a miriad image to disk
+    """ Method to write a miriad image to disk, the planes are written one at a time so the full
+        image never has to be in memory
         input :
             file - name of the output file
             header - a header object
-            image - an array containing the image data to be written
-            orig - name of the origianting file
-            doMask - whether to apply a mask
+            image - a 3D array (z,x,y) or any iterable of 2D (x,y) planes containing the image data to be written,
+                    masked (numpy.ma) and non-finite pixels are masked
+            orig - name of the origianting file, its header and history are copied (can be None)
+            doMask - whether to write a mask (only written if there are masked pixels)
         returns :
             none
     """
-
-    # don't need to apply a mask if there isn't one
-    if(not os.path.exists(file + "/mask") and doMask) :
-        doMask = False
     if(os.path.exists(file)) :
         print "FILE EXISTS"
         return
     # do the intialization
     os.makedirs(file)
-    shutil.copyfile(orig + "/header", file + "/header")
-    shutil.copyfile(orig + "/history", file + "/history")
-    handle = open(file + "/image",'w')
-    size = struct.pack(">l",4)
-    handle.write(size)
+    records = []
+    if(orig != None) :
+        records = headerRecords(orig)
+        if(os.path.exists(orig + "/history")) :
+            shutil.copyfile(orig + "/history", file + "/history")
+    writeHeaderRecords(file,records)
+    handle = open(file + "/image","wb")
+    handle.write(struct.pack(">l",4))
+    maskHandle = None
+    if(doMask) :
+        maskHandle = open(file + "/mask","wb")
+        maskHandle.write(struct.pack(">l",2))
+    carry = numpy.zeros(0,dtype=numpy.bool_)      # mask bits not yet written as a full word
+    masked = False
+    dataMin = None
+    dataMax = None
+    nplanes = 0
     x = header.getValue("naxis1")
     y = header.getValue("naxis2")
-    type = ">f"
 
-    # write the image
-    min = 100000.0
-    max = -100000.0
+    # write the image, the planes are stored row by row
     for plane in image :
-        for row in range(0,y) :
-            data = ""
-            for j in range(0,x) :
-                if(plane[j][row] > max) :
-                    max = plane[j][row]
-                if(plane[j][row] < min) :
-                    min = plane[j][row]
-                data += struct.pack(type,plane[j][row])
-            handle.write(data)
+        good = numpy.logical_not(numpy.ma.getmaskarray(plane)).T
+        data = numpy.ma.getdata(plane).T.astype(">f4")
+        good &= numpy.isfinite(data)
+        y,x = data.shape
+        data.tofile(handle)
+        if(good.any()) :
+            pmin = data[good].min()
+            pmax = data[good].max()
+            if(dataMin is None or pmin < dataMin) :
+                dataMin = pmin
+            if(dataMax is None or pmax > dataMax) :
+                dataMax = pmax
+        if(maskHandle != None) :
+            masked |= not good.all()
+            carry = numpy.concatenate((carry,good.ravel()))
+            nwords = len(carry) / BITS_PER_INT
+            bits = carry[:nwords * BITS_PER_INT].reshape(nwords,BITS_PER_INT).astype(numpy.int32)
+            (bits << numpy.arange(BITS_PER_INT)).sum(axis=1).astype(">i4").tofile(maskHandle)
+            carry = carry[nwords * BITS_PER_INT:]
+        nplanes += 1
     handle.close()
+    if(maskHandle != None) :
+        if(len(carry) > 0) :
+            numpy.array([(carry.astype(numpy.int32) << numpy.arange(len(carry))).sum()],dtype=">i4").tofile(maskHandle)
+        maskHandle.close()
+        # no need for a mask if nothing is masked
+        if(not masked) :
+            os.remove(file + "/mask")
+
+    # update the header to match what was written
+    naxis = header.getValue("naxis")
+    if(naxis < 2) :
+        naxis = 2
+    values = {"naxis" : max(naxis,3) if nplanes > 1 else naxis,"naxis1" : x,"naxis2" : y}
+    if(nplanes > 1 or naxis > 2) :
+        values["naxis3"] = nplanes
+    if(dataMin is not None) :
+        values["datamin"] = float(dataMin)
+        values["datamax"] = float(dataMax)
+    setHeaderValues(file,values,{"datamin" : 4,"datamax" : 4})
     return
 
 def putHeader(handle,header,h2):
@@ -252,74 +570,42 @@ def imageToArray(file, region,pointings=[0.0,0.0],doMask = True,isBeam = False,c
     """
     global beam
     global radToSec
-    handle = -1
     imageArray = None
     t0 = time.time()
     header = None
-    try :
-        cdelt = [0.0,0.0,0.0]
-        blc = [0,0,0,0,0,0,0]
-        trc = [0,0,0,0,0,0,0]
-        handle,num = xyopen(file,"old")
-        header = getHeader(handle)
-        cdelt[0] = header.getValue("cdelt1") * radToSec
-        cdelt[1] = header.getValue("cdelt2") * radToSec
-        cdelt[2] = header.getValue("cdelt3")
-        if(not isBeam) :
-            beam[0] = math.fabs(header.getValue("bmaj") * radToSec/cdelt[0])
-            beam[1] = math.fabs(header.getValue("bmin") * radToSec/cdelt[1])
-            beam[2] = header.getValue("bpa")
-        restFreq = header.getValue("restfreq")
-        naxis = header.getValue("naxis")
-        axisType = None
-        freq = 0.0
-        interval = 0.0
-        if("VELO" in header.getValue("ctype3") or "FELO" in header.getValue("ctype3")) :
-            axisType = AXIS_VEL
-            freq = calculations.velToFreq(header.getValue("crval3"),restFreq)
-            interval = calculations.velToFreq(cdelt[2],restFreq)-restFreq
-        elif("FREQ" in header.getValue("ctype3")) :
-            axisType = AXIS_FREQ
-            freq = header.getValue("crval3")
-            interval = cdelt[2]
-        image = []
-        mask = []
-        xyclose(handle)
-        handle = -1
-        offPoints = []
-        if(pointings == [0.0,0.0]) :
-            offPoints.append([int(header.getValue("crpix1")),int(header.getValue("crpix2"))])
-        else :
-            center = [int(header.getValue("crpix1")),int(header.getValue("crpix2"))]
-            for p in pointings :
-                offPoints.append([int(p[0]/cdelt[0]) + center[0],int(p[1]/cdelt[1]) + center[1]])
-
-        # if there is only 1 plane then do not use threads, it is a waste of time
-        if(header.getValue("naxis3") == 1) :
-            t,img = getPlane(file,1,header,region,int(calculations.calcImsize(freq,cdelt[1],0.0)/(2.0*1.639)),offPoints,doMask,cutoff)
-            image.append(img)
-        else :
-            worker = tp.ThreadPool(20)
-            result = dict()
-            #set up all arguments for all threads
-            arguments = [((file,plane,header,region,int(calculations.calcImsize(freq+((plane - 1) * interval),cdelt[1],0.0)/(2.0*1.639)),offPoints,doMask,cutoff), {}) for plane in range(1,header.getValue("naxis3") + 1)]
-            # generate the requested work
-            requests = tp.makeRequests(getPlane,arguments,getResult,result=result)
-            # fill the thread pool and start working
-            for req in requests:
-                worker.putRequest(req)
-            # wait for all threads to finish before continuing
-            worker.wait()
-            for plane in range(1,header.getValue("naxis3") + 1) :
-                image.append(result[plane])
-            del result
-        imageArray = numpy.array(image)
-        imageArray = imageArray.swapaxes(1,2)  # rotate the cube so that the order is z,x,y  (0,0,0) is top left of first plane
-        del image
-    except :
-        if(handle != -1) :
-            xyclose(handle)
-        raise
+    cdelt = [0.0,0.0,0.0]
+    blc = [0,0,0,0,0,0,0]
+    trc = [0,0,0,0,0,0,0]
+    header = readHeader(file)
+    cdelt[0] = header.getValue("cdelt1") * radToSec
+    cdelt[1] = header.getValue("cdelt2") * radToSec
+    cdelt[2] = header.getValue("cdelt3")
+    if(not isBeam) :
+        beam[0] = math.fabs(header.getValue("bmaj") * radToSec/cdelt[0])
+        beam[1] = math.fabs(header.getValue("bmin") * radToSec/cdelt[1])
+        beam[2] = header.getValue("bpa")
+    restFreq = header.getValue("restfreq")
+    naxis = header.getValue("naxis")
+    axisType = None
+    freq = 0.0
+    interval = 0.0
+    if("VELO" in header.getValue("ctype3") or "FELO" in header.getValue("ctype3")) :
+        axisType = AXIS_VEL
+        freq = calculations.velToFreq(header.getValue("crval3"),restFreq)
+        interval = calculations.velToFreq(cdelt[2],restFreq)-restFreq
+    elif("FREQ" in header.getValue("ctype3")) :
+        axisType = AXIS_FREQ
+        freq = header.getValue("crval3")
+        interval = cdelt[2]
+    offPoints = []
+    if(pointings == [0.0,0.0]) :
+        offPoints.append([int(header.getValue("crpix1")),int(header.getValue("crpix2"))])
+    else :
+        center = [int(header.getValue("crpix1")),int(header.getValue("crpix2"))]
+        for p in pointings :
+            offPoints.append([int(p[0]/cdelt[0]) + center[0],int(p[1]/cdelt[1]) + center[1]])
+    radii = [int(calculations.calcImsize(freq+((plane - 1) * interval),cdelt[1],0.0)/(2.0*1.639)) for plane in range(1,max(1,header.getValue("naxis3")) + 1)]
+    imageArray = readCube(file,header,region,radii,offPoints,doMask,cutoff)
     t1 = time.time()
     #print int((t1 - t0) * 1000)
     if(withHeader) :
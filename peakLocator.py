@@ -25,75 +25,43 @@ def imageToArray(file, region,pointings=[0.0,0.0],doMask = True,isBeam = False,c
             the image as a 2 or 3D array
     """
     global beam
-    handle = -1
     imageArray = None
     t0 = time.time()
     header = None
-    try :
-        cdelt = [0.0,0.0,0.0]
-        blc = [0,0,0,0,0,0,0]
-        trc = [0,0,0,0,0,0,0]
-        print "opening file"
-        handle,num = xyopen(file,"old")
-        header = mfunc.getHeader(handle)
-        cdelt[0] = header.getValue("cdelt1") * radToSec
-        cdelt[1] = header.getValue("cdelt2") * radToSec
-        cdelt[2] = header.getValue("cdelt3")
-        if(not isBeam) :
-            beam[0] = math.fabs(header.getValue("bmaj") * radToSec/cdelt[0])
-            beam[1] = math.fabs(header.getValue("bmin") * radToSec/cdelt[1])
-            beam[2] = header.getValue("bpa")
-        restFreq = header.getValue("restfreq")
-        naxis = header.getValue("naxis")
-        axisType = None
-        freq = 0.0
-        interval = 0.0
-        if("VELO" in header.getValue("ctype3") or "FELO" in header.getValue("ctype3")) :
-            axisType = AXIS_VEL
-            freq = calculations.velToFreq(header.getValue("crval3"),restFreq)
-            interval = calculations.velToFreq(cdelt[2],restFreq)-restFreq
-        elif("FREQ" in header.getValue("ctype3")) :
-            axisType = AXIS_FREQ
-            freq = header.getValue("crval3")
-            interval = cdelt[2]
-        image = []
-        mask = []
-        xyclose(handle)
-        handle = -1
-        offPoints = []
-        if(pointings == [0.0,0.0]) :
-            offPoints.append([int(header.getValue("crpix1")),int(header.getValue("crpix2"))])
-        else :
-            center = [int(header.getValue("crpix1")),int(header.getValue("crpix2"))]
-            print "CENTER: ",center
-            for p in pointings :
-                offPoints.append([int(p[0]/cdelt[0]) + center[0],int(p[1]/cdelt[1]) + center[1]])
-        print "PONTINGS: ",pointings,offPoints
-        # if there is only 1 plane then do not use threads, it is a waste of time
-        if(header.getValue("naxis3") == 1) :
-            t,img = mfunc.getPlane(file,1,header,region,int(calculations.calcImsize(freq,cdelt[1],0.0)/(2.0*1.639)),offPoints,doMask,cutoff)
-            image.append(img)
-        else :
-            worker = tp.ThreadPool(20)
-            result = dict()
-            #set up all arguments for all threads
-            arguments = [((file,plane,header,region,int(calculations.calcImsize(freq+((plane - 1) * interval),cdelt[1],0.0)/(2.0*1.639)),offPoints,doMask,cutoff), {}) for plane in range(1,header.getValue("naxis3") + 1)]
-            # generate the requested work
-            requests = tp.makeRequests(mfunc.getPlane,arguments,mfunc.getResult,result=result)
-            # fill the thread pool and start working
-            for req in requests:
-                worker.putRequest(req)
-            # wait for all threads to finish before continuing
-            worker.wait()
-            for plane in range(1,header.getValue("naxis3") + 1) :
-                image.append(result[plane])
-        imageArray = numpy.array(image)
-        imageArray = imageArray.swapaxes(1,2)  # rotate the cube so that the order is z,x,y  (0,0,0) is top left of first plane
-        del image
-    except :
-        if(handle != -1) :
-            xyclose(handle)
-        raise
+    cdelt = [0.0,0.0,0.0]
+    print "opening file"
+    header = mfunc.readHeader(file)
+    cdelt[0] = header.getValue("cdelt1") * radToSec
+    cdelt[1] = header.getValue("cdelt2") * radToSec
+    cdelt[2] = header.getValue("cdelt3")
+    if(not isBeam) :
+        beam[0] = math.fabs(header.getValue("bmaj") * radToSec/cdelt[0])
+        beam[1] = math.fabs(header.getValue("bmin") * radToSec/cdelt[1])
+        beam[2] = header.getValue("bpa")
+    restFreq = header.getValue("restfreq")
+    naxis = header.getValue("naxis")
+    axisType = None
+    freq = 0.0
+    interval = 0.0
+    if("VELO" in header.getValue("ctype3") or "FELO" in header.getValue("ctype3")) :
+        axisType = AXIS_VEL
+        freq = calculations.velToFreq(header.getValue("crval3"),restFreq)
+        interval = calculations.velToFreq(cdelt[2],restFreq)-restFreq
+    elif("FREQ" in header.getValue("ctype3")) :
+        axisType = AXIS_FREQ
+        freq = header.getValue("crval3")
+        interval = cdelt[2]
+    offPoints = []
+    if(pointings == [0.0,0.0]) :
+        offPoints.append([int(header.getValue("crpix1")),int(header.getValue("crpix2"))])
+    else :
+        center = [int(header.getValue("crpix1")),int(header.getValue("crpix2"))]
+        print "CENTER: ",center
+        for p in pointings :
+            offPoints.append([int(p[0]/cdelt[0]) + center[0],int(p[1]/cdelt[1]) + center[1]])
+    print "PONTINGS: ",pointings,offPoints
+    radii = [int(calculations.calcImsize(freq+((plane - 1) * interval),cdelt[1],0.0)/(2.0*1.639)) for plane in range(1,max(1,header.getValue("naxis3")) + 1)]
+    imageArray = mfunc.readCube(file,header,region,radii,offPoints,doMask,cutoff)
     t1 = time.time()
     print int((t1 - t0) * 1000)
     if(withHeader) :
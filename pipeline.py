@@ -35,7 +35,7 @@ import traceback
 import time
 import random
 import hybrid
-from threading import Thread
+import scheduler
 
 prjData = dict()
 
@@ -144,11 +144,7 @@ try :
 
     # flag based on system temperature and shadowing
     log.writeHeader(["Flagging bad data"])
-    flagging.flagTsys(visFile)
-    log.writeAll("\n")
-    flagging.flagShadowing(visFile)
-    log.writeAll("\n")
-    flagging.flagElevation(visFile)
+    flagging.flagTsysShadowingElevation(visFile)
     # apply the correct baseline solution
     if(p.preferences.get("doBaselines")) :
         log.writeHeader(["Determine if a new baseline solution is available,","   and apply as necessary"])
@@ -160,35 +156,30 @@ try :
 
     # look for bad amplitudes and  birdies in source(s) and gaincalibrator(s)
     # flagged birides are applied to all matching (bandwidth and number of channels) windows on all objects
-    threadList = []
+    jobs = []
     for object in (objects._sources + objects._gaincals) :
-        if(object in objects._sources) :
-            current = flagging.FlagBadAmpsThread(object,objects,onlyBirdies=True)
-        else :
-            current = flagging.FlagBadAmpsThread(object,objects)
-        threadList.append(current)
-        current.start()
-    for thread in threadList :
-        thread.join()
+        jobs.append([object,object in objects._sources])
+    flagging.flagBadAmpsPool(jobs,objects)
 
     # bandpass calibration
     log.writeHeader(["Bandpass calibration"])
-    threadList = []
+    stages = scheduler.StageScheduler()
     LSBdone = False
     USBdone = False
     for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
+        ending = ".w%i" % (window)
         if(objects._passcals[0].isSuper(window)) :
             if(window <= len(objects._passcals[0]._bandwidths)/2 and not LSBdone) :
                 LSBdone = True
+                ending = ".LSB"
             elif(window > len(objects._passcals[0]._bandwidths)/2 and not USBdone) :
                 USBdone = True
+                ending = ".USB"
             else :
                 continue
-        current = bandpasscal.bandpassThread(objects,refant,window)
-        threadList.append(current)
-        current.start()
-    for thread in threadList :
-        thread.join()
+        size = scheduler.dataSize([obj._file + ending for obj in objects._passcals + objects._gaincals + objects._sources])
+        stages.add("bandpass w%i" % (window),bandpasscal.bandpass,[objects,refant,window],memory=size)
+    stages.run()
 
     if(globals.hybrid() and hybrid.calculateOffsets(objects._passcals, refant)) :
         hybrid.applyOffsets(objects._passcals,objects._sources)
@@ -199,8 +190,9 @@ try :
     log.writeHeader(["Determining flux of gain calibrators"])
     if(len(objects._fluxcals) != 0) :
         primaryFluxcal = sources.getPrimaryFluxCal(objects)
-        for gcal in objects._gaincals :
-            flux = bootflux.runBootflux(prjData["project"]+"."+prjData["obsblock"]+"."+prjData["subObsblock"]+"."+str(prjData["trial"]),gcal,primaryFluxcal, calculations.gregorianToNumeric(obsDate), obsFreq)
+        # the bootflux runs of all gain calibrators are done at the same time
+        fluxes = bootflux.runBootfluxes(prjData["project"]+"."+prjData["obsblock"]+"."+prjData["subObsblock"]+"."+str(prjData["trial"]),objects._gaincals,primaryFluxcal, calculations.gregorianToNumeric(obsDate), obsFreq)
+        for gcal,flux in zip(objects._gaincals,fluxes) :
             gcal.setFlux(flux)
             globals.setScriptVar(str(flux),"FLUX")
             log.writeLog("Found a flux of %f for %s" % (gcal._flux, gcal._name))
@@ -222,100 +214,49 @@ try :
     usbRefWindows = []
     specWindows = []
     log.writeHeader(["Gain calibration","","Note that this section of the reduction is threaded","and the commands for each window will not necessarily appear together"])
-    if(SPECTRAL) :
-        maxBw = objects._gaincals[0].getMaxBw()
-        minBw = objects._gaincals[0].getMinBw()
-        midpoint = len(objects._gaincals[0]._bandwidths)/2
-        LSBdone = False
-        USBdone = False
-        if(maxBw != minBw) :
-            threadList = []
-            for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
-                if(objects._gaincals[0]._bandwidths[window - 1] == maxBw) :
-                    if(window <= midpoint):
-                        lsbRefWindows.append(window)
-                        if(objects._gaincals[0].isSuper(window)) :
-                            if(not LSBdone) :
-                                LSBdone = True
-                            else :
-                                continue
-                    else:
-                        usbRefWindows.append(window)
-                        if(objects._gaincals[0].isSuper(window)) :
-                            if(not USBdone) :
-                                USBdone = True
-                            else :
-                                continue
-                    current = gainCalibration.continuumThread(objects, refant, window)
-                    threadList.append(current)
-                    current.start()
-                else :
-                    specWindows.append(window)
-            for thread in threadList :
-                thread.join()
-            threadList = []
-            for window in specWindows :
-                refWindow = None
-                if(window <= midpoint) :
-                    refWindow = lsbRefWindows[0]
-                    if(objects._sources[0].haveSuper()) :
-                        refWindow = "LSB"
-                else:
-                    refWindow = usbRefWindows[0]
-                    if(objects._sources[0].haveSuper()) :
-                        refWindow = "USB"
-
-                current = gainCalibration.bootstrapThread(objects, refant, refWindow, window)
-                threadList.append(current)
-                current.start()
-            for thread in threadList :
-                thread.join()
-        else :
-            threadList = []
-            for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
-                if(window <= midpoint):
-                    lsbRefWindows.append(window)
-                    if(objects._gaincals[0].isSuper(window)) :
-                        if(not LSBdone) :
-                            LSBdone = True
-                        else :
-                            continue
-                else:
-                    usbRefWindows.append(window)
-                    if(objects._gaincals[0].isSuper(window)) :
-                        if(not USBdone) :
-                            USBdone = True
-                        else :
-                            continue
-
-                current = gainCalibration.continuumThread(objects, refant, window)
-                threadList.append(current)
-                current.start()
-            for thread in threadList :
-                thread.join()
-    else :
-        LSBdone = False
-        USBdone = False
-        threadList = []
-        for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
-            if(window <= midpoint):
-                if(objects._gaincals[0].isSuper(window)) :
-                    if(not LSBdone) :
-                        LSBdone = True
-                    else :
-                        continue
-            else :
-                if(objects._gaincals[0].isSuper(window)) :
-                    if(not USBdone) :
-                        USBdone = True
-                    else :
-                        continue
-
-            current = gainCalibration.continuumThread(objects, refant, window)
-            threadList.append(current)
-            current.start()
-        for thread in threadList :
-            thread.join()
+    # the wide band windows are calibrated first, each narrow band window is bootstrapped as soon as its
+    # reference window is done
+    stages = scheduler.StageScheduler()
+    maxBw = objects._gaincals[0].getMaxBw()
+    minBw = objects._gaincals[0].getMinBw()
+    midpoint = len(objects._gaincals[0]._bandwidths)/2
+    continuumStages = dict()    # continuum stage of each window (or sideband for the super windows)
+    for window in range(globals.STARTWINDOW, globals.ENDWINDOW + 1) :
+        if(SPECTRAL and maxBw != minBw and objects._gaincals[0]._bandwidths[window - 1] != maxBw) :
+            specWindows.append(window)
+            continue
+        if(SPECTRAL and window <= midpoint) :
+            lsbRefWindows.append(window)
+        elif(SPECTRAL) :
+            usbRefWindows.append(window)
+        reference = window
+        ending = ".w%i" % (window)
+        if(objects._gaincals[0].isSuper(window)) :
+            reference = "USB"
+            if(window <= midpoint) :
+                reference = "LSB"
+            if(reference in continuumStages) :
+                continue
+            ending = "." + reference
+        size = scheduler.dataSize([gcal._file + ending for gcal in objects._gaincals])
+        continuumStages[reference] = stages.add("continuum w%i" % (window),gainCalibration.continuum,[objects,refant,window],memory=size)
+    for window in specWindows :
+        refWindow = None
+        if(window <= midpoint) :
+            refWindow = lsbRefWindows[0]
+            if(objects._sources[0].haveSuper()) :
+                refWindow = "LSB"
+        else:
+            refWindow = usbRefWindows[0]
+            if(objects._sources[0].haveSuper()) :
+                refWindow = "USB"
+        depends = continuumStages.values()
+        if(refWindow in continuumStages) :
+            depends = [continuumStages[refWindow]]
+        for gcal in objects._gaincals :
+            size = scheduler.dataSize([gcal._file + ".w%i" % (window)])
+            stages.add("bootstrap %s w%i" % (gcal._name,window),gainCalibration.runboot,[objects,gcal,refant,refWindow,window],depends,size)
+    stages.run()
 
     if(not fluxTrack) :
         # determine if any sources are secondary calibrators and do a selfcal on them and apply to other sources
@@ -545,13 +486,10 @@ try :
             if(maxBw > 60) :
                 invert.invertContinuum(objects, obsFreq, avgBaseline, lsbRefWindows + usbRefWindows)
                 if(globals.isSci2) :
-                    threadList = []
+                    stages = scheduler.StageScheduler()
                     for window in lsbRefWindows + usbRefWindows :
-                        current = invert.invertContinuumThread(objects, obsFreq, avgBaseline ,window)
-                        threadList.append(current)
-                        current.start()
-                    for thread in threadList :
-                        thread.join()
+                        stages.add("continuum map w%i" % (window),invert.invertContinuum,[objects,obsFreq,avgBaseline,[window],True])
+                    stages.run()
 
             specWindows = specWindows + lsbRefWindows + usbRefWindows
             invert.invertSpectra(objects, obsFreq, avgBaseline, specWindows)
@@ -7,6 +7,9 @@ except ImportError:
     raise Exception,msg
 
 import time
+import ctypes
+import threading
+import numpy
 """
 Module to wrap basic miriad IO routines into python
 Author: D. N. Friedel
@@ -20,6 +23,8 @@ MAXANT = 64
 MAXBASE = 501
 MAXPOL = 4
 
+_buffers = threading.local()     # C arrays of the numpy wrappers, kept per thread so they can be reused
+
 print "Note: This wrapper package has a disclaimer. Type <m>.disclaimer() (where <m> is the name used for importing this module) to read it."
 
 def disclaimer() :
@@ -99,7 +104,7 @@ def doubleArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w):
+                for j in range(0,w):
                     row.append(float(array[(k*x*w)+(i*w) + j]))
                 temp.append(row)
             alist.append(temp)
@@ -110,7 +115,7 @@ def doubleArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w):
+                for j in range(0,w):
                     row.append(float(array[(l*y*x*w) +(k*x*w)+(i*w) + j]))
                 temp.append(row)
             ttemp.append(temp)
@@ -154,7 +159,7 @@ def intArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w):
+                for j in range(0,w):
                     row.append(int(array[(k*x*w)+(i*w) + j]))
                 temp.append(row)
             alist.append(temp)
@@ -198,7 +203,7 @@ def complexArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w,2):
+                for j in range(0,w,2):
                     row.append(complex(array[(k*x*w)+(i*w) + j],array[(k*x*w)+(i*w) + j + 1]))
                 temp.append(row)
             alist.append(temp)
@@ -209,7 +214,7 @@ def complexArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w,2):
+                for j in range(0,w,2):
                     row.append(complex(array[(l*y*x*w) +(k*x*w)+(i*w) + j],array[(l*y*x*w) +(k*x*w)+(i*w) + j + 1]))
                 temp.append(row)
             ttemp.append(temp)
@@ -434,8 +439,8 @@ def FcomplexArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w):
-                    row.append(complex(array[(k*x)+(i*w) + j].r,array[(k*x)+(i*w) + j].i))
+                for j in range(0,w):
+                    row.append(complex(array[(k*x*w)+(i*w) + j].r,array[(k*x*w)+(i*w) + j].i))
                 temp.append(row)
             alist.append(temp)
         return alist
@@ -445,13 +450,134 @@ def FcomplexArrayToList(array,w,x=0,y=0,z=0) :
             temp = []
             for i in range(0,x) :
                 row = []
-                for y in range(0,w):
-                    row.append(complex(array[(l*y) +(k*x)+(i*w) + j].r,array[(l*y) +(k*x)+(i*w) + j].i))
+                for j in range(0,w):
+                    row.append(complex(array[(l*y*x*w) +(k*x*w)+(i*w) + j].r,array[(l*y*x*w) +(k*x*w)+(i*w) + j].i))
                 temp.append(row)
             ttemp.append(temp)
         alist.append(ttemp)
     return alist
 
+def arrayToNumpy(array,dtype,count,out=None) :
+    """ Method to copy a C array into a numpy array, with a single copy of the underlying buffer
+        input :
+            array - the array pointer
+            dtype - the numpy type of the array elements (numpy.float32, numpy.float64 or numpy.int32)
+            count - the number of elements to copy
+            out - optional preallocated numpy array (of at least count elements) to copy into
+        returns :
+            a 1D numpy array of count elements (a view of out if it was given)
+    """
+    dtype = numpy.dtype(dtype)
+    try :
+        view = numpy.frombuffer((ctypes.c_char * (count * dtype.itemsize)).from_address(int(array.this)),dtype=dtype,count=count)
+    except (AttributeError,TypeError) :
+        view = numpy.fromiter((array[i] for i in xrange(count)),dtype=dtype,count=count)
+    if(out is None) :
+        return view.copy()
+    out = out.reshape(-1)[:count]
+    out[:] = view
+    return out
+
+def _shape(w,x=0,y=0,z=0) :
+    """ Method to convert the w,x,y,z lengths used by the array helpers to a numpy shape
+        input :
+            w,x,y,z - the length of each dimension (0 for unused dimensions)
+        returns :
+            the shape tuple, slowest varying dimension first
+    """
+    shape = [w]
+    for length in [x,y,z] :
+        if(length == 0) :
+            break
+        shape.insert(0,length)
+    return tuple(shape)
+
+def doubleArrayToNumpy(array,w,x=0,y=0,z=0,out=None) :
+    """ Method to convert a C array of double values to a numpy array
+        input :
+            array - the array pointer
+            w - the length of the first dimension
+            x,y,z - length of the other dimensions
+            out - optional preallocated float64 array to copy into
+        returns :
+            a float64 array with the same dimensions as doubleArrayToList would return
+    """
+    shape = _shape(w,x,y,z)
+    return arrayToNumpy(array,numpy.float64,numpy.prod(shape),out).reshape(shape)
+
+def floatArrayToNumpy(array,w,x=0,y=0,z=0,out=None) :
+    """ Method to convert a C array of float values to a numpy array
+        input :
+            array - the array pointer
+            w - the length of the first dimension
+            x,y,z - length of the other dimensions
+            out - optional preallocated float32 array to copy into
+        returns :
+            a float32 array with the same dimensions as floatArrayToList would return
+    """
+    shape = _shape(w,x,y,z)
+    return arrayToNumpy(array,numpy.float32,numpy.prod(shape),out).reshape(shape)
+
+def intArrayToNumpy(array,w,x=0,y=0,z=0,out=None) :
+    """ Method to convert a C array of integer values to a numpy array
+        input :
+            array - the array pointer
+            w - the length of the first dimension
+            x,y,z - length of the other dimensions
+            out - optional preallocated int32 array to copy into
+        returns :
+            an int32 array with the same dimensions as intArrayToList would return
+    """
+    shape = _shape(w,x,y,z)
+    return arrayToNumpy(array,numpy.int32,numpy.prod(shape),out).reshape(shape)
+
+def complexArrayToNumpy(array,w,x=0,y=0,z=0,out=None) :
+    """ Method to convert a C array of float values (real/imaginary pairs) to a numpy array of complex values
+        input :
+            array - the array pointer
+            w - the length of the first dimension (in floats)
+            x,y,z - length of the other dimensions
+            out - optional preallocated complex64 array to copy into
+        returns :
+            a complex64 array (last dimension is half that of the input w) the other dimensions are the same as the input array
+    """
+    shape = _shape(w,x,y,z)
+    if(out is not None) :
+        out = out.reshape(-1).view(numpy.float32)
+    values = arrayToNumpy(array,numpy.float32,numpy.prod(shape),out)
+    return values.view(numpy.complex64).reshape(shape[:-1] + (w / 2,))
+
+def castLogical_np(item,out=None) :
+    """ Method to convert an array of 1/0 to True/False
+        input :
+            item - a numpy array of 1/0 values
+            out - optional preallocated boolean array to write into
+        returns :
+            a boolean array of the same shape as the input
+    """
+    if(out is None) :
+        return item != 0
+    out = out.reshape(-1)[:item.size].reshape(item.shape)
+    numpy.not_equal(item,0,out)
+    return out
+
+def cachedArray(kind,n) :
+    """ Method to get a C array for the numpy wrappers, the array is made the first time and reused by later
+        calls from the same thread
+        input :
+            kind - the type of array ("double", "float", "int" or "intp" for a single integer)
+            n - the number of elements
+        returns :
+            the C array
+    """
+    arrays = _buffers.__dict__.setdefault("arrays",dict())
+    if(not (kind,n) in arrays) :
+        if(kind == "intp") :
+            arrays[(kind,n)] = miriad_io.new_intp()
+        else :
+            arrays[(kind,n)] = getattr(miriad_io,kind + "Array")(n)
+    return arrays[(kind,n)]
+
 def convertComplex(item) :
     """ Method to convert python complex to C/Fotran complex
         input :
@@ -13442,6 +13568,37 @@ def uvread(tno,n = MAXCHAN) :
     del flags
     return p,d,f
 
+# uvread is the only wrapper with a numpy version: the pipeline reads bulk visibilities, flags and images
+# straight from disk (uvReader, miriad_functions.maskBits and readCube), so uvwread, hreadr, hreadd and
+# xyread are not used in any loop and keep only their list versions
+def uvread_np(tno,n = MAXCHAN,preamble=None,data=None,flags=None) :
+    """ Miriad wrapper - see miriad documentation for full description
+        numpy version of uvread, the C arrays are kept (per thread and n) and reused by later calls, and the
+        optional numpy buffers are filled rather than allocating new arrays
+        input :
+            tno - the miriad file handle
+            n - maximum number of channels to read (default is MAXCHAN)
+            preamble - optional float64 array of (at least) 10 elements to hold the preamble
+            data - optional complex64 array of (at least) n elements to hold the data
+            flags - optional boolean array of (at least) n elements to hold the flags
+        returns :
+            a tuple of preamble, complex data, and channel flags (numpy arrays, views of the buffers if given)
+    """
+    preambleX = cachedArray("double",10)
+    dataX = cachedArray("float",2*n)
+    flagsX = cachedArray("int",n)
+    nread = cachedArray("intp",1)
+    miriad_io.intp_assign(nread,0)
+    try :
+        mx.safecall(miriad_io.uvread_c,(tno,preambleX,dataX,flagsX,n,nread))
+    except :
+        pass
+    nr = miriad_io.intp_value(nread)
+    p = doubleArrayToNumpy(preambleX,10,out=preamble)
+    d = complexArrayToNumpy(dataX,2*nr,out=data)
+    f = castLogical_np(intArrayToNumpy(flagsX,nr),flags)
+    return p,d,f
+
 def uvwread(tno,n = MAXCHAN) :
     """ Miriad wrapper - see miriad documentation for full description
         input :
@@ -0,0 +1,167 @@
+import numpy
+import miriad_functions as mfunc
+import uvReader
+import flagOccupancy
+
+"""
+Module for flagging on system temperature, elevation and shadowing in a single pass through a miriad data set
+The flags item is updated directly, replacing separate runs of uvflag (tsys and elev) and csflag
+Part of the CARMA data reduction pipeline
+Author: D. N. Friedel
+"""
+
+NS_TO_METERS = 0.299792458      # antenna positions are in nanoseconds
+
+# antenna types of the CARMA array, by antenna number: [first antenna, last antenna, dish diameter (m)]
+OVRO = [1,6,10.4]
+BIMA = [7,15,6.1]
+SZA = [16,23,3.5]
+
+TSYS = "tsys"
+ELEVATION = "elevation"
+SHADOWING = "shadowing"
+
+# uv variables needed by each check
+CHECK_VARIABLES = {TSYS : ["systemp","nschan"],
+                   ELEVATION : ["lst","latitud","obsra","obsdec"],
+                   SHADOWING : ["antpos","lst","obsra","obsdec"]}
+
+def antennaSizes(nants,fractions) :
+    """ Method to get the dish radius and shadowing fraction of each antenna
+        input :
+            nants - the number of antennas
+            fractions - list of the OVRO, BIMA and SZA shadowing fractions
+        returns :
+            an array of the radii (m) and an array of the fractions, indexed by antenna number - 1
+    """
+    radius = numpy.zeros(nants)
+    fraction = numpy.ones(nants)
+    for i,antType in enumerate([OVRO,BIMA,SZA]) :
+        radius[antType[0] - 1:antType[1]] = antType[2] / 2.0
+        fraction[antType[0] - 1:antType[1]] = fractions[i]
+    return radius,fraction
+
+def elevations(lst,latitude,ra,dec) :
+    """ Method to calculate the elevation of a source, all values are done at once
+        input :
+            lst - array of the local sidereal times (radians)
+            latitude - array of the observatory latitudes (radians)
+            ra - array of the right ascensions (radians)
+            dec - array of the declinations (radians)
+        returns :
+            an array of the elevations in degrees
+    """
+    sinel = numpy.sin(latitude)*numpy.sin(dec) + numpy.cos(latitude)*numpy.cos(dec)*numpy.cos(lst - ra)
+    return numpy.degrees(numpy.arcsin(numpy.clip(sinel,-1.0,1.0)))
+
+def shadowedAntennas(positions,ha,dec,radius,fraction) :
+    """ Method to find the shadowed antennas, all times are done at once
+        an antenna is shadowed when the projected separation from an antenna in front of it is less than
+        f(back)*r(back) + f(front)*r(front), the limit used by csflag with cfraction
+        input :
+            positions - array (times,3,nants) of the equatorial antenna positions (m), all zero for
+                        antennas not in the array
+            ha - array of the hour angles (radians)
+            dec - array of the declinations (radians)
+            radius - array of the dish radius of each antenna (m)
+            fraction - array of the shadowing fraction of each antenna
+        returns :
+            a boolean array (times,nants), True for shadowed antennas
+    """
+    present = numpy.abs(positions).sum(axis=1) > 0.0
+    # baseline from each antenna (back) to each other antenna (front)
+    b = positions[:,:,numpy.newaxis,:] - positions[:,:,:,numpy.newaxis]
+    sinh = numpy.sin(ha)[:,numpy.newaxis,numpy.newaxis]
+    cosh = numpy.cos(ha)[:,numpy.newaxis,numpy.newaxis]
+    sind = numpy.sin(dec)[:,numpy.newaxis,numpy.newaxis]
+    cosd = numpy.cos(dec)[:,numpy.newaxis,numpy.newaxis]
+    u = sinh*b[:,0] + cosh*b[:,1]
+    v = -sind*cosh*b[:,0] + sind*sinh*b[:,1] + cosd*b[:,2]
+    w = cosd*cosh*b[:,0] - cosd*sinh*b[:,1] + sind*b[:,2]
+    limit = (fraction*radius)[:,numpy.newaxis] + (fraction*radius)[numpy.newaxis,:]
+    blocked = (u**2 + v**2 < limit[numpy.newaxis]**2) & (w > 0.0)
+    blocked &= present[:,:,numpy.newaxis] & present[:,numpy.newaxis,:]
+    blocked[:,numpy.arange(len(radius)),numpy.arange(len(radius))] = False
+    return blocked.any(axis=2)
+
+def availableChecks(file) :
+    """ Method to get the checks which can be done on a data set
+        input :
+            file - the name of the uv data set
+        returns :
+            a list of the checks whose uv variables are all present
+    """
+    types,names = uvReader.readVartable(file)
+    checks = []
+    for check in [TSYS,ELEVATION,SHADOWING] :
+        if(all([var in names for var in CHECK_VARIABLES[check]])) :
+            checks.append(check)
+    return checks
+
+def preFlag(file,checks,tsysThreshold,elevationRange,fractions,chunk=1024) :
+    """ Method to flag on system temperature, elevation and shadowing in a single pass
+        input :
+            file - the name of the uv data set
+            checks - list of the checks to do (TSYS, ELEVATION and/or SHADOWING)
+            tsysThreshold - channels whose window has a system temperature above this for either antenna are flagged
+            elevationRange - [low,high] records with an elevation in this range (degrees) are flagged
+            fractions - list of the OVRO, BIMA and SZA shadowing fractions
+            chunk - the number of records to read at once
+        returns :
+            a dictionary of the number of records newly flagged by each check
+    """
+    variables = []
+    for check in checks :
+        for var in CHECK_VARIABLES[check] :
+            if(not var in variables) :
+                variables.append(var)
+    counts = dict([(check,0) for check in checks])
+    if(len(checks) == 0) :
+        return counts
+    reader = uvReader.UVReader(file,variables=variables)
+    flagItem = file + "/flags"
+    bit = 0
+    for records in reader.records(chunk,withData=False) :
+        nrec,nchan = records["flags"].shape
+        good = records["flags"]
+        rows = numpy.arange(nrec)
+        flag = numpy.zeros((nrec,nchan),dtype=numpy.bool_)
+        if(TSYS in checks) :
+            nschan = records["nschan"]
+            nspect = nschan.shape[1]
+            nants = records["systemp"].shape[1] / nspect
+            systemp = records["systemp"][:,:nants*nspect].reshape(nrec,nspect,nants)
+            # window of each channel (nspect for channels past the last window)
+            window = (numpy.arange(nchan)[numpy.newaxis,:,numpy.newaxis] >= numpy.cumsum(nschan,axis=1)[:,numpy.newaxis,:]).sum(axis=2)
+            hot = numpy.zeros((nrec,nspect + 1),dtype=numpy.bool_)
+            for ant in [records["ant1"],records["ant2"]] :
+                valid = (ant >= 1) & (ant <= nants)
+                hot[valid,:nspect] |= systemp[rows[valid],:,ant[valid] - 1] > tsysThreshold
+            tsys = hot[rows[:,numpy.newaxis],window]
+            counts[TSYS] += (tsys & good).any(axis=1).sum()
+            flag |= tsys
+        if(ELEVATION in checks) :
+            elev = elevations(records["lst"][:,0],records["latitud"][:,0],records["obsra"][:,0],records["obsdec"][:,0])
+            low = (elev >= elevationRange[0]) & (elev <= elevationRange[1])
+            counts[ELEVATION] += (low[:,numpy.newaxis] & good).any(axis=1).sum()
+            flag[low] = True
+        if(SHADOWING in checks) :
+            nants = records["antpos"].shape[1] / 3
+            # the shadowing only depends on the time, pointing and array, so do each combination once
+            keys = numpy.hstack((records["lst"],records["obsra"],records["obsdec"],records["antpos"][:,:3*nants]))
+            keys,index = numpy.unique(keys,axis=0,return_inverse=True)
+            positions = keys[:,3:].reshape(len(keys),3,nants) * NS_TO_METERS
+            radius,fraction = antennaSizes(nants,fractions)
+            shadowed = shadowedAntennas(positions,keys[:,0] - keys[:,1],keys[:,2],radius,fraction)
+            shadowed = numpy.hstack((numpy.zeros((len(keys),1),dtype=numpy.bool_),shadowed))
+            ant1 = numpy.where(records["ant1"] <= nants,records["ant1"],0)
+            ant2 = numpy.where(records["ant2"] <= nants,records["ant2"],0)
+            shadow = shadowed[index,ant1] | shadowed[index,ant2]
+            counts[SHADOWING] += (shadow[:,numpy.newaxis] & good).any(axis=1).sum()
+            flag[shadow] = True
+        flag &= good
+        if(flag.any()) :
+            mfunc.writeMaskBits(flagItem,bit,(good & numpy.logical_not(flag)).ravel())
+        bit += nrec*nchan
+    flagOccupancy.invalidateOccupancy(file)
+    return counts
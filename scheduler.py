@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+import traceback
+import logger as log
+import util
+
+"""
+Module for running the stages of the data reduction as a dependency graph
+Each stage starts as soon as the stages it depends on have finished, the number of stages running at once is
+limited by the number of CPUs and by an estimate of the memory each stage needs
+Part of the CARMA data reduction pipeline
+Author: D. N. Friedel
+"""
+
+MEMORY_FRACTION = 0.75      # fraction of the physical memory the running stages may use
+
+def physicalMemory() :
+    """ Method to get the size of the physical memory
+        input :
+            none
+        returns :
+            the memory size in bytes, or None if it cannot be determined
+    """
+    try :
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError,ValueError,OSError) :
+        return None
+
+def dataSize(files) :
+    """ Method to estimate the memory needed to process uv data sets, from the size of their visibilities
+        input :
+            files - list of the names of the uv data sets
+        returns :
+            the total size (bytes) of the visdata items (missing items count as 0)
+    """
+    size = 0
+    for file in files :
+        if(os.path.exists(file + "/visdata")) :
+            size += os.path.getsize(file + "/visdata")
+    return size
+
+class Stage :
+    def __init__(self,name,function,args,depends,memory) :
+        """ Initializer
+            name - the unique name of the stage
+            function - the function to run
+            args - list of the arguments of the function
+            depends - list of the names of the stages which must finish first
+            memory - estimate of the memory the stage needs (bytes)
+        """
+        self.name = name
+        self.function = function
+        self.args = args
+        self.depends = depends
+        self.memory = memory
+        self.started = False
+        self.done = False
+        self.failed = False
+
+class StageScheduler :
+    def __init__(self,maxJobs=None,maxMemory=None) :
+        """ Initializer
+            maxJobs - the maximum number of stages running at once (default is the number of CPUs)
+            maxMemory - the memory (bytes) the running stages may use (default is MEMORY_FRACTION of the
+                        physical memory, None if it cannot be determined)
+        """
+        if(maxJobs == None) :
+            maxJobs = util.determineNumberOfCPUs()
+        if(maxMemory == None and physicalMemory() != None) :
+            maxMemory = int(MEMORY_FRACTION * physicalMemory())
+        self.maxJobs = max(1,maxJobs)
+        self.maxMemory = maxMemory
+        self.stages = dict()
+        self.order = []             # stage names in the order they were added
+        self.running = 0
+        self.memory = 0
+        self.condition = threading.Condition()
+
+    def add(self,name,function,args=[],depends=[],memory=0) :
+        """ Method to add a stage, the stages it depends on may be added later
+            input :
+                name - the unique name of the stage
+                function - the function to run
+                args - list of the arguments of the function
+                depends - list of the names of the stages which must finish first (None entries are ignored)
+                memory - estimate of the memory the stage needs (bytes)
+            returns :
+                the name of the stage
+        """
+        if(name in self.stages) :
+            raise Exception, "Stage %s was already added" % (name)
+        self.stages[name] = Stage(name,function,args,[d for d in depends if d != None],memory)
+        self.order.append(name)
+        return name
+
+    def ready(self,stage) :
+        """ Method to check whether a stage can be started
+            input :
+                stage - the Stage
+            returns :
+                True if it has not been started and all the stages it depends on are done
+        """
+        if(stage.started) :
+            return False
+        for name in stage.depends :
+            if(not self.stages[name].done) :
+                return False
+        return True
+
+    def fits(self,stage) :
+        """ Method to check whether there are enough resources to start a stage, a stage is always
+            started if nothing else is running, so one that is larger than the memory limit still runs
+            input :
+                stage - the Stage
+            returns :
+                True if the stage can be started now
+        """
+        if(self.running == 0) :
+            return True
+        if(self.running >= self.maxJobs) :
+            return False
+        return self.maxMemory == None or self.memory + stage.memory <= self.maxMemory
+
+    def execute(self,stage) :
+        """ Method to run a stage (in its own thread) and release its resources when it is done, a stage
+            which fails is reported as an uncaught exception in a thread would be
+            input :
+                stage - the Stage
+            returns :
+                none
+        """
+        try :
+            stage.function(*stage.args)
+        except :
+            stage.failed = True
+            sys.stderr.write("Exception in stage %s:\n" % (stage.name))
+            traceback.print_exc()
+            log.writeLog("FAILED: stage %s (%s : %s)" % (stage.name,sys.exc_info()[0],sys.exc_info()[1]))
+        self.condition.acquire()
+        try :
+            stage.done = True
+            self.running -= 1
+            self.memory -= stage.memory
+            self.condition.notifyAll()
+        finally :
+            self.condition.release()
+
+    def run(self) :
+        """ Method to run all stages, each is started as soon as the stages it depends on are done (whether
+            they succeeded or not) and there are resources for it, returns when all stages are done
+            input :
+                none
+            returns :
+                a list of the names of the stages which failed
+        """
+        for name in self.order :
+            for depend in self.stages[name].depends :
+                if(not depend in self.stages) :
+                    raise Exception, "Stage %s depends on unknown stage %s" % (name,depend)
+        pending = list(self.order)
+        self.condition.acquire()
+        try :
+            while(len(pending) > 0 or self.running > 0) :
+                started = False
+                for name in pending[:] :
+                    stage = self.stages[name]
+                    if(self.ready(stage) and self.fits(stage)) :
+                        stage.started = True
+                        self.running += 1
+                        self.memory += stage.memory
+                        pending.remove(name)
+                        thread = threading.Thread(target=self.execute,args=(stage,))
+                        thread.start()
+                        started = True
+                if(started) :
+                    continue
+                if(self.running == 0) :
+                    raise Exception, "Stages %s have circular dependencies" % (", ".join(pending))
+                self.condition.wait()
+        finally :
+            self.condition.release()
+        return [name for name in self.order if self.stages[name].failed]
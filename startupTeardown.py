@@ -2,6 +2,7 @@ import os
 import globals
 from os.path import exists, join
 import logger as log
+import gproutines
 import time
 import version
 import fileinput
@@ -111,6 +112,7 @@ def cleanup(objects,fail = False) :
 
     # close everything up
     del objects
+    log.writeLog(gproutines.tableSummary())
     log.writeLog("Data reduction by CARMA pipeline version %s completed at %s" % (version.VERSION,time.ctime()))
     log.closeLog()
     prepend(log.closeScript())
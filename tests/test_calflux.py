@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import calflux
+
+"""
+Test of the saved index of the flux catalog: an index is only used for the catalog it was made from
+"""
+
+CATALOG = """#! Flux catalog
+## 3C84
+S 2011-Jun-01.0 95.0 10.5 0.1
+S 2011-Jun-15.0 230.0 7.5 0.2
+## 3C273
+S 2011-May-20.0 96.0 9.0 0.1
+"""
+
+class CatalogIndexTest(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.catalog = os.path.join(self.directory,"FluxSource.cat")
+        self.writeCatalog(CATALOG)
+        self.index = calflux.indexFiles(self.catalog)[0]
+
+    def tearDown(self) :
+        shutil.rmtree(self.directory)
+
+    def writeCatalog(self,text) :
+        output = open(self.catalog,"w")
+        output.write(text)
+        output.close()
+
+    def fluxes(self,sections) :
+        return [(section[0].split()[1],section[1]["flux"].tolist()) for section in sections]
+
+    def testSavedIndexIsUsed(self) :
+        first = calflux.loadIndex(self.catalog)
+        self.assertEqual(self.fluxes(first),[("3C84",[10.5,7.5]),("3C273",[9.0])])
+        self.assertTrue(os.path.exists(self.index))
+        stat = os.stat(self.catalog)
+        key = (calflux.INDEX_VERSION,os.path.abspath(self.catalog),stat.st_size,stat.st_mtime)
+        self.assertEqual(self.fluxes(calflux.readIndex(self.index,key)),self.fluxes(first))
+
+    def testIndexOfAnotherCatalog(self) :
+        calflux.loadIndex(self.catalog)
+        # a catalog of a different size must not use the saved index
+        self.writeCatalog(CATALOG + "S 2011-Jul-01.0 95.0 11.5 0.1\n")
+        self.assertEqual(self.fluxes(calflux.loadIndex(self.catalog))[1],("3C273",[9.0,11.5]))
+
+    def testCorruptIndex(self) :
+        calflux.loadIndex(self.catalog)
+        input = open(self.index,"rb")
+        header = input.readline()
+        input.close()
+        for payload in ["garbage",header + "garbage","cos\nsystem\n(S'exit 1'\ntR."] :
+            output = open(self.index,"wb")
+            output.write(payload)
+            output.close()
+            self.assertEqual(self.fluxes(calflux.loadIndex(self.catalog)),[("3C84",[10.5,7.5]),("3C273",[9.0])])
+
+    def testWrongContent(self) :
+        stat = os.stat(self.catalog)
+        key = (calflux.INDEX_VERSION,os.path.abspath(self.catalog),stat.st_size,stat.st_mtime)
+        output = open(self.index,"wb")
+        output.write(calflux.indexHeader(key))
+        calflux.cPickle.dump({"not" : "an index"},output,2)
+        output.close()
+        self.assertEqual(calflux.readIndex(self.index,key),None)
+        self.assertEqual(self.fluxes(calflux.loadIndex(self.catalog))[0],("3C84",[10.5,7.5]))
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,181 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import logger as log
+import calculations
+import gproutines
+import flagJournal
+import flagOccupancy
+import flagging32
+import flagging64
+
+"""
+Stress test of flagByGains: many windows are flagged at once and the gain break points and flagging of
+each window must be the same as when the windows are flagged one at a time
+"""
+
+NANTS = 8
+NTIMES = 30
+WINDOWS = range(1,17) + ["LSB","USB"]
+REPEATS = 5
+
+def syntheticGains(window) :
+    """ Method to make the gains of a window, each window has its own bad time ranges
+        input :
+            window - the window number, or LSB/USB
+        returns :
+            a list of the solution times (hh:mm:ss.s) and a list of the gains of each time (one per antenna)
+    """
+    rand = random.Random(str(window))
+    labels = calculations.unconvertTimes([2.0 + i*5.0/60.0 for i in range(0,NTIMES)])
+    gains = [[rand.uniform(0.9,1.1) for ant in range(0,NANTS)] for i in range(0,NTIMES)]
+    for ant in rand.sample(range(0,NANTS),3) :
+        start = rand.randint(0,NTIMES - 5)
+        for i in range(start,start + rand.randint(1,4)) :
+            gains[i][ant] = 10.0
+    return labels,gains
+
+def statistics(gains) :
+    """ Method to get the mean and rms gain of each antenna
+        input :
+            gains - the gains of each time
+        returns :
+            lists of the means and rms
+    """
+    means = []
+    rms = []
+    for ant in range(0,NANTS) :
+        values = [row[ant] for row in gains]
+        mean = sum(values)/len(values)
+        means.append(mean)
+        rms.append((sum([(v - mean)**2 for v in values])/(len(values) - 1))**0.5)
+    return means,rms
+
+def windowOf(vis) :
+    """ Method to get the window of a data set name
+        input :
+            vis - the name of the data set
+        returns :
+            the window number, or LSB/USB
+    """
+    ending = vis[vis.rindex(".") + 1:]
+    if(ending in ["LSB","USB"]) :
+        return ending
+    return int(ending[1:])
+
+class FakeOccupancy :
+    def fullyFlagged(self,select) :
+        time.sleep(random.random()*0.001)
+        return False
+
+class FlagContextTest(unittest.TestCase) :
+    def setUp(self) :
+        self.saved = [(log,"run",log.run),(log,"writeLog",log.writeLog),(log,"writeComment",log.writeComment),
+                      (gproutines,"gplist",gproutines.gplist),(flagJournal,"flush",flagJournal.flush),
+                      (flagOccupancy,"getOccupancy",flagOccupancy.getOccupancy)]
+        self.lock = threading.Lock()
+        self.results = dict()
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        log.run = self.fakeRun
+        log.writeLog = lambda message : None
+        log.writeComment = lambda message : None
+        gproutines.gplist = self.fakeGplist
+        flagJournal.flush = self.fakeFlush
+        flagOccupancy.getOccupancy = lambda file : FakeOccupancy()
+
+    def tearDown(self) :
+        for module,name,value in self.saved :
+            setattr(module,name,value)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def record(self,window,entry) :
+        self.lock.acquire()
+        try :
+            self.results.setdefault(window,[]).append(entry)
+        finally :
+            self.lock.release()
+
+    def fakeRun(self,command,args,fatal=False,logit=True,execute=True) :
+        """ Stand in for log.run, records gpbreak and writes the gplist output of flagging32 """
+        time.sleep(random.random()*0.001)
+        if(command == "gpbreak") :
+            values = dict([(arg.getOption(),arg.getArg() + arg.getPostfix()) for arg in args])
+            self.record(windowOf(values["vis"]),("gpbreak",values["ants"],values["break"]))
+        elif(command.startswith("gplist")) :
+            vis = command.split()[1][4:]
+            output = command.split(">")[1].strip()
+            labels,gains = syntheticGains(windowOf(vis))
+            means,rms = statistics(gains)
+            lines = ["Found gain entries for %i antennas." % (NANTS),"Time       Anten 1 ..."]
+            for i in range(0,NTIMES) :
+                lines.append(labels[i] + " " + " ".join(["%.3f" % (gain) for gain in gains[i]]))
+            lines.append("-" * 40)
+            lines.append("Means: " + " ".join(["%.3f" % (mean) for mean in means]))
+            lines.append("Rms: " + " ".join(["%.3f" % (value) for value in rms]))
+            outFile = open(output,"w")
+            outFile.write("\n".join(lines) + "\n")
+            outFile.close()
+        return 0
+
+    def fakeGplist(self,vis) :
+        """ Stand in for gproutines.gplist """
+        time.sleep(random.random()*0.001)
+        labels,gains = syntheticGains(windowOf(vis))
+        means,rms = statistics(gains)
+        gainList = []
+        for i in range(0,NTIMES) :
+            entry = gproutines.Gains(labels[i])
+            entry.gains = dict(zip(range(1,NANTS + 1),gains[i]))
+            gainList.append(entry)
+        ants = range(1,NANTS + 1)
+        return gainList,dict(zip(ants,means)),dict(zip(ants,means)),dict(zip(ants,rms))
+
+    def fakeFlush(self,file=None,fileEnd="") :
+        """ Stand in for flagJournal.flush, records and drops the pending selections """
+        journal = flagJournal.getJournal(file,fileEnd)
+        journal.lock.acquire()
+        try :
+            for args in journal.commands :
+                values = dict([(arg.getOption(),arg.getArg()) for arg in args])
+                self.record(windowOf(file + fileEnd),("uvflag",values["select"]))
+            del journal.selections[:]
+            del journal.commands[:]
+        finally :
+            journal.lock.release()
+
+    def check(self,flagging) :
+        # the results of each window flagged on its own
+        serial = dict()
+        for window in WINDOWS :
+            self.results = dict()
+            flagging.flagByGains("synthetic",window)
+            serial[window] = self.results.get(window,[])
+            self.assertTrue(len([entry for entry in serial[window] if entry[0] == "gpbreak"]) > 0)
+        # all windows at once
+        for repeat in range(0,REPEATS) :
+            self.results = dict()
+            threads = [threading.Thread(target=flagging.flagByGains,args=("synthetic",window)) for window in WINDOWS]
+            for thread in threads :
+                thread.start()
+            for thread in threads :
+                thread.join()
+            for window in WINDOWS :
+                self.assertEqual(self.results.get(window,[]),serial[window],"window %s differs when run concurrently" % (window))
+
+    def testFlagging32(self) :
+        self.check(flagging32)
+
+    def testFlagging64(self) :
+        self.check(flagging64)
+
+if __name__ == "__main__" :
+    unittest.main()
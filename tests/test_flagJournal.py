@@ -0,0 +1,67 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import logger as log
+import miriad_functions as mfunc
+import flagJournal
+import uvReader
+
+"""
+Test of applying a flag journal to a copy of testMiriadFile, the flags and wflags items must end up as
+uvflag would leave them when the script is replayed
+"""
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","testMiriadFile")
+
+def readFlags(file,data) :
+    """ Method to read the flags of a data set
+        input :
+            file - the name of the data set
+            data - "corr" or "wcorr"
+        returns :
+            the flags (records x channels) and the antennas of each record
+    """
+    records = numpy.concatenate(list(uvReader.UVReader(file,data=data).records(withData=False)))
+    return records["flags"],records["ant1"],records["ant2"]
+
+class FlagJournalTest(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory,"data")
+        shutil.copytree(TEST_FILE,self.file)
+        self.saved = log.run
+        self.commands = []
+        log.run = lambda command,args,fatal=False,logit=True,execute=True : self.commands.append(command)
+
+    def tearDown(self) :
+        log.run = self.saved
+        shutil.rmtree(self.directory)
+
+    def testAntennaFlagsWide(self) :
+        flagJournal.getJournal(self.file).add(select="antenna'('17')'")
+        flagJournal.flush(self.file)
+        self.assertEqual(self.commands,["uvflag"])
+        for data in ["corr","wcorr"] :
+            flags,ant1,ant2 = readFlags(self.file,data)
+            selected = (ant1 == 17) | (ant2 == 17)
+            self.assertFalse(flags[selected].any())
+            self.assertTrue(flags[numpy.logical_not(selected)].all())
+
+    def testLineOnlyFlagsChannels(self) :
+        flagJournal.getJournal(self.file).add(select="antenna'('17')'",line="channel,10,1,1,1")
+        flagJournal.flush(self.file)
+        flags,ant1,ant2 = readFlags(self.file,"corr")
+        selected = (ant1 == 17) | (ant2 == 17)
+        self.assertFalse(flags[selected][:,:10].any())
+        self.assertTrue(flags[selected][:,10:].all())
+        self.assertTrue(flags[numpy.logical_not(selected)].all())
+        # the wide channels are not touched
+        flags,ant1,ant2 = readFlags(self.file,"wcorr")
+        self.assertTrue(flags.all())
+
+if __name__ == "__main__" :
+    unittest.main()
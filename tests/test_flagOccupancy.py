@@ -0,0 +1,49 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import miriad_functions as mfunc
+import flagOccupancy
+
+"""
+Test of the flag occupancy cache when the flags are rewritten in place
+"""
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","testMiriadFile")
+
+class OccupancyCacheTest(unittest.TestCase) :
+    def setUp(self) :
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory,"data")
+        shutil.copytree(TEST_FILE,self.file)
+
+    def tearDown(self) :
+        flagOccupancy.invalidateOccupancy(self.file)
+        shutil.rmtree(self.directory)
+
+    def testRewriteInPlace(self) :
+        self.assertEqual(flagOccupancy.getOccupancy(self.file).fraction(),0.0)
+        # flag half of the first record, keeping the size and modification time of the item
+        item = self.file + "/flags"
+        stat = os.stat(item)
+        bits = numpy.ones(240,dtype=numpy.bool_)
+        bits[:120] = False
+        mfunc.writeMaskBits(item,0,bits)
+        os.utime(item,(stat.st_atime,stat.st_mtime))
+        self.assertEqual(os.path.getsize(item),stat.st_size)
+        # the cache cannot see the change
+        self.assertEqual(flagOccupancy.getOccupancy(self.file).fraction(),0.0)
+        flagOccupancy.invalidateOccupancy(self.file)
+        self.assertAlmostEqual(flagOccupancy.getOccupancy(self.file).fraction(),120.0/(560*240))
+
+    def testInvalidateAll(self) :
+        first = flagOccupancy.getOccupancy(self.file)
+        self.assertTrue(flagOccupancy.getOccupancy(self.file) is first)
+        flagOccupancy.invalidateOccupancy()
+        self.assertFalse(flagOccupancy.getOccupancy(self.file) is first)
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+import numpy
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import preFlagging
+
+"""
+Tests of the shadowing check of preFlagging against the csflag criterion
+"""
+
+def csflagShadowed(separation,w,radius1,fraction1,radius2,fraction2) :
+    """ Method to apply the csflag criterion to one pair of antennas
+        input :
+            separation - the projected separation (m)
+            w - the w component of the baseline from antenna 1 to antenna 2 (m), antenna 2 is in front if > 0
+            radius1,fraction1 - the radius (m) and shadowing fraction of antenna 1
+            radius2,fraction2 - the radius (m) and shadowing fraction of antenna 2
+        returns :
+            True if antenna 1 is shadowed by antenna 2
+    """
+    return w > 0.0 and separation < fraction1*radius1 + fraction2*radius2
+
+class ShadowingTest(unittest.TestCase) :
+    def geometry(self,back,front,separation,w,nants=23) :
+        """ Method to place two antennas, at hour angle 0 and declination 0 the w axis is x and the
+            projected separation is along y
+            input :
+                back,front - the antenna numbers
+                separation - the projected separation (m)
+                w - the distance of front in front of back (m)
+                nants - the number of antennas
+            returns :
+                the positions (1,3,nants)
+        """
+        positions = numpy.zeros((1,3,nants))
+        positions[0,:,back - 1] = [10.0,20.0,30.0]
+        positions[0,:,front - 1] = [10.0 + w,20.0 + separation,30.0]
+        return positions
+
+    def testMatchesCsflag(self) :
+        zero = numpy.zeros(1)
+        for fractions in [[1.0,0.9,1.0],[0.5,0.5,0.5],[1.0,1.0,1.0]] :
+            radius,fraction = preFlagging.antennaSizes(23,fractions)
+            # OVRO, BIMA and SZA antennas shadowing each other
+            for back,front in [[1,16],[16,1],[7,2],[8,20]] :
+                for separation in numpy.arange(0.0,12.0,0.25) :
+                    for w in [-50.0,50.0] :
+                        positions = self.geometry(back,front,separation,w)
+                        shadowed = preFlagging.shadowedAntennas(positions,zero,zero,radius,fraction)[0]
+                        expected = csflagShadowed(separation,w,radius[back - 1],fraction[back - 1],radius[front - 1],fraction[front - 1])
+                        self.assertEqual(bool(shadowed[back - 1]),expected,"antenna %i behind %i at %.2f m, fractions %s" % (back,front,separation,fractions))
+                        self.assertFalse(shadowed[front - 1] and w > 0.0)
+
+    def testDishesOverlap(self) :
+        # an OVRO dish 6 m behind an SZA dish overlaps it (5.2 + 1.75 m), so csflag flags it
+        radius,fraction = preFlagging.antennaSizes(23,[1.0,1.0,1.0])
+        zero = numpy.zeros(1)
+        shadowed = preFlagging.shadowedAntennas(self.geometry(1,16,6.0,50.0),zero,zero,radius,fraction)[0]
+        self.assertTrue(shadowed[0])
+        self.assertFalse(shadowed[15])
+        shadowed = preFlagging.shadowedAntennas(self.geometry(1,16,7.0,50.0),zero,zero,radius,fraction)[0]
+        self.assertFalse(shadowed.any())
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import miriad_functions as mfunc
+import uvReader
+
+"""
+Regression test of uvReader against testMiriadFile
+"""
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","testMiriadFile")
+NRECORDS = 560
+NCHAN = 240             # corr channels, 16 windows of 15
+NWIDE = 32              # wcorr channels
+NTIMES = 20
+ANTENNAS = range(16,24)
+
+def readAll(file,data,chunk) :
+    """ Method to read all records of a data set
+        input :
+            file - the name of the data set
+            data - "corr" or "wcorr"
+            chunk - the number of records to read at once
+        returns :
+            the reader and an array of all records
+    """
+    reader = uvReader.UVReader(file,data=data)
+    return reader,numpy.concatenate(list(reader.records(chunk)))
+
+def writeFlags(item,bits) :
+    """ Method to write a flags item bit by bit, independently of miriad_functions: a 4 byte header then
+        31 bits in each big endian 32 bit word, lowest bit first
+        input :
+            item - the full path to the flags item
+            bits - list of the flags (True is good)
+        returns :
+            none
+    """
+    output = open(item,"wb")
+    output.write(struct.pack(">i",2))
+    for word in range(0,(len(bits) + 30)/31) :
+        value = 0
+        for bit in range(0,31) :
+            if(word*31 + bit >= len(bits) or bits[word*31 + bit]) :
+                value |= 1 << bit
+        output.write(struct.pack(">i",value))
+    output.close()
+
+class UVReaderTest(unittest.TestCase) :
+    def testCorr(self) :
+        reader,records = readAll(TEST_FILE,"corr",1024)
+        self.assertEqual(len(records),NRECORDS)
+        self.assertEqual(records["data"].shape,(NRECORDS,NCHAN))
+        self.assertEqual(records["flags"].shape,(NRECORDS,NCHAN))
+        self.assertEqual(reader.sources,["3C84"])
+        self.assertTrue((records["source"] == 0).all())
+        self.assertTrue((records["pol"] == -2).all())
+        self.assertEqual(len(numpy.unique(records["time"])),NTIMES)
+
+    def testBaselines(self) :
+        reader,records = readAll(TEST_FILE,"corr",1024)
+        expected = set()
+        for ant1 in ANTENNAS :
+            for ant2 in ANTENNAS :
+                if(ant1 < ant2) :
+                    expected.add(256*ant1 + ant2)
+        self.assertEqual(set(records["baseline"].tolist()),expected)
+        self.assertTrue((records["ant1"] == records["baseline"] / 256).all())
+        self.assertTrue((records["ant2"] == records["baseline"] % 256).all())
+
+    def testFlags(self) :
+        reader,records = readAll(TEST_FILE,"corr",1024)
+        # the flags item, decoded on its own
+        flags = mfunc.maskBits(TEST_FILE + "/flags",0,NRECORDS*NCHAN)
+        self.assertEqual(records["flags"].sum(),flags.sum())
+        self.assertEqual(records["flags"].sum(),134400)
+        self.assertTrue((records["flags"].ravel() == flags).all())
+
+    def testFlaggedBits(self) :
+        # a copy of the data set with a pattern of flagged bits which crosses the word boundaries
+        directory = tempfile.mkdtemp()
+        try :
+            file = os.path.join(directory,"flagged")
+            shutil.copytree(TEST_FILE,file)
+            bits = [(i % 7 != 3) and (i % 31 != 30) and not (1000 <= i < 1100) for i in range(0,NRECORDS*NCHAN)]
+            writeFlags(file + "/flags",bits)
+            reader,records = readAll(file,"corr",37)
+            self.assertEqual(records["flags"].ravel().tolist(),bits)
+            self.assertEqual(records["flags"].sum(),sum(bits))
+            # the first flagged bits, counting from the first record
+            self.assertFalse(records["flags"][0,3])
+            self.assertTrue(records["flags"][0,4])
+            self.assertFalse(records["flags"][0,30])
+            self.assertFalse(records["flags"][4,1000 - 4*NCHAN])
+        finally :
+            shutil.rmtree(directory)
+
+    def testWide(self) :
+        reader,records = readAll(TEST_FILE,"wcorr",1024)
+        self.assertEqual(len(records),NRECORDS)
+        self.assertEqual(records["data"].shape,(NRECORDS,NWIDE))
+        flags = mfunc.maskBits(TEST_FILE + "/wflags",0,NRECORDS*NWIDE)
+        self.assertEqual(records["flags"].sum(),flags.sum())
+        self.assertEqual(records["flags"].sum(),17920)
+
+    def testChunks(self) :
+        # reading in small chunks gives the same records
+        reader,whole = readAll(TEST_FILE,"corr",1024)
+        reader,chunked = readAll(TEST_FILE,"corr",37)
+        for name in ["baseline","time","flags","data"] :
+            self.assertTrue((whole[name] == chunked[name]).all())
+
+if __name__ == "__main__" :
+    unittest.main()
@@ -0,0 +1,314 @@
+import os
+import mmap
+import struct
+import numpy
+import miriad_functions as mfunc
+import calculations
+
+"""
+Module for reading miriad uv data sets directly from disk with NumPy
+The vartable, visdata and flags items are read without going through the SWIG wrappers
+Part of the CARMA data reduction pipeline
+Author: D. N. Friedel
+"""
+
+# record types in the visdata item
+VAR_SIZE = 0
+VAR_DATA = 1
+VAR_EOR = 2
+
+UV_ALIGN = 8        # every visdata record starts on an 8 byte boundary
+UV_HDR_SIZE = 4     # size of the header of each visdata record
+
+# on disk types of the uv variables
+TYPES = {"a" : "S1", "b" : ">i1", "j" : ">i2", "i" : ">i4", "l" : ">i8", "r" : ">f4", "d" : ">f8", "c" : ">c8"}
+SIZES = {"a" : 1, "b" : 1, "j" : 2, "i" : 4, "l" : 8, "r" : 4, "d" : 8, "c" : 8}
+
+def readVartable(file) :
+    """ Method to read the variable table of a uv data set
+        input :
+            file - the name of the uv data set
+        returns :
+            a list of the variable types and a list of the variable names (both in variable number order)
+    """
+    types = []
+    names = []
+    input = open(file + "/vartable")
+    for line in input.readlines() :
+        splitLine = line.split()
+        if(len(splitLine) != 2) :
+            continue
+        types.append(splitLine[0])
+        names.append(splitLine[1])
+    input.close()
+    return types,names
+
+def basant(baseline) :
+    """ Method to convert baseline numbers to antenna pairs, based on MIRIAD basant
+        input :
+            baseline - an array of baseline numbers
+        returns :
+            arrays of the first and second antenna numbers
+    """
+    baseline = numpy.asarray(baseline,dtype=numpy.int64)
+    big = baseline > 65536
+    ant1 = numpy.where(big,(baseline - 65536)/2048,baseline/256)
+    ant2 = numpy.where(big,(baseline - 65536) % 2048,baseline % 256)
+    return ant1,ant2
+
+class UVReader :
+    def __init__(self,file,data="corr",variables=[]) :
+        """ Initializer
+            file - the name of the uv data set
+            data - the data variable to read, corr (spectral channels) or wcorr (wide channels)
+            variables - list of any other uv variables whose current value should be returned with each record
+        """
+        self.file = file
+        self.data = data
+        self.variables = list(variables)
+        self.types,self.names = readVartable(file)
+        if(not data in self.names) :
+            raise Exception, "No %s variable in %s" % (data,file)
+        if(self.types[self.names.index(data)] == "j") :
+            raise Exception, "Scaled integer correlations in %s are not supported" % (file)
+        self.flagItem = file + "/flags"
+        if(data == "wcorr") :
+            self.flagItem = file + "/wflags"
+        self.sources = []       # source names, the source field of each record is an index into this list
+
+    def index(self,name) :
+        """ Method to get the variable number of a uv variable
+            input :
+                name - the name of the variable
+            returns :
+                the variable number, or -1 if the variable is not in the data set
+        """
+        if(name in self.names) :
+            return self.names.index(name)
+        return -1
+
+    def records(self,chunk=1024,withData=True) :
+        """ Generator which reads the data set and returns the records in fixed size chunks
+            each chunk is a numpy structured array with the fields
+                preamble - u,v,time,baseline
+                baseline - the baseline number
+                ant1,ant2 - the antennas of the baseline
+                time - the julian date
+                source - index into self.sources
+                pol - the polarization code
+                data - the complex64 visibilities
+                flags - the channel flags (True is good)
+            plus one field for each of the requested variables. All records in a chunk have the same
+            number of channels (a new chunk is started if the number of channels changes)
+            input :
+                chunk - the maximum number of records in each chunk
+                withData - whether to read the visibilities, if False the data field is left as zeros
+            returns :
+                yields the chunks in file order
+        """
+        handle = open(self.file + "/visdata","rb")
+        size = os.fstat(handle.fileno()).st_size
+        if(size == 0) :
+            handle.close()
+            return
+        buffer = mmap.mmap(handle.fileno(),0,access=mmap.ACCESS_READ)
+        raw = numpy.frombuffer(buffer,dtype=numpy.uint8)
+        nvar = len(self.names)
+        sizes = [SIZES[t] for t in self.types]
+        lengths = [0] * nvar
+        location = [-1] * nvar      # offset of the current value of each variable
+        dataVar = self.index(self.data)
+        sourceVar = self.index("source")
+        tracked = [self.index(v) for v in ["coord","time","baseline","pol"] + self.variables]
+        pending = []                # offsets of the tracked variables for each record in the current chunk
+        pendingShape = None
+        nchan = -1
+        flagOffset = 0
+        chunkFlagOffset = 0
+        sourceIndex = -1
+        offset = 0
+        try :
+            while(offset + UV_HDR_SIZE <= size) :
+                var = ord(buffer[offset])
+                kind = ord(buffer[offset + 2])
+                if(kind == VAR_SIZE) :
+                    lengths[var] = struct.unpack_from(">i",buffer,offset + UV_HDR_SIZE)[0]
+                    offset += UV_HDR_SIZE + 4
+                elif(kind == VAR_DATA) :
+                    offset += max(UV_HDR_SIZE,sizes[var])
+                    location[var] = offset
+                    if(var == sourceVar) :
+                        source = buffer[offset:offset + lengths[var]].rstrip("\0 ")
+                        if(not source in self.sources) :
+                            self.sources.append(source)
+                        sourceIndex = self.sources.index(source)
+                    offset += lengths[var]
+                elif(kind == VAR_EOR) :
+                    offset += UV_HDR_SIZE
+                    if(location[dataVar] >= 0) :
+                        n = lengths[dataVar] / 8
+                        shape = [lengths[v] if v >= 0 else 0 for v in tracked]
+                        if(len(pending) > 0 and (n != nchan or shape != pendingShape or len(pending) >= chunk)) :
+                            yield self._chunk(raw,pending,nchan,pendingShape,tracked,chunkFlagOffset,withData)
+                            pending = []
+                        if(len(pending) == 0) :
+                            nchan = n
+                            pendingShape = shape
+                            chunkFlagOffset = flagOffset
+                        pending.append([location[dataVar],sourceIndex] + [location[v] if v >= 0 else -1 for v in tracked])
+                        flagOffset += n
+                else :
+                    raise Exception, "Corrupt visdata item in %s at offset %i" % (self.file,offset)
+                offset = ((offset + UV_ALIGN - 1) / UV_ALIGN) * UV_ALIGN
+            if(len(pending) > 0) :
+                yield self._chunk(raw,pending,nchan,pendingShape,tracked,chunkFlagOffset,withData)
+        finally :
+            del raw
+            buffer.close()
+            handle.close()
+
+    def _chunk(self,raw,pending,nchan,shape,tracked,flagOffset,withData=True) :
+        """ Method to gather the records of a chunk into a structured array
+            input :
+                raw - the visdata item as a byte array
+                pending - the data/variable offsets of each record
+                nchan - the number of channels in each record
+                shape - the length (in bytes) of each tracked variable
+                tracked - the variable numbers of the tracked variables
+                flagOffset - the bit offset of the first record in the flags item
+                withData - whether to read the visibilities
+            returns :
+                the structured array
+        """
+        nrec = len(pending)
+        offsets = numpy.array(pending,dtype=numpy.int64)
+        fields = [("preamble",numpy.float64,(4,)),("baseline",numpy.int32),("ant1",numpy.int32),("ant2",numpy.int32),("time",numpy.float64),("source",numpy.int16),("pol",numpy.int16),("data",numpy.complex64,(nchan,)),("flags",numpy.bool_,(nchan,))]
+        extra = []
+        for i in range(0,len(self.variables)) :
+            v = tracked[i + 4]
+            if(v < 0) :
+                raise Exception, "No %s variable in %s" % (self.variables[i],self.file)
+            count = shape[i + 4] / SIZES[self.types[v]]
+            if(self.types[v] == "a") :
+                extra.append((self.variables[i],"S%i" % (max(1,shape[i + 4]))))
+            else :
+                extra.append((self.variables[i],numpy.dtype(TYPES[self.types[v]]).newbyteorder("="),(count,)))
+        records = numpy.zeros(nrec,dtype=fields + extra)
+        # the data, stored either as complex values or as pairs of reals
+        if(withData) :
+            values = self._gather(raw,offsets[:,0],8 * nchan)
+            if(self.types[self.index(self.data)] == "c") :
+                records["data"] = values.view(">c8").reshape(nrec,nchan)
+            else :
+                values = values.view(">f4").reshape(nrec,2 * nchan)
+                records["data"] = values[:,0::2] + 1j * values[:,1::2]
+        records["source"] = offsets[:,1]
+        coord = self._gather(raw,offsets[:,2],16).view(">f8").reshape(nrec,2)
+        time = self._gather(raw,offsets[:,3],8).view(">f8").reshape(nrec)
+        baseline = self._gather(raw,offsets[:,4],4).view(">f4").reshape(nrec)
+        records["preamble"][:,0:2] = coord
+        records["preamble"][:,2] = time
+        records["preamble"][:,3] = baseline
+        records["time"] = time
+        records["baseline"] = baseline.astype(numpy.int32)
+        records["ant1"],records["ant2"] = basant(records["baseline"])
+        if(tracked[3] >= 0 and (offsets[:,5] >= 0).all()) :
+            records["pol"] = self._gather(raw,offsets[:,5],4).view(">i4").reshape(nrec)
+        else :
+            records["pol"] = 1
+        for i in range(0,len(self.variables)) :
+            v = tracked[i + 4]
+            values = self._gather(raw,offsets[:,i + 6],shape[i + 4])
+            if(self.types[v] == "a") :
+                records[self.variables[i]] = values.view("S%i" % (max(1,shape[i + 4]))).reshape(nrec)
+            else :
+                records[self.variables[i]] = values.view(TYPES[self.types[v]]).reshape(nrec,-1)
+        if(os.path.exists(self.flagItem)) :
+            records["flags"] = mfunc.maskBits(self.flagItem,flagOffset,nrec * nchan).reshape(nrec,nchan)
+        else :
+            records["flags"] = True
+        return records
+
+    def _gather(self,raw,offsets,length) :
+        """ Method to gather a fixed length value for each record
+            input :
+                raw - the visdata item as a byte array
+                offsets - the offset of the value for each record (-1 if never set)
+                length - the length of the value in bytes
+            returns :
+                a 2D uint8 array (records,length), values that were never set are 0
+        """
+        values = numpy.zeros((len(offsets),max(0,length)),dtype=numpy.uint8)
+        if(length <= 0 or len(offsets) == 0) :
+            return values
+        steps = numpy.diff(offsets)
+        if(offsets[0] >= 0 and (steps > 0).all() and (steps == steps[0:1]).all()) :
+            # the records are evenly spaced, so the values are a strided view of the item
+            step = int(steps[0]) if len(steps) > 0 else length
+            values[:] = numpy.lib.stride_tricks.as_strided(raw[int(offsets[0]):],shape=values.shape,strides=(step,1))
+            return values
+        for i,offset in enumerate(offsets.tolist()) :
+            if(offset >= 0) :
+                values[i] = raw[offset:offset + length]
+        return values
+
+def amplitudeStatistics(file,sigma=3.0,chunk=1024) :
+    """ Method to calculate the amplitude statistics of each record of a uv data set in a single pass,
+        similar to uvlist options=stat. Only unflagged channels are used and records with no unflagged
+        channels are skipped
+        input :
+            file - the name of the uv data set
+            sigma - channels more than sigma*rms above the mean amplitude of their record are high channels
+            chunk - the number of records to read at once
+        returns :
+            a structured array with the baseline, ant1, ant2, time (hours), amp (mean amplitude), rms, peak
+            (channel with the largest amplitude, 1 based) and nhigh (number of high channels) of each record,
+            and a dictionary of the number of times each channel was high, keyed on baseline number
+    """
+    reader = UVReader(file)
+    fields = [("baseline",numpy.int32),("ant1",numpy.int32),("ant2",numpy.int32),("time",numpy.float64),("amp",numpy.float64),("rms",numpy.float64),("peak",numpy.int32),("nhigh",numpy.int32)]
+    parts = []
+    highChans = dict()
+    for records in reader.records(chunk) :
+        flags = records["flags"]
+        count = flags.sum(axis=1)
+        keep = count > 0
+        if(not keep.any()) :
+            continue
+        records = records[keep]
+        flags = flags[keep]
+        count = count[keep]
+        amps = numpy.abs(records["data"]).astype(numpy.float64)
+        mean = numpy.where(flags,amps,0.0).sum(axis=1)/count
+        deviation = numpy.where(flags,amps - mean[:,numpy.newaxis],0.0)
+        rms = numpy.sqrt((deviation**2).sum(axis=1)/numpy.maximum(count - 1,1))
+        high = flags & (deviation > sigma*rms[:,numpy.newaxis])
+        stats = numpy.zeros(len(records),dtype=fields)
+        stats["baseline"] = records["baseline"]
+        stats["ant1"] = records["ant1"]
+        stats["ant2"] = records["ant2"]
+        stats["time"] = calculations.julianToHours(records["time"])
+        stats["amp"] = mean
+        stats["rms"] = rms
+        stats["peak"] = numpy.argmax(numpy.where(flags,amps,-1.0),axis=1) + 1
+        stats["nhigh"] = high.sum(axis=1)
+        parts.append(stats)
+        # count the high channels of each baseline
+        baselines,index = numpy.unique(stats["baseline"],return_inverse=True)
+        counts = numpy.zeros((len(baselines),high.shape[1]),dtype=numpy.int64)
+        numpy.add.at(counts,index,high)
+        for i in range(0,len(baselines)) :
+            bl = int(baselines[i])
+            if(bl in highChans and len(highChans[bl]) == high.shape[1]) :
+                highChans[bl] += counts[i]
+            elif(bl in highChans) :
+                length = max(len(highChans[bl]),high.shape[1])
+                total = numpy.zeros(length,dtype=numpy.int64)
+                total[:len(highChans[bl])] += highChans[bl]
+                total[:high.shape[1]] += counts[i]
+                highChans[bl] = total
+            else :
+                highChans[bl] = counts[i]
+    if(len(parts) == 0) :
+        return numpy.zeros(0,dtype=fields),highChans
+    return numpy.concatenate(parts),highChans
@@ -1,6 +1,7 @@
 from pipeline_miriadwrap import *
-import calculations
 import math
+import numpy
+import uvReader
 
 """
 Python version of the MIRIAD task uvflux.
@@ -9,118 +10,186 @@ Released with pipeline version: 1.1
 Author: D. N. Friedel
 """
 
-def uvflux(file,start,step) :
-    """ Python port of MIRIAD task uvflux
+PolMin = -9
+PolMax = 4
+NPOLCODES = PolMax - PolMin + 1     # accumulators are indexed by polarization code - PolMin
+
+def averageChannels(records,start,step) :
+    """ Method to average a range of channels of each record, in the same way as uvread with
+        line=channel,1,start,step,step (only the good channels are averaged)
+        input :
+            records - the records from uvReader.UVReader.records
+            start - starting channel number
+            step - the number of channels to average
+        returns :
+            an array of the averaged data and an array of the flags (True where any channel was good)
+    """
+    data = records["data"][:,start - 1:start - 1 + step]
+    flags = records["flags"][:,start - 1:start - 1 + step]
+    count = flags.sum(axis=1)
+    average = numpy.where(flags,data,0.0).sum(axis=1) / numpy.maximum(count,1)
+    return average,count > 0
+
+def channelWindow(records,start,step) :
+    """ Method to find the spectral window of a range of channels and its frequency
+        input :
+            records - the records from uvReader.UVReader.records (with the nschan, sfreq and sdf variables)
+            start - starting channel number
+            step - the number of channels in the range
+        returns :
+            an array of the window index of each record and an array of the sky frequency (GHz) of the
+            center of the range
+    """
+    ends = numpy.cumsum(records["nschan"],axis=1)
+    window = numpy.minimum((ends < start).sum(axis=1),ends.shape[1] - 1)
+    rows = numpy.arange(len(records))
+    first = ends[rows,window] - records["nschan"][rows,window]
+    freq = records["sfreq"][rows,window] + (start - 1 - first + (step - 1)/2.0) * records["sdf"][rows,window]
+    return window,freq
+
+def variances(records,window,step) :
+    """ Method to calculate the theoretical variance of each record, as uvinfo(handle,"variance") does
+        (jyperk**2 * Tsys1 * Tsys2 / (2 * bandwidth * inttime))
+        input :
+            records - the records from uvReader.UVReader.records (with the jyperk, inttime, systemp and
+                      sdf variables)
+            window - array of the window index of each record
+            step - the number of channels averaged
+        returns :
+            an array of the variances (Jy**2)
+    """
+    nspect = records["sdf"].shape[1]
+    nants = records["systemp"].shape[1] / nspect
+    rows = numpy.arange(len(records))
+    ant1 = numpy.clip(records["ant1"] - 1,0,nants - 1)
+    ant2 = numpy.clip(records["ant2"] - 1,0,nants - 1)
+    tsys1 = records["systemp"][rows,window*nants + ant1].astype(numpy.float64)
+    tsys2 = records["systemp"][rows,window*nants + ant2].astype(numpy.float64)
+    bandwidth = numpy.abs(records["sdf"][rows,window]) * step * 1.0e9
+    inttime = records["inttime"][:,0].astype(numpy.float64)
+    jyperk = records["jyperk"][:,0].astype(numpy.float64)
+    with numpy.errstate(divide="ignore",invalid="ignore") :
+        variance = jyperk**2 * numpy.abs(tsys1*tsys2) / (2.0 * bandwidth * inttime)
+    return numpy.where(numpy.isfinite(variance),variance,0.0)
+
+def fluxes(file,start,step,uvBins=None,chunk=1024) :
+    """ Method to calculate the vector and scalar averages of a range of channels for each source and
+        polarization, optionally also as a function of uv distance, in a single pass
         input :
             file - the name of the file to operate on
             start - starting channel number
             step - step size (in channels)
+            uvBins - list of the edges of the uv distance bins (in kilolambda), None for no bins
+            chunk - the number of records to read at once
+        returns :
+            the list of results (see uvflux) and, for each entry in the list, the amplitude versus uv distance
+            curve as a list of [low edge,high edge,vector amplitude,scalar amplitude,number of points] of
+            each bin (an empty list if there are no bins)
     """
-    doshift = False
-    uvflags = "sdlcef"
-    handle = uvopen(file,"old")
-    uvset(handle,"data","channel",1,float(start),float(step),float(step))
-    PolIndx = [0] * 14
-    sources = ["  "] * 14
-    isrc = -1
-    nsrc = 0
-    npol = 0
-    fluxr = []
-    fluxi = []
-    amp = []
-    amp2 = []
-    rms2 = []
-    ncnt = []
-    PolMin = -9
-    PolMax = 4
-    for i in range(0,MAXPOL) :
-        temp = [0.0] * MAXSRC
-        fluxr.append(temp)
-        temp = [0.0] * MAXSRC
-        fluxi.append(temp)
-        temp = [0.0] * MAXSRC
-        amp.append(temp)
-        temp = [0.0] * MAXSRC
-        amp2.append(temp)
-        temp = [0.0] * MAXSRC
-        rms2.append(temp)
-        temp = [0] * MAXSRC
-        ncnt.append(temp)
-    preamble,data,flags = uvread(handle)
-    ipol = -20
-    while(len(flags) > 0) :
-        ipol = uvrdvri(handle,"pol",1)
-        if(PolIndx[ipol] == 0) :
-            npol += 1
-            PolIndx[ipol] = npol
-        ipol = PolIndx[ipol]
-        t,l,update = uvprobvr(handle,"source")
-        if(update) :
-            source = uvgetvra(handle,"source")
-            found = False
-            if(isrc >= 0) :
-                found = source == sources[isrc]
-            if(not found) :
-                if(source in sources) :
-                    isrc = sources.index(source)
-                    found = True
-            if(not found) :
-                nsrc += 1
-                sources[nsrc - 1] = source
-                for i in range(0,MAXPOL) :
-                    fluxr[i][nsrc] = 0.0
-                    fluxi[i][nsrc] = 0.0
-                    amp[i][nsrc]  = 0.0
-                    amp2[i][nsrc] = 0.0
-                    rms2[i][nsrc] = 0.0
-                    ncnt[i][nsrc] = 0
-                isrc = nsrc-1
-        sig2 = uvinfo(handle,"variance")[0]
-        for i in range(0,len(flags)) :
-            if(flags[i]) :
-                fluxr[ipol][isrc] += data[i].real
-                fluxi[ipol][isrc] += data[i].imag
-                rms2[ipol][isrc] += sig2
-                temp = calculations.cabs(data[i])
-                amp[ipol][isrc]  += temp
-                amp2[ipol][isrc] += temp*temp
-                ncnt[ipol][isrc] += 1
-        preamble,data,flags = uvread(handle)
-    uvclose(handle)
+    names = uvReader.readVartable(file)[1]
+    variance = ["jyperk","inttime","systemp"]
+    frequency = ["nschan","sfreq","sdf"]
+    variables = [v for v in frequency + variance if v in names]
+    doVariance = all([v in variables for v in frequency + variance])
+    doBins = uvBins is not None and len(uvBins) > 1
+    if(doBins and not all([v in variables for v in frequency])) :
+        raise Exception, "No frequency information in %s, cannot bin by uv distance" % (file)
+    nbins = 1
+    if(doBins) :
+        uvBins = numpy.asarray(uvBins,dtype=numpy.float64)
+        nbins = len(uvBins) - 1
+    reader = uvReader.UVReader(file,variables=variables)
+    # accumulators (source,polarization,bin), the last bin is used for the totals
+    shape = (0,NPOLCODES,nbins + 1)
+    sums = dict()
+    for name in ["fluxr","fluxi","amp","amp2","rms2"] :
+        sums[name] = numpy.zeros(shape)
+    ncnt = numpy.zeros(shape,dtype=numpy.int64)
+    for records in reader.records(chunk) :
+        if(records["data"].shape[1] < start) :
+            continue
+        data,good = averageChannels(records,start,step)
+        if(not good.any()) :
+            continue
+        # grow the accumulators as new sources are found
+        if(len(reader.sources) > ncnt.shape[0]) :
+            extra = numpy.zeros((len(reader.sources) - ncnt.shape[0],NPOLCODES,nbins + 1))
+            for name in sums :
+                sums[name] = numpy.concatenate((sums[name],extra))
+            ncnt = numpy.concatenate((ncnt,extra.astype(numpy.int64)))
+        sig2 = numpy.zeros(len(records))
+        if(doVariance or doBins) :
+            window,freq = channelWindow(records,start,step)
+        if(doVariance) :
+            sig2 = variances(records,window,step)
+        records = records[good]
+        data = data[good]
+        sig2 = sig2[good]
+        src = records["source"].astype(numpy.int64)
+        pol = records["pol"].astype(numpy.int64) - PolMin
+        amp = numpy.abs(data).astype(numpy.float64)
+        # each record goes into the totals and into its uv distance bin
+        keys = [[(src,pol,numpy.zeros(len(records),dtype=numpy.int64) + nbins),slice(None)]]
+        if(doBins) :
+            uvdist = numpy.hypot(records["preamble"][:,0],records["preamble"][:,1]) * freq[good] / 1000.0
+            bins = numpy.searchsorted(uvBins,uvdist,side="right") - 1
+            inside = (bins >= 0) & (bins < nbins)
+            keys.append([(src[inside],pol[inside],bins[inside]),inside])
+        for key,select in keys :
+            numpy.add.at(sums["fluxr"],key,data.real[select])
+            numpy.add.at(sums["fluxi"],key,data.imag[select])
+            numpy.add.at(sums["amp"],key,amp[select])
+            numpy.add.at(sums["amp2"],key,amp[select]**2)
+            numpy.add.at(sums["rms2"],key,sig2[select])
+            numpy.add.at(ncnt,key,1)
+    # order the polarizations as uvflux does
     npol = 0
-    p = [0] * MAXPOL
-    pp = [0] * MAXPOL
+    p = []
     for j in range(PolMin,PolMax+1) :
-        if(PolIndx[j] > 0) :
-            p[npol] = j
-            pp[npol] = PolIndx[j]
+        if(ncnt[:,j - PolMin,nbins].sum() > 0) :
+            p.append(j)
             npol = npol + 1
             for i in range(npol-1,1,-1) :
-                print i
                 if(abs(p[i]) < abs(p[i-1])) :
-                    t = p[i]
-                    p[i] = p[i-1]
-                    p[i-1] = t
-                    t = pp[i]
-                    pp[i] = pp[i-1]
-                    pp[i-1] = t
-    PolCode = "--"
+                    p[i],p[i-1] = p[i-1],p[i]
     retVal = []
-    for isrc in range(0,nsrc) :
-        source = sources[isrc]
-        for i in range(0,npol) :
-            ipol = pp[i]
-            if(ncnt[ipol][isrc] > 0) :
-                PolCode = polsc2p(p[i])
-                fluxr[ipol][isrc] /= ncnt[ipol][isrc]
-                fluxi[ipol][isrc] /= ncnt[ipol][isrc]
-                vecaver  = complex(fluxr[ipol][isrc],fluxi[ipol][isrc])
-                vecscat  = amp2[ipol][isrc] / (2*ncnt[ipol][isrc])- 0.5*(fluxr[ipol][isrc]**2+fluxi[ipol][isrc]**2)
+    curves = []
+    for isrc in range(0,ncnt.shape[0]) :
+        source = reader.sources[isrc]
+        for code in p :
+            ipol = code - PolMin
+            n = ncnt[isrc,ipol,nbins]
+            if(n > 0) :
+                PolCode = polsc2p(code)
+                fluxr = sums["fluxr"][isrc,ipol,nbins] / n
+                fluxi = sums["fluxi"][isrc,ipol,nbins] / n
+                vecscat = sums["amp2"][isrc,ipol,nbins] / (2*n) - 0.5*(fluxr**2 + fluxi**2)
                 vecscat = math.sqrt(abs(vecscat))
-                vecamp,vecpha = amphase(vecaver)
-                scalamp = amp[ipol][isrc] / ncnt[ipol][isrc]
-                scalscat = amp2[ipol][isrc] / ncnt[ipol][isrc]- (amp[ipol][isrc] / ncnt[ipol][isrc])**2
+                scalamp = sums["amp"][isrc,ipol,nbins] / n
+                scalscat = sums["amp2"][isrc,ipol,nbins] / n - scalamp**2
                 scalscat = math.sqrt(abs(scalscat))
-                sig2 = math.sqrt(rms2[ipol][isrc]/ncnt[ipol][isrc])
-                retVal.append([source,PolCode,sig2,complex(fluxr[ipol][isrc],fluxi[ipol][isrc]),vecscat,scalamp,scalscat,ncnt[ipol][isrc]])
-    return retVal
+                sig2 = math.sqrt(sums["rms2"][isrc,ipol,nbins] / n)
+                retVal.append([source,PolCode,sig2,complex(fluxr,fluxi),vecscat,scalamp,scalscat,int(n)])
+                curve = []
+                for b in range(0,nbins if doBins else 0) :
+                    count = ncnt[isrc,ipol,b]
+                    vecamp = 0.0
+                    scalar = 0.0
+                    if(count > 0) :
+                        vecamp = abs(complex(sums["fluxr"][isrc,ipol,b],sums["fluxi"][isrc,ipol,b])) / count
+                        scalar = sums["amp"][isrc,ipol,b] / count
+                    curve.append([uvBins[b],uvBins[b + 1],vecamp,scalar,int(count)])
+                curves.append(curve)
+    return retVal,curves
+
+def uvflux(file,start,step) :
+    """ Python port of MIRIAD task uvflux
+        input :
+            file - the name of the file to operate on
+            start - starting channel number
+            step - step size (in channels)
+        returns :
+            a list of [source,polarization,rms,vector average,vector scatter,scalar average,scalar scatter,
+            number of points] for each source and polarization
+    """
+    return fluxes(file,start,step)[0]